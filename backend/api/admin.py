@@ -1,9 +1,12 @@
 from django.contrib import admin
-from .models import Customer, Product, Order, OrderItem, CartItem, Review
+from .models import Customer, Product, Order, OrderItem, CartItem, Review, CatalogImport, Task, IdempotencyKey
 
 admin.site.register(Customer)
 admin.site.register(Product)
 admin.site.register(Order)
 admin.site.register(OrderItem)
 admin.site.register(CartItem)
-admin.site.register(Review)
\ No newline at end of file
+admin.site.register(Review)
+admin.site.register(CatalogImport)
+admin.site.register(Task)
+admin.site.register(IdempotencyKey)
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_safe
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from .cache import CATALOG, cache_response, product_scope
+from .catalog import categories, filtered_products
+from .models import Product, Review
+from .pagination import KeysetPagination
+from .serializers import ProductSerializer, ProductSummarySerializer, ReviewSerializer, fieldset_context
+
+# Async versions of the read-only catalog views, for deployments served by
+# an ASGI server (backend.asgi). They return the same bytes as their
+# counterparts in api.views; independent queries are issued together with
+# asyncio.gather instead of one after another. They are not routed to the
+# read replicas (api.replicas): their queries go to the primary.
+
+
+def render(request, data, status_code=status.HTTP_200_OK):
+    started = time.perf_counter()
+    content = JSONRenderer().render(data)
+    request._metrics_render_time = time.perf_counter() - started
+    return HttpResponse(content, status=status_code, content_type='application/json')
+
+
+def error(request, exc):
+    return render(request, {'detail': exc.detail}, exc.status_code)
+
+
+async def fetch_all(queryset):
+    return [obj async for obj in queryset]
+
+
+def reviews_for(product_pk):
+    return Review.objects.select_related('customer__user').filter(product_id=product_pk)
+
+
+async def paginated(request, queryset, serializer_class, ordering=('id', False)):
+    paginator = KeysetPagination(ordering=ordering)
+    try:
+        page = await paginator.apaginate_queryset(queryset, request)
+    except APIException as exc:
+        return error(request, exc)
+    serializer = serializer_class(page, many=True, context=fieldset_context(request.GET))
+    return render(request, paginator.get_paginated_data(serializer.data))
+
+
+@cache_response(lambda pk: [product_scope(pk)])
+@require_safe
+async def product_detail(request, pk):
+    context = fieldset_context(request.GET)
+    try:
+        if 'reviews' not in context['expand']:
+            product = await Product.objects.aget(pk=pk)
+        else:
+            product, reviews = await asyncio.gather(Product.objects.aget(pk=pk), fetch_all(reviews_for(pk)))
+            # Hand the reviews to the serializer the way prefetch_related would
+            prefetched = product.reviews.all()
+            prefetched._result_cache = reviews
+            prefetched._prefetch_done = True
+            product._prefetched_objects_cache = {'reviews': prefetched}
+    except Product.DoesNotExist:
+        return render(request, {'detail': 'Product not found'}, status.HTTP_404_NOT_FOUND)
+    return render(request, ProductSerializer(product, context=context).data)
+
+
+@cache_response(lambda: [CATALOG])
+@require_safe
+async def list_products(request):
+    products = Product.objects.for_serializer(fieldset_context(request.GET)['expand'])
+    return await paginated(request, products, ProductSummarySerializer)
+
+
+@cache_response(lambda: [CATALOG])
+@require_safe
+async def filter_products(request):
+    try:
+        products, ordering = filtered_products(request.GET, fieldset_context(request.GET)['expand'])
+    except ValueError as e:
+        return render(request, {'detail': str(e)}, status.HTTP_400_BAD_REQUEST)
+    return await paginated(request, products, ProductSummarySerializer, ordering)
+
+
+@cache_response(lambda: [CATALOG])
+@require_safe
+async def list_categories(request):
+    return JsonResponse(await fetch_all(categories()), safe=False)
+
+
+@cache_response(lambda pk: [product_scope(pk)])
+@require_safe
+async def product_reviews(request, pk):
+    exists, response = await asyncio.gather(
+        Product.objects.filter(pk=pk).aexists(), paginated(request, reviews_for(pk), ReviewSerializer)
+    )
+    if not exists:
+        return render(request, {'detail': 'Product not found'}, status.HTTP_404_NOT_FOUND)
+    return response
@@ -0,0 +1,148 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+from .models import Customer
+from .revocations import is_revoked, revocations
+
+# Token authentication that resolves the user and their customer together.
+# Tokens carry the customer id (CUSTOMER_ID_CLAIM), and resolved users are
+# kept in process for AUTH_USER_CACHE_TTL seconds, so a request from a
+# recent user costs no query and views read request.user.customer.
+#
+# Saving or deleting a User or Customer drops it from this process's cache
+# (api.signals, forget_on_commit); other processes see the change when
+# their entry expires. QuerySet.update() sends no signals, so call forget()
+# after one.
+
+CUSTOMER_ID_CLAIM = 'customer_id'
+
+# user id -> (expires at, user, customer or None), least recently used first
+_users = OrderedDict()
+_lock = threading.Lock()
+
+
+class RefreshToken(tokens.RefreshToken):
+    # Looked up through the revocation filter (api.revocations), and never
+    # blacklisted twice, so a rotated token cannot be refreshed again even
+    # before this process's filter has seen it revoked
+    def check_blacklist(self):
+        if is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError('Token is blacklisted')
+
+    def blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        with transaction.atomic():
+            token, _ = OutstandingToken.objects.get_or_create(jti=jti, defaults={
+                'token': str(self), 'expires_at': datetime_from_epoch(self.payload['exp']),
+            })
+            blacklisted, created = BlacklistedToken.objects.get_or_create(token=token)
+        if not created:
+            raise TokenError('Token is blacklisted')
+        revocations.add(jti)
+        return blacklisted, created
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+
+def tokens_for(user):
+    """A refresh token for user with the customer id claim; its access_token carries the claim too."""
+    refresh = RefreshToken.for_user(user)
+    try:
+        refresh[CUSTOMER_ID_CLAIM] = user.customer.pk
+    except Customer.DoesNotExist:
+        refresh[CUSTOMER_ID_CLAIM] = None
+    return refresh
+
+
+def forget(user_id):
+    with _lock:
+        _users.pop(user_id, None)
+
+
+def forget_on_commit(user_id):
+    # Again after commit: a request in between may have cached the old row
+    forget(user_id)
+    transaction.on_commit(lambda: forget(user_id))
+
+
+def clear():
+    with _lock:
+        _users.clear()
+
+
+def remember(user, customer):
+    if not settings.AUTH_USER_CACHE_TTL:
+        return
+    with _lock:
+        _users[user.pk] = (time.monotonic() + settings.AUTH_USER_CACHE_TTL, user, customer)
+        _users.move_to_end(user.pk)
+        while len(_users) > settings.AUTH_USER_CACHE_SIZE:
+            _users.popitem(last=False)
+
+
+def cached(user_id):
+    with _lock:
+        entry = _users.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _users[user_id]
+            return None
+        _users.move_to_end(user_id)
+    return entry[1], entry[2]
+
+
+def load(user_id, customer_id):
+    """The user and their customer (None if they have none) from one query."""
+    if customer_id is not None:
+        customer = Customer.objects.select_related('user').filter(pk=customer_id, user_id=user_id).first()
+        if customer is not None:
+            return customer.user, customer
+    user = User.objects.select_related('customer').get(pk=user_id)
+    try:
+        return user, user.customer
+    except Customer.DoesNotExist:
+        return user, None
+
+
+def attach(user, customer):
+    # Every request gets its own instances: views may change and save them
+    user = copy.copy(user)
+    if customer is None:
+        User.customer.related.set_cached_value(user, None)
+    else:
+        user.customer = copy.copy(customer)
+    return user
+
+
+class CustomerJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        entry = cached(user_id)
+        if entry is None:
+            try:
+                entry = load(user_id, validated_token.get(CUSTOMER_ID_CLAIM))
+            except User.DoesNotExist:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            remember(*entry)
+        user = attach(*entry)
+
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
@@ -0,0 +1,163 @@
+import contextlib
+import random
+import statistics
+import time
+from io import BytesIO
+from urllib.parse import urlsplit
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from . import search
+from .models import CartItem, Customer, Order, OrderItem, Product, Review
+
+# Shared helpers for the benchmark_* management commands. Benchmarks run
+# against a throwaway test database (in-memory for SQLite) so they never
+# touch real data.
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'te', 'vo', 'zu', 'bel', 'dor', 'fin', 'gar', 'hul', 'jen', 'mar', 'nox', 'pol']
+CATEGORIES = [f'Category {i}' for i in range(20)]
+
+
+@contextlib.contextmanager
+def benchmark_database(verbosity=0, name=None):
+    """Run against a fresh test database; name puts a SQLite one in a file instead of memory."""
+    old_name, old_test_name = connection.settings_dict['NAME'], connection.settings_dict['TEST']['NAME']
+    if name:
+        connection.settings_dict['TEST']['NAME'] = name
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        connection.settings_dict['TEST']['NAME'] = old_test_name
+
+
+def wsgi_request(application, url):
+    parts = urlsplit(url)
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': parts.path, 'QUERY_STRING': parts.query,
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(), 'wsgi.errors': BytesIO(),
+    }
+    statuses = []
+    result = application(environ, lambda status, headers: statuses.append(int(status[:3])))
+    try:
+        b''.join(result)
+    finally:
+        result.close()
+    return statuses[0]
+
+
+def vocabulary(size=2000, seed=0):
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def seed_products(count, start=0, batch_size=5000, seed=0):
+    rng = random.Random(seed + start)
+    words = vocabulary()
+    # Zipf-like word frequencies so some terms are common and most are rare
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    for offset in range(start, start + count, batch_size):
+        Product.objects.bulk_create([
+            Product(
+                name=' '.join(rng.choices(words, weights, k=rng.randint(2, 4))).title(),
+                description=' '.join(rng.choices(words, weights, k=rng.randint(8, 15))),
+                price=f'{rng.randint(1, 500)}.{rng.randint(0, 99):02d}',
+                category=rng.choice(CATEGORIES),
+                image='product_images/Sample_Image.jpg',
+                inventory_quantity=rng.randint(0, 200),
+            )
+            for _ in range(min(batch_size, start + count - offset))
+        ])
+    # bulk_create skips the post_save receivers that maintain the index
+    search.rebuild_index()
+
+
+def seed_customers(count, start=0, password='benchmark-pass'):
+    # Hash once and share it: seeding should not spend minutes in PBKDF2
+    hashed = make_password(password)
+    users = User.objects.bulk_create([
+        User(username=f'bench-{i}', email=f'bench-{i}@example.com', password=hashed)
+        for i in range(start, start + count)
+    ])
+    return Customer.objects.bulk_create([
+        Customer(user=user, shipping_address='1 Benchmark Way', billing_address='1 Benchmark Way')
+        for user in users
+    ])
+
+
+def seed_dataset(products, customers, reviews, carts, orders, seed=0):
+    """
+    Fill the database with a synthetic storefront: products, customers,
+    ``reviews`` distinct (customer, product) reviews, ``carts`` customers
+    with 1-5 cart lines, and ``orders`` orders of 1-5 lines each.
+    """
+    rng = random.Random(seed)
+    seed_products(products, seed=seed)
+    product_rows = list(Product.objects.values_list('pk', 'price'))
+    customer_rows = seed_customers(customers)
+
+    pairs = set()
+    reviews = min(reviews, len(product_rows) * len(customer_rows))
+    while len(pairs) < reviews:
+        pairs.add((rng.choice(customer_rows).pk, rng.choice(product_rows)[0]))
+    Review.objects.bulk_create(
+        [Review(customer_id=c, product_id=p, rating=rng.randint(1, 5), review='Synthetic review') for c, p in pairs],
+        batch_size=5000,
+    )
+    Product.objects.rebuild_rating_stats()
+
+    CartItem.objects.bulk_create([
+        CartItem(customer=customer, product_id=product_id, quantity=rng.randint(1, 3))
+        for customer in rng.sample(customer_rows, min(carts, len(customer_rows)))
+        for product_id, _ in rng.sample(product_rows, min(rng.randint(1, 5), len(product_rows)))
+    ])
+
+    for offset in range(0, orders, 1000):
+        lines = []
+        batch = []
+        for _ in range(min(1000, orders - offset)):
+            items = rng.sample(product_rows, min(rng.randint(1, 5), len(product_rows)))
+            quantities = [rng.randint(1, 3) for _ in items]
+            lines.append(list(zip(items, quantities)))
+            batch.append(Order(
+                customer=rng.choice(customer_rows),
+                total_price=sum(price * quantity for (_, price), quantity in zip(items, quantities)),
+                shipping_address='1 Benchmark Way',
+                billing_address='1 Benchmark Way',
+                status='Approved',
+            ))
+        Order.objects.bulk_create(batch)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=product_id, quantity=quantity)
+            for order, order_lines in zip(batch, lines)
+            for (product_id, _), quantity in order_lines
+        ])
+
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 3),
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+    }
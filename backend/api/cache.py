@@ -0,0 +1,178 @@
+import functools
+import hashlib
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+# Response cache for the anonymous, read-mostly catalog endpoints.
+#
+# Cached entries are keyed on version counters rather than deleted on
+# writes: 'catalog' covers anything listing several products, and
+# 'product:<id>' covers one product's detail and reviews. A write bumps the
+# relevant counters (see api.signals and api.checkout) so stale entries are
+# never read again and age out of the bounded backend on their own.
+#
+# With read replicas, a view run just after a write may read a replica that
+# has not caught up, and its response would be cached under the new
+# versions. So a write also marks its scopes as changed for
+# REPLICA_MAX_LAG_SECONDS, and responses for a marked scope are neither
+# stored nor given an ETag.
+
+CATALOG = 'catalog'
+
+_stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'invalidations': 0}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def product_scope(pk):
+    return f'product:{pk}'
+
+
+def record(stat, count=1):
+    with _stats_lock:
+        _stats[stat] += count
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_stats():
+    with _stats_lock:
+        for stat in _stats:
+            _stats[stat] = 0
+
+
+def get_versions(scopes):
+    cache = get_cache()
+    keys = [f'version:{scope}' for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Seed from the clock, not 1: if the counter was evicted, entries
+            # cached under its old value must not become reachable again.
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*scopes):
+    cache = get_cache()
+    for scope in scopes:
+        key = f'version:{scope}'
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+    if settings.DATABASE_REPLICAS:
+        cache.set_many({f'changed:{scope}': True for scope in scopes}, settings.REPLICA_MAX_LAG_SECONDS)
+    record('invalidations', len(scopes))
+
+
+def invalidate_products(product_ids):
+    invalidate(CATALOG, *[product_scope(pk) for pk in product_ids])
+
+
+def invalidate_products_on_commit(product_ids):
+    transaction.on_commit(lambda: invalidate_products(product_ids))
+
+
+def lookup(request, scopes):
+    """
+    Return the request's digest under the current scope versions and, when
+    it can be answered without the view, the 304 or cached response.
+    """
+    versions = get_versions(scopes)
+    fingerprint = '|'.join([
+        request.get_host(), request.get_full_path(), request.META.get('HTTP_ACCEPT', ''), *map(str, versions)
+    ])
+    digest = hashlib.sha1(fingerprint.encode()).hexdigest()
+    etag = f'"{digest}"'
+
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        record('not_modified')
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return digest, response
+
+    entry = get_cache().get(f'response:{digest}')
+    if entry is None:
+        record('misses')
+        return digest, None
+    record('hits')
+    content, content_type = entry
+    return digest, HttpResponse(content, content_type=content_type)
+
+
+def store(digest, response, scopes):
+    # Browsable API pages and errors are not cached
+    if response.status_code != 200 or not response['Content-Type'].startswith('application/json'):
+        return False
+    # Nor what a lagging replica may have answered (see above)
+    if settings.DATABASE_REPLICAS and get_cache().get_many([f'changed:{scope}' for scope in scopes]):
+        return False
+    entry = (response.content, response['Content-Type'])
+    get_cache().set(f'response:{digest}', entry, settings.CATALOG_CACHE_TIMEOUT)
+    return True
+
+
+def finalize(digest, response):
+    response['ETag'] = f'"{digest}"'
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def cache_response(scopes):
+    """
+    Cache successful JSON GET responses of a view under the given version
+    scopes, a callable receiving the view's URL kwargs. Responses carry an
+    ETag derived from the versions, so clients revalidating with
+    If-None-Match get a 304 without the view or the cache entry being read.
+    Works on both sync and async views; the latter do their cache I/O in a
+    worker thread since the cache backends are blocking.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method != 'GET' or not settings.CATALOG_CACHE_ENABLED:
+                    return await view(request, *args, **kwargs)
+
+                view_scopes = scopes(**kwargs)
+                digest, response = await sync_to_async(lookup, thread_sensitive=False)(request, view_scopes)
+                if response is not None:
+                    return response if response.status_code == 304 else finalize(digest, response)
+                response = await view(request, *args, **kwargs)
+                if not await sync_to_async(store, thread_sensitive=False)(digest, response, view_scopes):
+                    return response
+                return finalize(digest, response)
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or not settings.CATALOG_CACHE_ENABLED:
+                return view(request, *args, **kwargs)
+
+            view_scopes = scopes(**kwargs)
+            digest, response = lookup(request, view_scopes)
+            if response is not None:
+                return response if response.status_code == 304 else finalize(digest, response)
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            if not store(digest, response, view_scopes):
+                return response
+            return finalize(digest, response)
+        return wrapper
+    return decorator
@@ -0,0 +1,110 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from . import fast_serializers, reservations
+from .models import CartItem, Product
+
+# Cart writes and the cart summary. Every write keeps the stock holds of
+# api.reservations in step with the cart lines.
+
+PRODUCT_FIELDS = [f'product__{field}' for field in fast_serializers.PRODUCT_FIELDS]
+
+
+def add(customer, product_id, quantity):
+    """
+    Add quantity units of a product to the customer's cart and hold them.
+    Returns the line's pk. Raises InsufficientStock, or Product.DoesNotExist
+    if there is no such product.
+    """
+    with transaction.atomic():
+        reservations.hold(product_id, quantity)
+        expiry = reservations.hold_expiry()
+        line, created = CartItem.objects.get_or_create(customer=customer, product_id=product_id, defaults={
+            'quantity': quantity, 'reserved_quantity': quantity, 'reserved_until': expiry,
+        })
+        # Increment in the database: concurrent adds to one line both count
+        if not created:
+            CartItem.objects.filter(pk=line.pk).update(
+                quantity=F('quantity') + quantity, reserved_quantity=F('reserved_quantity') + quantity, reserved_until=expiry,
+            )
+    return line.pk
+
+
+def apply_changes(customer, changes):
+    """
+    Set the quantities of many cart lines in one transaction, creating the
+    missing lines. changes maps product ids to quantities, and 0 removes the line.
+    Raises InsufficientStock or Product.DoesNotExist, in which case nothing
+    is written.
+    """
+    with transaction.atomic():
+        def locked_lines():
+            lines = CartItem.objects.select_for_update().filter(customer=customer, product_id__in=changes)
+            return {line.product_id: line for line in lines}
+
+        lines = locked_lines()
+        missing = [product_id for product_id, quantity in changes.items() if quantity and product_id not in lines]
+        if missing:
+            found = set(Product.objects.filter(pk__in=missing).values_list('pk', flat=True))
+            if len(found) != len(missing):
+                raise Product.DoesNotExist(f'Product {min(set(missing) - found)} not found.')
+            # Lines added concurrently are kept and picked up by the second read
+            CartItem.objects.bulk_create([
+                CartItem(customer=customer, product_id=product_id, quantity=0) for product_id in missing
+            ], ignore_conflicts=True)
+            lines = locked_lines()
+
+        removed = [line for product_id, line in lines.items() if not changes[product_id]]
+        if removed:
+            reservations.release(removed)
+            CartItem.objects.filter(pk__in=[line.pk for line in removed]).delete()
+        kept = [line for product_id, line in lines.items() if changes[product_id]]
+        reservations.reserve_many(kept, {line.pk: changes[line.product_id] for line in kept})
+
+
+def summary(user):
+    """
+    The user's cart with line totals, subtotal, item count and the lines
+    their stock no longer covers, from one query.
+    """
+    rows = (
+        CartItem.objects.filter(customer__user=user).order_by('pk')
+        # What this line could have: the stock nobody else holds
+        .annotate(available=Greatest(
+            F('product__inventory_quantity') - F('product__reserved_quantity') + F('reserved_quantity'), Value(0)
+        ))
+        .values('id', 'quantity', 'reserved_quantity', 'reserved_until', 'available', *PRODUCT_FIELDS)
+    )
+    lines, warnings, subtotal = [], [], Decimal('0')
+    for row in rows:
+        product = fast_serializers.product_summary({
+            field: row[f'product__{field}'] for field in fast_serializers.PRODUCT_FIELDS
+        })
+        line_total = row['product__price'] * row['quantity']
+        subtotal += line_total
+        lines.append({
+            'id': row['id'],
+            'product': product,
+            'quantity': row['quantity'],
+            'line_total': fast_serializers.money(line_total),
+            'available': row['available'],
+            'reserved_quantity': row['reserved_quantity'],
+            'reserved_until': row['reserved_until'] and fast_serializers.datetime(row['reserved_until']),
+        })
+        if row['quantity'] > row['available']:
+            warnings.append({
+                'line': row['id'],
+                'product': product['id'],
+                'quantity': row['quantity'],
+                'available': row['available'],
+                'detail': f"Only {row['available']} of {product['name']} available."
+                if row['available'] else f"{product['name']} is out of stock.",
+            })
+    return {
+        'lines': lines,
+        'line_count': len(lines),
+        'item_count': sum(line['quantity'] for line in lines),
+        'subtotal': fast_serializers.money(subtotal),
+        'warnings': warnings,
+    }
@@ -0,0 +1,130 @@
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from django.db.models import BooleanField, Case, Count, Q, Value, When
+from django.db.models.functions import Lower
+from .models import Product
+from .pagination import PRODUCT_ORDERINGS
+from .search import search_products
+
+# Catalog queries shared by the sync views and their async variants.
+
+
+# Facet buckets: prices in [edge, next edge), the last one open-ended, and
+# the min_rating thresholds offered
+PRICE_BUCKETS = [0, 10, 25, 50, 100, 250, 500]
+RATING_THRESHOLDS = [4, 3, 2, 1]
+
+
+def price_filter(params):
+    """min_price (inclusive) and max_price (exclusive), so a facet bucket's edges select exactly its products."""
+    condition = Q()
+    for name, lookup in (('min_price', 'price__gte'), ('max_price', 'price__lt')):
+        if params.get(name):
+            try:
+                value = Decimal(params[name])
+            except InvalidOperation:
+                value = None
+            if value is None or not value.is_finite():
+                raise ValueError(f'{name} must be a number.')
+            condition &= Q(**{lookup: value})
+    return condition
+
+
+def rating_filter(params):
+    min_rating = params.get('min_rating')
+    if not min_rating:
+        return Q()
+    try:
+        return Q(review_count__gt=0, average_rating__gte=float(min_rating))
+    except ValueError:
+        raise ValueError('min_rating must be a number.')
+
+
+def filtered_products(params, expand=()):
+    """
+    Build the filter_products queryset from its query parameters. Returns
+    the queryset and its keyset ordering; raises ValueError for a
+    malformed min_rating, min_price or max_price.
+    """
+    category = params.get('category')
+    search = params.get('search')
+    sort_by = params.get('sort_by')
+
+    products = Product.objects.for_serializer(expand)
+
+    if category:
+        products = products.filter(category=category)
+    products = products.filter(price_filter(params), rating_filter(params))
+    if search:
+        products = search_products(products, search)
+
+    # Search results default to relevance order
+    ordering = PRODUCT_ORDERINGS.get(sort_by, ('search_rank', False) if search else ('id', False))
+    if ordering[0] == 'name_lower':
+        products = products.annotate(name_lower=Lower('name'))
+    return products, ordering
+
+
+def matches(condition):
+    if not condition:
+        return Value(True)
+    return Case(When(condition, then=Value(True)), default=Value(False), output_field=BooleanField())
+
+
+def facets(params):
+    """
+    Product counts by category, price bucket and min_rating threshold for
+    the filter_products parameters, from one GROUP BY query. Each facet
+    ignores its own filter (the category counts cover every category) and
+    applies the others; total applies them all. Raises ValueError like
+    filtered_products.
+    """
+    category = params.get('category')
+    products = Product.objects.order_by()
+    if params.get('search'):
+        products = search_products(products, params['search'])
+    rows = products.annotate(
+        price_bucket=Case(
+            *[When(price__gte=edge, then=Value(i)) for i, edge in reversed(list(enumerate(PRICE_BUCKETS)))],
+            default=Value(0),
+        ),
+        rating_bucket=Case(
+            When(review_count=0, then=Value(0)),
+            *[When(average_rating__gte=threshold, then=Value(threshold)) for threshold in RATING_THRESHOLDS],
+            default=Value(0),
+        ),
+        in_price=matches(price_filter(params)),
+        in_rating=matches(rating_filter(params)),
+    ).values('category', 'price_bucket', 'rating_bucket', 'in_price', 'in_rating').annotate(count=Count('pk'))
+
+    total = 0
+    categories, prices, ratings = Counter(), Counter(), Counter()
+    for row in rows:
+        in_category = not category or row['category'] == category
+        if row['in_price'] and row['in_rating']:
+            categories[row['category']] += row['count']
+        if in_category and row['in_rating']:
+            prices[row['price_bucket']] += row['count']
+        if in_category and row['in_price']:
+            ratings[row['rating_bucket']] += row['count']
+            if row['in_rating']:
+                total += row['count']
+
+    edges = PRICE_BUCKETS + [None]
+    return {
+        'total': total,
+        'categories': [{'category': name, 'count': categories[name]} for name in sorted(categories)],
+        'price': [
+            {'min_price': edges[i], 'max_price': edges[i + 1], 'count': prices[i]}
+            for i in range(len(PRICE_BUCKETS))
+        ],
+        # Thresholds are cumulative: rated 4 and up includes the 5s
+        'rating': [
+            {'min_rating': threshold, 'count': sum(n for bucket, n in ratings.items() if bucket >= threshold)}
+            for threshold in RATING_THRESHOLDS
+        ],
+    }
+
+
+def categories():
+    return Product.objects.values_list('category', flat=True).distinct()
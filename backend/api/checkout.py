@@ -0,0 +1,103 @@
+from collections import defaultdict
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.db.models.functions import Now
+from . import replicas, tasks
+from .cache import invalidate_products_on_commit
+from .models import CartItem, Order, OrderItem, Product
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product):
+        super().__init__(f'Not enough stock for {product.name}' if product else 'Not enough stock')
+        self.product = product
+
+
+def place_order(customer, shipping_address, billing_address, status):
+    """
+    Turn the customer's cart into an order in one transaction: decrement
+    stock (converting the cart's holds), create the order and its items,
+    and empty the cart; the confirmation email is queued with them. Raises
+    EmptyCart or InsufficientStock, in which case nothing is written.
+    """
+    with transaction.atomic():
+        cart_items = list(
+            CartItem.objects.select_related('product')
+            .select_for_update(of=('self', 'product'))
+            .filter(customer=customer)
+        )
+        if not cart_items:
+            raise EmptyCart()
+
+        quantities, held = defaultdict(int), defaultdict(int)
+        for item in cart_items:
+            quantities[item.product_id] += item.quantity
+            held[item.product_id] += item.reserved_quantity
+        decrement_stock(quantities, held)
+
+        order = Order.objects.create(
+            customer=customer,
+            total_price=sum(item.product.price * item.quantity for item in cart_items),
+            shipping_address=shipping_address,
+            billing_address=billing_address,
+            status=status,
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_id=item.product_id, quantity=item.quantity)
+            for item in cart_items
+        ])
+        CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+        tasks.enqueue(send_order_confirmation, order_id=order.pk)
+        # Stock levels are part of the cached catalog responses
+        invalidate_products_on_commit(list(quantities))
+        # The new order is not on the replicas yet
+        transaction.on_commit(lambda: replicas.pin_user(customer.user_id))
+    return order
+
+
+def send_order_confirmation(order_id):
+    # A task (api.tasks): the order may be gone by the time it runs
+    order = Order.objects.select_related('customer__user').prefetch_related('items__product').filter(pk=order_id).first()
+    if order is None or not order.customer.user.email:
+        return
+    lines = [f'{item.quantity} x {item.product.name}: {item.product.price * item.quantity}' for item in order.items.all()]
+    send_mail(
+        f'Your order #{order.pk}',
+        '\n'.join([f'Thank you for your order ({order.status}).', '', *lines, '', f'Total: {order.total_price}']),
+        None,
+        [order.customer.user.email],
+    )
+
+
+def decrement_stock(quantities, held=None):
+    # One conditional UPDATE for every product: a row is only decremented if
+    # the stock other carts do not hold still covers the order, so a short
+    # row count means someone else got there first. The order's own holds
+    # (held, from api.reservations) are released in the same statement. The
+    # savepoint undoes the partial decrement before the shortfall is looked up.
+    held = held or {}
+    enough_stock = Q()
+    for product_id, quantity in quantities.items():
+        enough_stock |= Q(pk=product_id, inventory_quantity__gte=F('reserved_quantity') + (quantity - held.get(product_id, 0)))
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(enough_stock).update(inventory_quantity=Case(*[
+                When(pk=product_id, then=F('inventory_quantity') - quantity)
+                for product_id, quantity in quantities.items()
+            ]), reserved_quantity=Case(*[
+                When(pk=product_id, then=F('reserved_quantity') - held.get(product_id, 0))
+                for product_id in quantities
+            ]), updated_at=Now())
+            if updated != len(quantities):
+                raise InsufficientStock(None)
+    except InsufficientStock:
+        products = Product.objects.filter(pk__in=quantities).order_by('pk')
+        raise InsufficientStock(next((
+            p for p in products
+            if p.inventory_quantity - p.reserved_quantity + held.get(p.pk, 0) < quantities[p.pk]
+        ), None)) from None
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core import checks
+
+# Backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_process_local(alias):
+    return settings.CACHES[alias]['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+@checks.register(checks.Tags.caches)
+def check_replica_cache(app_configs, **kwargs):
+    if settings.DATABASE_REPLICAS and is_process_local('default'):
+        return [checks.Error(
+            'DB_REPLICAS needs a cache shared by all workers.',
+            hint=(
+                'Set CACHE_BACKEND to redis or file. Read-your-writes pins and replica lag markers '
+                'are kept in the cache, and other workers do not see a per-process one.'
+            ),
+            id='api.E001',
+        )]
+    return []
+
+
+@checks.register(checks.Tags.caches)
+def check_catalog_cache(app_configs, **kwargs):
+    if settings.CATALOG_CACHE_ENABLED and is_process_local(settings.CATALOG_CACHE_ALIAS):
+        return [checks.Error(
+            'CATALOG_CACHE_ENABLED needs a cache shared by all workers.',
+            hint=(
+                'Set CACHE_BACKEND to redis or file. A write bumps the version counters only in the '
+                'worker that handled it; the others would keep serving stale catalog responses.'
+            ),
+            id='api.E002',
+        )]
+    return []
@@ -0,0 +1,149 @@
+import csv
+import datetime
+from decimal import Decimal
+from itertools import islice
+import orjson
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Order, OrderItem, Product, Review
+
+# Streaming exports for admins and reporting jobs. Rows are read with
+# .iterator() and encoded one chunk at a time, so memory stays flat no
+# matter how many rows are exported. Each dataset is ordered by a
+# watermark column and id; passing the last row's (watermark, id) back as
+# since / since_id resumes with the rows written or changed after it.
+#
+# Watermarks are set when a row is saved, not when its transaction commits,
+# so a row may appear behind the watermark of an export that ran before its
+# commit. Exports therefore stop at EXPORT_SAFETY_MARGIN seconds ago (until),
+# leaving recent rows to the next run; a transaction must commit within the
+# margin.
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+class Dataset:
+    def __init__(self, model, watermark, fields):
+        self.model = model
+        self.watermark = watermark
+        self.fields = fields
+
+    def queryset(self, since=None, since_id=None, until=None):
+        queryset = self.model.objects.all()
+        if until is not None:
+            queryset = queryset.filter(**{f'{self.watermark}__lte': until})
+        if since is not None:
+            after = Q(**{f'{self.watermark}__gt': since})
+            if since_id is not None:
+                after |= Q(**{self.watermark: since, 'id__gt': since_id})
+            queryset = queryset.filter(after)
+        return queryset.order_by(self.watermark, 'id').values(*self.fields)
+
+    def chunks(self, since=None, since_id=None, chunk_size=DEFAULT_CHUNK_SIZE, until=None):
+        rows = self.queryset(since, since_id, until).iterator(chunk_size=chunk_size)
+        while chunk := list(islice(rows, chunk_size)):
+            yield chunk
+
+    def csv_header(self):
+        return self.fields
+
+    def csv_rows(self, row):
+        yield [row[field] for field in self.fields]
+
+
+class OrderDataset(Dataset):
+    item_fields = ['product_id', 'quantity']
+
+    def chunks(self, since=None, since_id=None, chunk_size=DEFAULT_CHUNK_SIZE, until=None):
+        for chunk in super().chunks(since, since_id, chunk_size, until):
+            items = {}
+            lines = OrderItem.objects.filter(order_id__in=[row['id'] for row in chunk]).order_by('pk')
+            for line in lines.values('order_id', *self.item_fields):
+                items.setdefault(line.pop('order_id'), []).append(line)
+            for row in chunk:
+                row['items'] = items.get(row['id'], [])
+            yield chunk
+
+    def csv_header(self):
+        return [*self.fields, *[f'item_{field}' for field in self.item_fields]]
+
+    # One line per order item, so the CSV stays flat
+    def csv_rows(self, row):
+        order = [row[field] for field in self.fields]
+        for item in row['items'] or [dict.fromkeys(self.item_fields)]:
+            yield [*order, *[item[field] for field in self.item_fields]]
+
+
+DATASETS = {
+    'orders': OrderDataset(Order, 'updated_at', [
+        'id', 'customer_id', 'total_price', 'shipping_address', 'billing_address', 'status', 'created_at', 'updated_at',
+    ]),
+    'products': Dataset(Product, 'updated_at', [
+        'id', 'name', 'description', 'price', 'category', 'image', 'inventory_quantity',
+        'average_rating', 'review_count', 'updated_at',
+    ]),
+    'reviews': Dataset(Review, 'updated_at', [
+        'id', 'customer_id', 'product_id', 'rating', 'review', 'created_at', 'updated_at',
+    ]),
+}
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def encode_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+
+def ndjson(chunks):
+    for chunk in chunks:
+        yield b''.join(orjson.dumps(row, default=encode_default) + b'\n' for row in chunk)
+
+
+class LineBuffer:
+    # csv.writer target that hands back each line instead of storing it
+    def write(self, value):
+        return value
+
+
+def csv_lines(dataset, chunks):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(dataset.csv_header()).encode()
+    for chunk in chunks:
+        yield ''.join(writer.writerow(line) for row in chunk for line in dataset.csv_rows(row)).encode()
+
+
+def parse_watermark(since, since_id=None):
+    """Parse the since / since_id parameters; naive timestamps are UTC."""
+    if not since:
+        return None, None
+    parsed = parse_datetime(since)
+    if parsed is None:
+        raise ValueError('since must be an ISO 8601 timestamp.')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    try:
+        return parsed, int(since_id) if since_id not in (None, '') else None
+    except ValueError:
+        raise ValueError('since_id must be an integer.')
+
+
+def safe_until():
+    """The newest watermark an export can include: older rows have all committed."""
+    return timezone.now() - datetime.timedelta(seconds=settings.EXPORT_SAFETY_MARGIN)
+
+
+def encode(dataset, chunks, output_format):
+    return ndjson(chunks) if output_format == 'ndjson' else csv_lines(dataset, chunks)
+
+
+def export(name, output_format, since=None, since_id=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield the encoded export of a dataset as bytes, one chunk at a time."""
+    dataset = DATASETS[name]
+    return encode(dataset, dataset.chunks(since, since_id, chunk_size, safe_until()), output_format)
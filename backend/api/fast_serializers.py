@@ -0,0 +1,120 @@
+import time
+from decimal import Decimal
+import orjson
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from . import images
+from .models import OrderItem, Product
+
+# Read-only rendering of the default product summary and order payloads
+# straight from .values() rows, skipping DRF's per-field machinery. Output
+# is byte-identical to ProductSummarySerializer / OrderSerializer rendered
+# by JSONRenderer; api.tests.FastSerializationTests holds them together.
+# Requests using ?fields= or ?expand= go through the serializers.
+
+PRODUCT_FIELDS = [
+    'id', 'name', 'price', 'category', 'image', 'image_variants', 'inventory_quantity', 'average_rating', 'review_count',
+]
+ORDER_FIELDS = [
+    'id', 'total_price', 'shipping_address', 'billing_address', 'created_at', 'updated_at', 'status',
+    'customer__user_id', 'customer__user__username', 'customer__user__email',
+    'customer__billing_address', 'customer__shipping_address', 'customer__credit_card_info',
+]
+CENTS = Decimal('0.01')
+
+image_storage = Product._meta.get_field('image').storage
+
+
+def enabled(request, context):
+    return (
+        settings.API_FAST_SERIALIZATION and context['fields'] is None and not context['expand']
+        and request.accepted_renderer.format == 'json'
+    )
+
+
+def render(data):
+    # JSONRenderer escapes the two line separators JavaScript rejects in strings
+    return orjson.dumps(data).replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+def response(request, data):
+    """A JSON response of render(data), timed as the request's render time (api.middleware)."""
+    started = time.perf_counter()
+    content = render(data)
+    request._request._metrics_render_time = time.perf_counter() - started
+    return HttpResponse(content, content_type='application/json')
+
+
+def money(value):
+    return f'{value.quantize(CENTS):f}'
+
+
+def datetime(value):
+    value = timezone.localtime(value) if settings.USE_TZ else value
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def product_values(queryset, *extra):
+    return queryset.values(*PRODUCT_FIELDS, *[field for field in extra if field not in PRODUCT_FIELDS])
+
+
+def product_summary(row):
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'price': money(row['price']),
+        'category': row['category'],
+        'image': image_storage.url(row['image']) if row['image'] else None,
+        'image_variants': images.variant_urls(row['image'], row['image_variants']),
+        'inventory_quantity': row['inventory_quantity'],
+        'average_rating': row['average_rating'] if row['review_count'] else None,
+        'review_count': row['review_count'],
+    }
+
+
+def order_values(queryset, *extra):
+    return queryset.values(*ORDER_FIELDS, *[field for field in extra if field not in ORDER_FIELDS])
+
+
+def order_payloads(rows):
+    """Render order_values() rows, loading their items and products in two queries."""
+    if not rows:
+        return []
+    items = list(OrderItem.objects.filter(order__in=[row['id'] for row in rows]).order_by('pk').values())
+    products = {
+        row['id']: product_summary(row)
+        for row in product_values(Product.objects.filter(pk__in={item['product_id'] for item in items}))
+    }
+    items_by_order = {}
+    for item in items:
+        items_by_order.setdefault(item['order_id'], []).append({
+            'id': item['id'],
+            'product': products[item['product_id']],
+            'quantity': item['quantity'],
+            'order': item['order_id'],
+        })
+    return [
+        {
+            'id': row['id'],
+            'items': items_by_order.get(row['id'], []),
+            'customer': {
+                'user': {
+                    'id': row['customer__user_id'],
+                    'username': row['customer__user__username'],
+                    'email': row['customer__user__email'],
+                },
+                'billing_address': row['customer__billing_address'],
+                'shipping_address': row['customer__shipping_address'],
+                'credit_card_info': row['customer__credit_card_info'],
+            },
+            'total_price': money(row['total_price']),
+            'shipping_address': row['shipping_address'],
+            'billing_address': row['billing_address'],
+            'created_at': datetime(row['created_at']),
+            'updated_at': datetime(row['updated_at']),
+            'status': row['status'],
+        }
+        for row in rows
+    ]
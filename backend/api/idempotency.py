@@ -0,0 +1,123 @@
+import datetime
+import functools
+import hashlib
+import json
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+# Idempotency-Key support for the views that create orders. The first
+# request with a key claims it by inserting its row; the view then runs in
+# one transaction with the recording of its response, so an order exists
+# exactly when its response is stored. Later requests with the same key get
+# the stored response back (with Idempotent-Replayed: true) and do nothing.
+#
+# Only successful responses are kept. A failure (declined payment, empty
+# cart, insufficient stock) writes nothing, so its key is released and the
+# client can retry with it. A duplicate that arrives while the first request
+# is still running gets 409; a claim whose request died is taken over after
+# IDEMPOTENCY_LOCK_SECONDS. Keys are kept IDEMPOTENCY_KEY_TTL seconds and
+# deleted by prune_expired (the prune_idempotency_keys command).
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+PRUNE_BATCH_SIZE = 1000
+
+
+def fingerprint(request):
+    return hashlib.sha256(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def claim(scope, key, digest):
+    """The key's record, and whether this request now owns it."""
+    now = timezone.now()
+    fields = {
+        'fingerprint': digest,
+        'status_code': None,
+        'response': None,
+        'locked_until': now + datetime.timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS),
+        'expires_at': now + datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+    }
+    records = IdempotencyKey.objects.filter(scope=scope, key=key)
+    # Read first, so a replay is one query
+    record = records.first()
+    if record is None:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(scope=scope, key=key, **fields), True
+        except IntegrityError:
+            return records.first(), False
+    # An expired key, or a claim abandoned by its request, is taken over in
+    # one conditional UPDATE, so only one of several retries gets it
+    if record.expires_at <= now or (record.status_code is None and record.locked_until <= now):
+        if records.filter(Q(expires_at__lte=now) | Q(status_code__isnull=True, locked_until__lte=now)).update(**fields):
+            for name, value in fields.items():
+                setattr(record, name, value)
+            return record, True
+        return records.first(), False
+    return record, False
+
+
+def idempotent(view):
+    """
+    Honour the Idempotency-Key header on a view that creates something.
+    Takes a DRF Request, so it goes below @api_view and @permission_classes
+    (or on a function views call).
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({'detail': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        scope = f'{view.__name__}:{request.user.pk if request.user.is_authenticated else "-"}'
+        digest = fingerprint(request)
+        record, claimed = claim(scope, key, digest)
+        if not claimed:
+            if record is not None and record.fingerprint != digest:
+                return Response(
+                    {'detail': f'This {HEADER} was used for a different request.'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            # None: its holder failed and released it between our insert and read
+            if record is None or record.status_code is None:
+                return Response(
+                    {'detail': f'A request with this {HEADER} is in progress.'},
+                    status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'},
+                )
+            return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            with transaction.atomic():
+                response = view(request, *args, **kwargs)
+                if status.is_success(response.status_code):
+                    IdempotencyKey.objects.filter(pk=record.pk).update(
+                        status_code=response.status_code, response=response.data, locked_until=None,
+                    )
+                    return response
+        except BaseException:
+            # Not if the error came after the commit (an on_commit hook):
+            # the order exists, and a retry must get its response
+            IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+            raise
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+        return response
+
+    return wrapper
+
+
+def prune_expired(now=None, batch_size=PRUNE_BATCH_SIZE):
+    """Delete expired keys, batch_size per statement. Returns how many."""
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,146 @@
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+from .cache import invalidate_products
+from .models import Product
+
+# Resized WebP derivatives of product images, one per PRODUCT_IMAGE_SIZES
+# entry, written next to the originals under product_images/derived/.
+#
+# A derivative's name carries a hash of the original's bytes and of the
+# size and encoder settings, so a name always means the same bytes and can
+# be cached forever; new settings produce new names. Product.image_variants
+# records which original its variants were made from, so a product whose
+# image changed is never shown the old image's thumbnails.
+#
+# Generation runs on a local thread pool after the saving transaction
+# commits (IMAGE_WORKERS threads; 0 runs it inline). The work is keyed by
+# the original's name, so products sharing an image share one job.
+
+VERSION = 1
+WEBP_QUALITY = 80
+DERIVED_DIR = 'product_images/derived'
+
+logger = logging.getLogger(__name__)
+storage = Product._meta.get_field('image').storage
+
+_lock = threading.Lock()
+_executor = None
+_pending = set()
+# Variants this process generated, by storage location, original name and
+# sizes (a stored name never changes content); cleared when it gets large
+_generated = {}
+MAX_GENERATED = 10000
+
+
+def is_current(name, variants):
+    return bool(variants) and variants.get('source') == name and all(label in variants for label in settings.PRODUCT_IMAGE_SIZES)
+
+
+def variant_urls(name, variants):
+    """Derivative URLs by size label, or {} until they exist for the current image."""
+    if not is_current(name, variants):
+        return {}
+    return {label: storage.url(variants[label]) for label in settings.PRODUCT_IMAGE_SIZES}
+
+
+def resize(data, size):
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+        output = io.BytesIO()
+        image.save(output, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return output.getvalue()
+
+
+def memo_key(name):
+    return storage.location, name, tuple(settings.PRODUCT_IMAGE_SIZES.items())
+
+
+def cached_variants(name):
+    return _generated.get(memo_key(name))
+
+
+def generate(name):
+    """Write the missing derivatives of one original and return its variants."""
+    cached = cached_variants(name)
+    if cached:
+        return cached
+    with storage.open(name, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    stem = os.path.splitext(os.path.basename(name))[0]
+    variants = {'source': name}
+    for label, size in settings.PRODUCT_IMAGE_SIZES.items():
+        key = hashlib.sha256(f'{digest}:{size}:{WEBP_QUALITY}:{VERSION}'.encode()).hexdigest()[:16]
+        target = f'{DERIVED_DIR}/{stem}-{label}-{key}.webp'
+        if not storage.exists(target):
+            target = storage.save(target, ContentFile(resize(data, size)))
+        variants[label] = target
+    if len(_generated) >= MAX_GENERATED:
+        _generated.clear()
+    _generated[memo_key(name)] = variants
+    return variants
+
+
+def apply(name, variants):
+    """Record variants on every product still showing this original."""
+    products = Product.objects.filter(image=name).exclude(image_variants=variants)
+    with transaction.atomic():
+        product_ids = list(products.values_list('pk', flat=True))
+        products.update(image_variants=variants, updated_at=Now())
+    invalidate_products(product_ids)
+    return product_ids
+
+
+def process(name):
+    try:
+        variants = generate(name)
+    except Exception:
+        logger.exception('Could not generate derivatives of %s', name)
+        return []
+    return apply(name, variants)
+
+
+def _run(name):
+    # Taken off the pending set first: a save while this runs schedules it again
+    with _lock:
+        _pending.discard(name)
+    close_old_connections()
+    try:
+        process(name)
+    finally:
+        close_old_connections()
+
+
+def schedule(names):
+    names = [name for name in dict.fromkeys(names) if name]
+    if not names or not settings.PRODUCT_IMAGE_SIZES:
+        return
+    if not settings.IMAGE_WORKERS:
+        for name in names:
+            process(name)
+        return
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.IMAGE_WORKERS, thread_name_prefix='images')
+        for name in names:
+            if name not in _pending:
+                _pending.add(name)
+                _executor.submit(_run, name)
+
+
+def schedule_on_commit(names):
+    names = list(names)
+    transaction.on_commit(lambda: schedule(names))
@@ -0,0 +1,257 @@
+import csv
+import datetime
+import hashlib
+import io
+import os
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlsplit
+import orjson
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+from . import images, search
+from .cache import invalidate_products_on_commit
+from .models import HASHED_IMAGE_DIR, CatalogImport, Product
+from .serializers import ProductImportSerializer
+
+# Bulk catalog upserts from supplier CSV / NDJSON files. The file is read
+# one batch at a time: each row is validated on its own, the batch's images
+# are copied into MEDIA_ROOT/product_images/hashed/ on a thread pool, and the valid
+# rows are written with one INSERT ... ON CONFLICT (sku) DO UPDATE. Rejected
+# rows are recorded on the CatalogImport and the rest of the batch goes on.
+#
+# rows_processed is saved in the same transaction as each batch, so an
+# interrupted import resumes after its last committed batch. Replaying rows
+# is harmless: the upsert is keyed on sku and image names on their content.
+#
+# A running import renews its lease (locked_until) with every batch. claim()
+# takes a pending or failed import, or a running one whose lease ran out
+# because its process died; the API, the run_import task and the
+# import_catalog command all resume through it.
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_IMAGE_WORKERS = 8
+MAX_REPORTED_ERRORS = 1000
+MAX_IMAGE_BYTES = 10 * 1024 * 1024
+IMAGE_FETCH_TIMEOUT = 10
+IMAGE_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+EXTENSIONS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+# Everything a supplier row owns; review aggregates are left alone
+UPDATE_FIELDS = [
+    'name', 'description', 'price', 'category', 'image', 'image_variants', 'inventory_quantity', 'updated_at',
+]
+
+image_storage = Product._meta.get_field('image').storage
+
+
+def csv_rows(f):
+    reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        # Cells beyond the header end up under the None key
+        row.pop(None, None)
+        yield reader.line_num, row
+
+
+def ndjson_rows(f):
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield number, orjson.loads(line)
+            except orjson.JSONDecodeError:
+                yield number, None
+
+
+READERS = {'csv': csv_rows, 'ndjson': ndjson_rows}
+
+
+def format_for(name):
+    return EXTENSIONS.get(os.path.splitext(name)[1].lower())
+
+
+def save_upload(upload, import_format):
+    """Store an uploaded catalog under CATALOG_IMPORT_ROOT and create its job."""
+    os.makedirs(settings.CATALOG_IMPORT_ROOT, exist_ok=True)
+    stamp = timezone.now().strftime('%Y%m%d%H%M%S%f')
+    path = os.path.join(settings.CATALOG_IMPORT_ROOT, f'{stamp}-{os.path.basename(upload.name)}')
+    with open(path, 'wb') as f:
+        for chunk in upload.chunks():
+            f.write(chunk)
+    return CatalogImport.objects.create(source=path, format=import_format)
+
+
+def lease():
+    return timezone.now() + datetime.timedelta(seconds=settings.CATALOG_IMPORT_LEASE_SECONDS)
+
+
+def claimable(now):
+    # Running without a current lease: the process running it died
+    return Q(status__in=['pending', 'failed']) | Q(status='running', locked_until__lte=now) | Q(
+        status='running', locked_until__isnull=True,
+    )
+
+
+def claim(pk):
+    """
+    Take an import for this process with one conditional UPDATE. Returns
+    None if it is completed or running elsewhere.
+    """
+    if not CatalogImport.objects.filter(claimable(timezone.now()), pk=pk).update(status='running', locked_until=lease()):
+        return None
+    return CatalogImport.objects.get(pk=pk)
+
+
+def validate(batch, row_serializer):
+    """Split a batch into {sku: data} (the last row of a sku wins) and row errors."""
+    valid, errors = {}, []
+    for line, row in batch:
+        if not isinstance(row, dict):
+            errors.append({'line': line, 'sku': None, 'errors': {'non_field_errors': ['Expected a JSON object.']}})
+            continue
+        try:
+            data = row_serializer.run_validation(row)
+        except serializers.ValidationError as e:
+            errors.append({'line': line, 'sku': row.get('sku'), 'errors': e.detail})
+            continue
+        valid[data['sku']] = (line, data)
+    return valid, errors
+
+
+def image_name(data, extension):
+    # Stored like Product.image uploads, so api.media serves it as immutable
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    return f'{HASHED_IMAGE_DIR}/import-{digest}{extension}'
+
+
+def read_image(source, image_root):
+    if urlsplit(source).scheme in ('http', 'https'):
+        with urllib.request.urlopen(source, timeout=IMAGE_FETCH_TIMEOUT) as response:
+            data = response.read(MAX_IMAGE_BYTES + 1)
+    else:
+        root = os.path.realpath(image_root)
+        path = os.path.realpath(os.path.join(root, source))
+        if not path.startswith(root + os.sep):
+            raise ValueError('Image path is outside the image root.')
+        with open(path, 'rb') as f:
+            data = f.read(MAX_IMAGE_BYTES + 1)
+    if len(data) > MAX_IMAGE_BYTES:
+        raise ValueError(f'Image is larger than {MAX_IMAGE_BYTES} bytes.')
+    return data
+
+
+def resolve_image(source, image_root=None):
+    """
+    Return the storage name of a row's image: a file already in storage, or
+    a URL / path under image_root copied into HASHED_IMAGE_DIR. The copy is
+    named after its content: a source whose image changed gets a new name,
+    and an unchanged one reuses the stored copy.
+    """
+    is_url = urlsplit(source).scheme in ('http', 'https')
+    if not is_url and not image_root:
+        if not image_storage.exists(source):
+            raise ValueError('Image not found in storage.')
+        return source
+
+    data = read_image(source, image_root)
+    with Image.open(io.BytesIO(data)) as image:
+        image.verify()
+        if image.format not in IMAGE_EXTENSIONS:
+            raise ValueError(f'Unsupported image format {image.format}.')
+        name = image_name(data, IMAGE_EXTENSIONS[image.format])
+    if not image_storage.exists(name):
+        name = image_storage.save(name, ContentFile(data))
+    return name
+
+
+def resolve_images(sources, pool, image_root=None):
+    """Resolve each distinct source once; returns {source: (name, error)}."""
+    def attempt(source):
+        try:
+            return resolve_image(source, image_root), None
+        except Exception as e:
+            return None, f'Could not load image: {e}'
+
+    sources = list(dict.fromkeys(sources))
+    return dict(zip(sources, pool.map(attempt, sources)))
+
+
+def write_batch(job, batch_size, rows, errors):
+    with transaction.atomic():
+        existing = dict(Product.objects.filter(sku__in=[data['sku'] for data in rows]).values_list('sku', 'image_variants'))
+        products = []
+        for data in rows:
+            # Keep the derivatives already made for this image; the rest are generated after commit
+            variants = images.cached_variants(data['image'])
+            if variants is None and images.is_current(data['image'], existing.get(data['sku'])):
+                variants = existing[data['sku']]
+            products.append(Product(**data, image_variants=variants or {}))
+        products = Product.objects.bulk_create(
+            products, update_conflicts=True, unique_fields=['sku'], update_fields=UPDATE_FIELDS,
+        )
+        # bulk_create skips the post_save receivers that maintain the index, cache and images
+        search.index_products(products)
+        invalidate_products_on_commit([product.pk for product in products])
+        images.schedule_on_commit(product.image.name for product in products if not product.image_variants)
+
+        created = len(rows) - len(existing)
+        job.rows_processed += batch_size
+        job.created += created
+        # Rows superseded by a later row for the same sku count as updates
+        job.updated += batch_size - len(errors) - created
+        job.failed += len(errors)
+        job.errors += errors[:MAX_REPORTED_ERRORS - len(job.errors)]
+        job.locked_until = lease()
+        job.save()
+
+
+def run(job, batch_size=DEFAULT_BATCH_SIZE, image_root=None, image_workers=DEFAULT_IMAGE_WORKERS, on_batch=None):
+    """
+    Import (or resume) a CatalogImport. on_batch(job, errors) is called
+    after each committed batch with that batch's rejected rows.
+    """
+    job.status = 'running'
+    job.locked_until = lease()
+    job.save(update_fields=['status', 'locked_until'])
+    row_serializer = ProductImportSerializer()
+    try:
+        with open(job.source, 'rb') as f, ThreadPoolExecutor(image_workers) as pool:
+            rows = islice(READERS[job.format](f), job.rows_processed, None)
+            while batch := list(islice(rows, batch_size)):
+                valid, errors = validate(batch, row_serializer)
+                images = resolve_images([data['image'] for _, data in valid.values()], pool, image_root)
+                accepted = []
+                for line, data in valid.values():
+                    name, error = images[data['image']]
+                    if error:
+                        errors.append({'line': line, 'sku': data['sku'], 'errors': {'image': [error]}})
+                    else:
+                        accepted.append({**data, 'image': name})
+                errors.sort(key=lambda error: error['line'])
+                write_batch(job, len(batch), accepted, errors)
+                if on_batch:
+                    on_batch(job, errors)
+    except BaseException:
+        job.status = 'failed'
+        job.locked_until = None
+        job.save(update_fields=['status', 'locked_until'])
+        raise
+    job.status = 'completed'
+    job.locked_until = None
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'locked_until', 'finished_at'])
+    return job
+
+
+def run_import(import_id):
+    """
+    Task for the import API. Does nothing if the import is running elsewhere;
+    an error leaves it failed, and the task's retry resumes it.
+    """
+    job = claim(import_id)
+    if job is not None:
+        run(job)
@@ -0,0 +1,269 @@
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from api import benchmarking
+from api.authentication import tokens_for
+from api.models import CartItem, Customer, Product
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Storefront:
+    """
+    The request scenarios, one per route in api/urls.py. Each scenario
+    returns (method, url, body, headers) for iteration ``i``; any state it
+    needs (a cart to check out, a token to revoke) is prepared before the
+    timed request.
+    """
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.product_ids = list(Product.objects.values_list('pk', flat=True))
+        self.customers = list(Customer.objects.select_related('user'))
+        self.categories = list(Product.objects.values_list('category', flat=True).distinct())
+        self.words = benchmarking.vocabulary()[:200]
+        self.tokens = {}
+
+    def auth(self, customer):
+        if customer.pk not in self.tokens:
+            self.tokens[customer.pk] = str(tokens_for(customer.user).access_token)
+        return {'HTTP_AUTHORIZATION': f'Bearer {self.tokens[customer.pk]}'}
+
+    def customer(self):
+        return self.rng.choice(self.customers)
+
+    def product(self):
+        return self.rng.choice(self.product_ids)
+
+    def restock(self, product_id):
+        Product.objects.filter(pk=product_id, inventory_quantity__lt=10).update(inventory_quantity=1000)
+
+    def fill_cart(self, customer, lines=3):
+        for product_id in self.rng.sample(self.product_ids, lines):
+            self.restock(product_id)
+            CartItem.objects.update_or_create(customer=customer, product_id=product_id, defaults={'quantity': 1})
+
+    def cart_item(self, customer):
+        # A cart has one line per product: the product may be in it already
+        product_id = self.product()
+        self.restock(product_id)
+        item, _ = CartItem.objects.get_or_create(customer=customer, product_id=product_id, defaults={'quantity': 1})
+        return item
+
+    def scenarios(self):
+        return {
+            'list_products': lambda i: ('get', reverse('list_products'), None, {}),
+            'product_detail': lambda i: ('get', reverse('product_detail', args=[self.product()]), None, {}),
+            'product_reviews': lambda i: ('get', reverse('product_reviews', args=[self.product()]), None, {}),
+            'list_categories': lambda i: ('get', reverse('list_categories'), None, {}),
+            'product_facets': lambda i: (
+                'get', reverse('product_facets') + f'?category={self.rng.choice(self.categories)}&max_price=50', None, {}
+            ),
+            'product_availability': lambda i: (
+                'get', reverse('product_availability') + '?ids=' + ','.join(map(str, self.rng.sample(self.product_ids, 5))),
+                None, {}
+            ),
+            'filter_category': lambda i: (
+                'get', reverse('filter_products') + f'?category={self.rng.choice(self.categories)}&sort_by=price_asc', None, {}
+            ),
+            'filter_search': lambda i: (
+                'get', reverse('filter_products') + f'?search={self.rng.choice(self.words)}', None, {}
+            ),
+            'register': lambda i: (
+                'post', reverse('register'), {'username': f'new-{i}', 'password': 'benchmark-pass', 'email': f'new-{i}@example.com'}, {}
+            ),
+            'login': lambda i: (
+                'post', reverse('login'), {'username': self.customer().user.username, 'password': 'benchmark-pass'}, {}
+            ),
+            'account_get': lambda i: ('get', reverse('account'), None, self.auth(self.customer())),
+            'account_update': lambda i: (
+                'put', reverse('account'), {'shipping_address': f'{i} Benchmark Way'}, self.auth(self.customer())
+            ),
+            'get_cart': self.get_cart,
+            'add_to_cart': lambda i: (
+                'post', reverse('add_to_cart'), {'product_id': self.product(), 'quantity': 1}, self.auth(self.customer())
+            ),
+            'update_cart_item': self.update_cart_item,
+            'cart_summary': self.cart_summary,
+            'update_cart': self.update_cart,
+            'remove_from_cart': self.remove_from_cart,
+            'checkout': self.checkout,
+            'process_payment': self.process_payment,
+            'register_or_login_and_checkout': lambda i: (
+                'post', reverse('register_or_login_and_checkout'),
+                {'username': f'guest-{i}', 'password': 'benchmark-pass', 'email': f'guest-{i}@example.com'}, {}
+            ),
+            'order_history': lambda i: ('get', reverse('order_history'), None, self.auth(self.customer())),
+            'add_review': lambda i: (
+                'post', reverse('add_review'), {'product_id': self.product(), 'rating': self.rng.randint(1, 5), 'review': 'Bench'},
+                self.auth(self.customer())
+            ),
+            'logout': self.logout,
+        }
+
+    def get_cart(self, i):
+        customer = self.customer()
+        self.fill_cart(customer)
+        return 'get', reverse('get_cart'), None, self.auth(customer)
+
+    def update_cart_item(self, i):
+        customer = self.customer()
+        item = self.cart_item(customer)
+        return 'put', reverse('update_cart_item', args=[item.pk]), {'quantity': 2}, self.auth(customer)
+
+    def remove_from_cart(self, i):
+        customer = self.customer()
+        item = self.cart_item(customer)
+        return 'delete', reverse('remove_from_cart', args=[item.pk]), None, self.auth(customer)
+
+    def cart_summary(self, i):
+        customer = self.customer()
+        self.fill_cart(customer)
+        return 'get', reverse('cart_summary'), None, self.auth(customer)
+
+    def update_cart(self, i):
+        customer = self.customer()
+        product_ids = self.rng.sample(self.product_ids, 3)
+        for product_id in product_ids:
+            self.restock(product_id)
+        items = [{'product_id': pk, 'quantity': self.rng.randint(0, 3)} for pk in product_ids]
+        return 'post', reverse('update_cart'), {'items': items}, self.auth(customer)
+
+    def checkout(self, i):
+        customer = self.customer()
+        CartItem.objects.filter(customer=customer).delete()
+        self.fill_cart(customer)
+        return 'post', reverse('checkout'), {}, self.auth(customer)
+
+    def process_payment(self, i):
+        method, _, _, headers = self.checkout(i)
+        body = {'shipping_address': '1 Benchmark Way', 'billing_address': '1 Benchmark Way'}
+        return method, reverse('process_payment'), body, headers
+
+    def logout(self, i):
+        customer = self.customer()
+        refresh = RefreshToken.for_user(customer.user)
+        return 'post', reverse('logout'), {'refresh_token': str(refresh)}, self.auth(customer)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic storefront in a throwaway database and drive every API route, '
+        'reporting latency percentiles, throughput and queries per request.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--customers', type=int, default=500)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--carts', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per route (default: 50).')
+        parser.add_argument('--routes', nargs='+', help='Only run these scenarios.')
+        parser.add_argument('--no-cache', action='store_true', help='Disable the catalog response cache.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this path.')
+        parser.add_argument('--compare', help='A previous --output file to report p95 changes against.')
+
+    def handle(self, *args, **options):
+        dataset = {key: options[key] for key in ('products', 'customers', 'reviews', 'carts', 'orders')}
+        report = {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'catalog_cache': not options['no_cache'],
+            'dataset': dataset,
+            'routes': {},
+        }
+
+        # Expected 4xx responses (e.g. the simulated payment failures) would
+        # otherwise be logged for every request
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        with benchmarking.benchmark_database(), override_settings(CATALOG_CACHE_ENABLED=not options['no_cache']):
+            started = time.perf_counter()
+            benchmarking.seed_dataset(**dataset, seed=options['seed'])
+            self.stdout.write(f'Seeded {dataset} in {time.perf_counter() - started:.1f}s')
+
+            storefront = Storefront(random.Random(options['seed']))
+            client = Client()
+            for name, scenario in storefront.scenarios().items():
+                if options['routes'] and name not in options['routes']:
+                    continue
+                report['routes'][name] = self.run_scenario(client, scenario, options['requests'])
+                self.print_route(name, report['routes'][name])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f), report)
+
+    def run_scenario(self, client, scenario, requests):
+        samples, queries, statuses = [], [], {}
+        for i in range(requests):
+            method, url, body, headers = scenario(i)
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                if body is None:
+                    response = getattr(client, method)(url, **headers)
+                else:
+                    response = getattr(client, method)(url, body, content_type='application/json', **headers)
+                samples.append(time.perf_counter() - started)
+            queries.append(counter.count)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        stats = benchmarking.summarize(samples)
+        return {
+            **stats,
+            'throughput_rps': round(len(samples) / sum(samples), 1),
+            'queries_per_request': round(sum(queries) / len(queries), 2),
+            'max_queries': max(queries),
+            'statuses': statuses,
+        }
+
+    def print_route(self, name, stats):
+        self.stdout.write(
+            f"{name:<32} p50={stats['p50_ms']:>8.2f}ms p95={stats['p95_ms']:>8.2f}ms p99={stats['p99_ms']:>8.2f}ms "
+            f"{stats['throughput_rps']:>8.1f} req/s {stats['queries_per_request']:>6.1f} q/req {stats['statuses']}"
+        )
+
+    def print_comparison(self, before, after):
+        self.stdout.write(f"\np95 change {before.get('revision')} -> {after.get('revision')}")
+        for name, stats in after['routes'].items():
+            previous = before['routes'].get(name)
+            if not previous:
+                continue
+            change = (stats['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+            style = self.style.ERROR if change > 10 else self.style.SUCCESS if change < -10 else str
+            self.stdout.write(style(
+                f"{name:<32} {previous['p95_ms']:>8.2f}ms -> {stats['p95_ms']:>8.2f}ms ({change:+.0f}%) "
+                f"queries {previous['queries_per_request']} -> {stats['queries_per_request']}"
+            ))
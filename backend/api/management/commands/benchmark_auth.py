@@ -0,0 +1,99 @@
+import json
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.module_loading import import_string
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from api import authentication, benchmarking
+from api.models import Customer
+
+PASSWORD = 'benchmark-pass'
+
+
+def hashers_for(profile):
+    hashers = settings.PASSWORD_HASHER_PROFILES
+    return [hashers[profile], *(hasher for name, hasher in hashers.items() if name != profile)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure login throughput with each password hashing profile (PASSWORD_HASHING), including '
+        'the first login that rehashes a password stored with PBKDF2, and the cost of resolving the '
+        'user and customer of an authenticated request with and without the in-process user cache.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=20, help='Timed logins per profile (default: 20).')
+        parser.add_argument('--requests', type=int, default=2000, help='Timed authentications per mode (default: 2000).')
+        parser.add_argument('--output', help='Write the results as JSON to this path.')
+
+    def handle(self, *args, **options):
+        results = []
+        with benchmarking.benchmark_database():
+            self.stdout.write(f"{'login':<38} {'logins/s':>9} {'p50':>10} {'p95':>10}")
+            for profile in settings.PASSWORD_HASHER_PROFILES:
+                with override_settings(PASSWORD_HASHERS=hashers_for(profile)):
+                    try:
+                        get_hasher().encode(PASSWORD, get_hasher().salt())
+                    except ValueError as e:
+                        self.stdout.write(f'{profile:<38} skipped: {e}')
+                        continue
+                    results.append(self.logins(profile, 'login', profile, options['logins']))
+                    if profile != 'pbkdf2':
+                        results.append(self.logins(profile, 'first login, rehash from pbkdf2', 'pbkdf2', options['logins']))
+
+            self.stdout.write(f"\n{'authenticated request':<38} {'queries':>9} {'p50':>10} {'p95':>10}")
+            results.extend(self.authentications(options['requests']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def logins(self, profile, label, stored_with, count):
+        # One user per login, so every rehash-on-login is a first login
+        stored = make_password(PASSWORD, hasher=import_string(settings.PASSWORD_HASHER_PROFILES[stored_with])())
+        users = User.objects.bulk_create([
+            User(username=f'{profile}-{stored_with}-{i}', password=stored) for i in range(count)
+        ])
+        client = Client()
+        url = reverse('login')
+        usernames = iter(user.username for user in users)
+        stats = benchmarking.measure(
+            lambda: client.post(url, {'username': next(usernames), 'password': PASSWORD}, content_type='application/json'),
+            count,
+        )
+        name = f'{profile}: {label}'
+        self.stdout.write(f"{name:<38} {1000 / stats['mean_ms']:>9.1f} {stats['p50_ms']:>8.2f}ms {stats['p95_ms']:>8.2f}ms")
+        return {'scenario': 'login', 'profile': profile, 'path': label, **stats}
+
+    def authentications(self, count):
+        customer = Customer.objects.create(user=User.objects.create_user('requester', password=PASSWORD))
+        token = authentication.tokens_for(customer.user).access_token
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        def baseline():
+            # What every view did before: the token's user, then its customer
+            user, _ = JWTAuthentication().authenticate(request)
+            Customer.objects.get(user=user)
+
+        def resolve():
+            user, _ = authentication.CustomerJWTAuthentication().authenticate(request)
+            user.customer
+
+        def cold():
+            authentication.clear()
+            resolve()
+
+        results = []
+        for label, fn in [('JWTAuthentication + customer', baseline), ('customer claim, cache miss', cold), ('customer claim, cached', resolve)]:
+            with CaptureQueriesContext(connection) as queries:
+                fn()
+            stats = benchmarking.measure(fn, count)
+            self.stdout.write(f"{label:<38} {len(queries):>9} {stats['p50_ms']:>8.3f}ms {stats['p95_ms']:>8.3f}ms")
+            results.append({'scenario': 'authenticated request', 'path': label, 'queries': len(queries), **stats})
+        return results
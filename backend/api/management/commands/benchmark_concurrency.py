@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.core.signals import request_started
+from django.db import connections
+from django.test import override_settings
+from django.urls import reverse
+from api import benchmarking
+from api.models import Product
+
+
+class SimulatedLatency:
+    """
+    Sleep before every query, standing in for the network round trip to a
+    database server. In-memory SQLite answers in microseconds, which hides
+    exactly the waiting that async views are meant to overlap.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+    def install(self, **kwargs):
+        # Sent on the thread that will run the request's queries under both
+        # handlers (see api.middleware.install_query_collector)
+        for alias in connections:
+            wrappers = connections[alias].execute_wrappers
+            if self not in wrappers:
+                wrappers.append(self)
+
+
+async def asgi_request(application, url):
+    parts = urlsplit(url)
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': parts.path, 'raw_path': parts.path.encode(), 'query_string': parts.query.encode(),
+        'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+    }
+    received = False
+    disconnected = asyncio.Event()
+    statuses = []
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    await application(scope, receive, send)
+    disconnected.set()
+    return statuses[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare catalog read throughput of the sync views under the WSGI handler (one thread per '
+        'in-flight request) with the async views under the ASGI handler, at increasing concurrency.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--customers', type=int, default=100)
+        parser.add_argument('--reviews', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=400, help='Requests per concurrency level (default: 400).')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+        parser.add_argument(
+            '--wsgi-threads', type=int,
+            help='Cap the WSGI worker threads, like a gunicorn --threads setting (default: one per client).',
+        )
+        parser.add_argument('--db-latency', type=float, default=2.0, help='Simulated milliseconds per query (default: 2).')
+        parser.add_argument('--cache', action='store_true', help='Enable the catalog response cache.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        latency = SimulatedLatency(options['db_latency'] / 1000)
+        with benchmarking.benchmark_database(), override_settings(CATALOG_CACHE_ENABLED=options['cache']):
+            benchmarking.seed_dataset(
+                options['products'], options['customers'], options['reviews'], carts=0, orders=0, seed=options['seed']
+            )
+            urls = self.urls(random.Random(options['seed']), options['requests'])
+            wsgi, asgi = WSGIHandler(), ASGIHandler()
+            if latency.seconds:
+                request_started.connect(latency.install)
+            try:
+                self.stdout.write(f"{'handler':<6} {'concurrency':>11} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9}  statuses")
+                for concurrency in options['concurrency']:
+                    self.report('wsgi', concurrency, *self.run_wsgi(wsgi, urls, concurrency, options['wsgi_threads'] or concurrency))
+                    self.report('asgi', concurrency, *asyncio.run(self.run_asgi(asgi, urls, concurrency)))
+            finally:
+                request_started.disconnect(latency.install)
+
+    def urls(self, rng, count):
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        words = benchmarking.vocabulary()[:200]
+        routes = [
+            lambda: reverse('list_products'),
+            lambda: reverse('product_detail', args=[rng.choice(product_ids)]),
+            lambda: reverse('product_reviews', args=[rng.choice(product_ids)]),
+            lambda: reverse('list_categories'),
+            lambda: reverse('filter_products') + f'?search={rng.choice(words)}&sort_by=price_asc',
+        ]
+        return [routes[i % len(routes)]() for i in range(count)]
+
+    def run_wsgi(self, application, urls, concurrency, threads):
+        # Clients queue for a server thread; that wait counts toward latency
+        server_threads = threading.BoundedSemaphore(threads)
+
+        def timed(url):
+            started = time.perf_counter()
+            with server_threads:
+                status = benchmarking.wsgi_request(application, url)
+            return time.perf_counter() - started, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(timed, urls))
+        return results, time.perf_counter() - started
+
+    async def run_asgi(self, application, urls, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(url):
+            async with semaphore:
+                started = time.perf_counter()
+                status = await asgi_request(application, '/api/async' + url.removeprefix('/api'))
+                return time.perf_counter() - started, status
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(timed(url) for url in urls))
+        return results, time.perf_counter() - started
+
+    def report(self, handler, concurrency, results, elapsed):
+        stats = benchmarking.summarize([duration for duration, _ in results])
+        statuses = {}
+        for _, status in results:
+            statuses[status] = statuses.get(status, 0) + 1
+        self.stdout.write(
+            f"{handler:<6} {concurrency:>11} {len(results) / elapsed:>9.1f} {stats['p50_ms']:>7.1f}ms "
+            f"{stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms  {statuses}"
+        )
@@ -0,0 +1,95 @@
+import os
+import random
+import tempfile
+import time
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.urls import reverse
+from api import benchmarking
+from api.models import Product
+
+# (label, CONN_MAX_AGE, CONN_HEALTH_CHECKS)
+MODES = [
+    ('new connection per request', 0, False),
+    ('persistent', 600, False),
+    ('persistent + health checks', 600, True),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure per-request latency and connections opened with a new database connection per '
+        'request versus persistent connections (CONN_MAX_AGE), with and without health checks. '
+        'Runs against the configured database engine; SQLite gets a file database so closing '
+        'a connection really closes it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument(
+            '--connect-latency', type=float, default=0,
+            help='Milliseconds added to every new connection, standing in for the TCP, TLS and '
+                 'authentication handshake of a database server (default: 0).',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        latency = options['connect_latency'] / 1000
+        opened = []
+
+        def connected(sender, connection, **kwargs):
+            opened.append(connection.alias)
+            time.sleep(latency)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                benchmarking.benchmark_database(name=self.file_name(directory)), \
+                override_settings(CATALOG_CACHE_ENABLED=False):
+            benchmarking.seed_products(options['products'], seed=options['seed'])
+            urls = self.urls(random.Random(options['seed']), options['requests'])
+            application = WSGIHandler()
+            saved = {key: connection.settings_dict[key] for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+            connection_created.connect(connected)
+            try:
+                self.stdout.write(
+                    f'{connection.vendor}, {len(urls)} requests, '
+                    f"{options['connect_latency']:g}ms added per connection"
+                )
+                self.stdout.write(f"{'mode':<28} {'connections':>11} {'req/s':>9} {'mean':>9} {'p50':>9} {'p95':>9}")
+                for label, max_age, health_checks in MODES:
+                    connection.close()
+                    connection.settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+                    opened.clear()
+                    samples = []
+                    started = time.perf_counter()
+                    for url in urls:
+                        request_started = time.perf_counter()
+                        benchmarking.wsgi_request(application, url)
+                        samples.append(time.perf_counter() - request_started)
+                    elapsed = time.perf_counter() - started
+                    stats = benchmarking.summarize(samples)
+                    self.stdout.write(
+                        f"{label:<28} {len(opened):>11} {len(urls) / elapsed:>9.1f} {stats['mean_ms']:>7.2f}ms "
+                        f"{stats['p50_ms']:>7.2f}ms {stats['p95_ms']:>7.2f}ms"
+                    )
+            finally:
+                connection_created.disconnect(connected)
+                connection.close()
+                connection.settings_dict.update(saved)
+
+    def file_name(self, directory):
+        # Closing an in-memory SQLite test database is a no-op
+        return os.path.join(directory, 'benchmark.sqlite3') if connection.vendor == 'sqlite' else None
+
+    def urls(self, rng, count):
+        product_ids = list(Product.objects.values_list('pk', flat=True))
+        # A one-query read and a full product payload: the fixed per-request
+        # cost matters most for the cheap one
+        routes = [
+            lambda: reverse('product_availability') + f'?ids={rng.choice(product_ids)}',
+            lambda: reverse('product_detail', args=[rng.choice(product_ids)]),
+        ]
+        return [routes[i % len(routes)]() for i in range(count)]
@@ -0,0 +1,88 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast, Mod
+from django.test import Client, override_settings
+from django.urls import reverse
+from api import benchmarking
+from api.catalog import PRICE_BUCKETS, RATING_THRESHOLDS, facets
+from api.models import Product
+from api.search import search_products
+
+
+def count_queries_facets(params):
+    # What a client had to do before: one count per category, price range and rating
+    products = Product.objects.all()
+    if params.get('search'):
+        products = search_products(products, params['search'])
+    in_category = products.filter(category=params['category']) if params.get('category') else products
+    edges = PRICE_BUCKETS + [None]
+    return {
+        'categories': {name: products.filter(category=name).count() for name in products.values_list('category', flat=True).distinct()},
+        'price': [
+            in_category.filter(price__gte=low, **({'price__lt': high} if high else {})).count()
+            for low, high in zip(edges, edges[1:])
+        ],
+        'rating': [
+            in_category.filter(review_count__gt=0, average_rating__gte=threshold).count()
+            for threshold in RATING_THRESHOLDS
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the facets endpoint (one grouped query, then the response cache) against '
+        'counting each category, price range and rating threshold separately.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per scenario (default: 10).')
+        parser.add_argument('--output', help='Write the results as JSON to this path.')
+
+    def handle(self, *args, **options):
+        words = benchmarking.vocabulary()
+        scenarios = {
+            'everything': {},
+            'category': {'category': benchmarking.CATEGORIES[3]},
+            'search': {'search': words[0]},
+            'search+category+rating': {'search': words[0], 'category': benchmarking.CATEGORIES[3], 'min_rating': '3'},
+        }
+        results = []
+        with benchmarking.benchmark_database():
+            benchmarking.seed_products(options['products'])
+            # Deterministic spread of ratings: 0-6 reviews averaging 1-5
+            Product.objects.update(review_count=Mod(F('id'), 7))
+            Product.objects.update(rating_sum=F('review_count') * (Mod(F('id'), 5) + 1))
+            Product.objects.filter(review_count__gt=0).update(
+                average_rating=Cast('rating_sum', FloatField()) / F('review_count')
+            )
+            # Planner statistics, as on a database that has been running for a while: without
+            # them SQLite probes the full-text index once per row of a category
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+            client = Client()
+            url = reverse('product_facets')
+            self.stdout.write(f"{'scenario':<24} {'path':<16} {'p50':>10} {'p95':>10}")
+            for label, params in scenarios.items():
+                paths = [
+                    ('count queries', lambda: count_queries_facets(params)),
+                    ('grouped query', lambda: facets(params)),
+                ]
+                for path, fn in paths:
+                    results.append({'scenario': label, 'path': path, **benchmarking.measure(fn, options['repeat'])})
+                with override_settings(CATALOG_CACHE_ENABLED=True):
+                    client.get(url, params)
+                    stats = benchmarking.measure(lambda: client.get(url, params), options['repeat'])
+                results.append({'scenario': label, 'path': 'cached response', **stats})
+                for result in results[-3:]:
+                    self.stdout.write(
+                        f"{label:<24} {result['path']:<16} {result['p50_ms']:>8.2f}ms {result['p95_ms']:>8.2f}ms"
+                    )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
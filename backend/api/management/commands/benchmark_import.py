@@ -0,0 +1,81 @@
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from PIL import Image
+from api import benchmarking, imports
+from api.models import CatalogImport, Product
+
+COLUMNS = ['sku', 'name', 'description', 'price', 'category', 'image', 'inventory_quantity']
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure catalog import throughput: a generated supplier file is imported into an empty '
+        'catalog (inserts) and then imported again (updates of every sku).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--format', choices=sorted(imports.READERS), default='csv')
+        parser.add_argument('--images', type=int, default=500, help='Distinct image files the rows share (default: 500).')
+        parser.add_argument('--invalid', type=float, default=0.01, help='Fraction of rows with a bad price (default: 0.01).')
+        parser.add_argument('--batch-size', type=int, default=imports.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--image-workers', type=int, default=imports.DEFAULT_IMAGE_WORKERS)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory, benchmarking.benchmark_database(), \
+                override_settings(MEDIA_ROOT=os.path.join(directory, 'media')):
+            image_root = os.path.join(directory, 'supplier')
+            os.makedirs(image_root)
+            for i in range(options['images']):
+                Image.new('RGB', (64, 64), (i % 256, i * 7 % 256, i * 13 % 256)).save(os.path.join(image_root, f'{i}.png'))
+            path = os.path.join(directory, f"catalog.{options['format']}")
+            started = time.perf_counter()
+            self.write_catalog(path, options)
+            self.stdout.write(
+                f"Generated {options['rows']:,} rows ({os.path.getsize(path) / 2**20:.1f} MiB) "
+                f'in {time.perf_counter() - started:.1f}s'
+            )
+
+            for run in ['insert', 'update']:
+                job = CatalogImport.objects.create(source=path, format=options['format'])
+                started = time.perf_counter()
+                imports.run(
+                    job, batch_size=options['batch_size'], image_root=image_root,
+                    image_workers=options['image_workers'],
+                )
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{run:<6} {elapsed:>7.1f}s {job.rows_processed / elapsed:>9,.0f} rows/s  '
+                    f'created={job.created} updated={job.updated} rejected={job.failed} '
+                    f'products={Product.objects.count()}'
+                )
+
+    def write_catalog(self, path, options):
+        rng = random.Random(options['seed'])
+        words = benchmarking.vocabulary()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            if options['format'] == 'csv':
+                writer.writerow(COLUMNS)
+            for i in range(options['rows']):
+                price = 'n/a' if rng.random() < options['invalid'] else f'{rng.randint(1, 500)}.{rng.randint(0, 99):02d}'
+                row = [
+                    f'SKU-{i:08d}',
+                    ' '.join(rng.choices(words, k=rng.randint(2, 4))).title(),
+                    ' '.join(rng.choices(words, k=rng.randint(8, 15))),
+                    price,
+                    rng.choice(benchmarking.CATEGORIES),
+                    f"{rng.randrange(options['images'])}.png",
+                    rng.randint(0, 200),
+                ]
+                if options['format'] == 'csv':
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
@@ -0,0 +1,104 @@
+import os
+import random
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+from django.views import static
+from PIL import Image
+from api import benchmarking, images
+from api.media import serve_media
+from api.models import Product
+
+
+def body_size(response):
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+        response.close()
+        return size
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the bytes and server time of one catalog page (the product list JSON plus every '
+        'image on it) with original images versus derivatives, cold and on a repeat visit.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--images', type=int, default=20, help='Distinct original images (default: 20).')
+        parser.add_argument('--size', type=int, default=2000, help='Edge of the generated originals in pixels (default: 2000).')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--variant', default='medium', help='Derivative the grid uses (default: medium).')
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, benchmarking.benchmark_database(), \
+                override_settings(MEDIA_ROOT=media_root, MEDIA_SERVING='django', IMAGE_WORKERS=0):
+            self.seed(media_root, options)
+            client, factory = Client(), RequestFactory()
+            url = reverse('list_products') + f"?page_size={options['page_size']}"
+            page = client.get(url).json()['results']
+            validators = {}
+
+            def fetch(image_url, view, conditional=False):
+                path, headers = image_url.removeprefix('/media/'), {}
+                if conditional and image_url in validators:
+                    headers['If-None-Match'] = validators[image_url]
+                response = view(factory.get(image_url, headers=headers), path)
+                if response.has_header('ETag'):
+                    validators[image_url] = response['ETag']
+                return response.status_code, body_size(response)
+
+            def old_static(request, path):
+                return static.serve(request, path, document_root=media_root)
+
+            variant = options['variant']
+            originals = [row['image'] for row in page]
+            derived = [row['image_variants'].get(variant, row['image']) for row in page]
+            scenarios = [
+                ('originals, static() (before)', originals, old_static, False),
+                ('originals, serve_media', originals, serve_media, False),
+                (f'{variant} derivatives, serve_media', derived, serve_media, False),
+                ('originals, repeat visit (revalidated)', originals, serve_media, True),
+                # Hashed names are immutable: a returning browser does not ask at all
+                (f'{variant} derivatives, repeat visit', [], serve_media, True),
+            ]
+            self.stdout.write(f"{'scenario':<42} {'requests':>8} {'image bytes':>12} {'page bytes':>11} {'p50':>9} {'p95':>9}")
+            for name, urls, view, conditional in scenarios:
+                fetch_all = lambda: [fetch(image_url, view, conditional) for image_url in urls]
+                fetch_all()
+                results, samples = [], []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    json_bytes = body_size(client.get(url))
+                    results = fetch_all()
+                    samples.append(time.perf_counter() - started)
+                image_bytes = sum(size for _, size in results)
+                stats = benchmarking.summarize(samples)
+                self.stdout.write(
+                    f"{name:<42} {len(urls) + 1:>8} {image_bytes:>12,} {json_bytes + image_bytes:>11,} "
+                    f"{stats['p50_ms']:>7.2f}ms {stats['p95_ms']:>7.2f}ms"
+                )
+
+    def seed(self, media_root, options):
+        rng = random.Random(0)
+        os.makedirs(os.path.join(media_root, 'product_images'))
+        names = []
+        for i in range(options['images']):
+            # Noise over a gradient compresses roughly like a product photo
+            size = (options['size'], options['size'])
+            noise = Image.effect_noise(size, 40).convert('RGB')
+            gradient = Image.linear_gradient('L').resize(size).convert('RGB')
+            name = f'product_images/photo-{i}.jpg'
+            Image.blend(noise, gradient, 0.5).save(os.path.join(media_root, name), quality=85)
+            names.append(name)
+        benchmarking.seed_products(options['products'])
+        products = list(Product.objects.only('pk'))
+        for product in products:
+            product.image = rng.choice(names)
+        Product.objects.bulk_update(products, ['image'], batch_size=500)
+        for name in names:
+            images.process(name)
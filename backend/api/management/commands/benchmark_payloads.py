@@ -0,0 +1,139 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from api import benchmarking, fast_serializers
+from api.models import CartItem, Customer, Order, OrderItem, Product, Review
+from api.serializers import (
+    CartItemSerializer, CustomerSerializer, OrderSerializer, ProductSerializer, ProductSummarySerializer,
+    fieldset_context,
+)
+
+
+# The payload shapes before sparse fieldsets: every product carried all of
+# its reviews, each with the reviewer's full customer record
+class LegacyReviewSerializer(serializers.ModelSerializer):
+    customer = CustomerSerializer(read_only=True)
+
+    class Meta:
+        model = Review
+        fields = ['id', 'customer', 'product', 'rating', 'review', 'created_at']
+
+
+class LegacyProductSerializer(ProductSerializer):
+    reviews = LegacyReviewSerializer(many=True, read_only=True)
+    image_variants = None
+
+    class Meta:
+        model = Product
+        exclude = ['rating_sum']
+
+
+class LegacyCartItemSerializer(serializers.ModelSerializer):
+    product = LegacyProductSerializer(read_only=True)
+
+    class Meta:
+        model = CartItem
+        fields = '__all__'
+
+
+class LegacyOrderItemSerializer(serializers.ModelSerializer):
+    product = LegacyProductSerializer(read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = '__all__'
+
+
+class LegacyOrderSerializer(serializers.ModelSerializer):
+    items = LegacyOrderItemSerializer(many=True, read_only=True)
+    customer = CustomerSerializer(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = '__all__'
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare response size and serialization time of the product, cart and order payloads before '
+        'sparse fieldsets, with the default summaries, and with ?fields= selections.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--customers', type=int, default=200)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--cart-lines', type=int, default=20, help='Lines in the measured cart (default: 20).')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per payload (default: 20).')
+        parser.add_argument('--output', help='Write the results as JSON to this path.')
+
+    def handle(self, *args, **options):
+        results = []
+        with benchmarking.benchmark_database():
+            benchmarking.seed_dataset(
+                options['products'], options['customers'], options['reviews'], carts=0, orders=0
+            )
+            customer = Customer.objects.first()
+            product_ids = list(Product.objects.values_list('pk', flat=True)[:options['cart_lines']])
+            CartItem.objects.bulk_create([CartItem(customer=customer, product_id=pk, quantity=1) for pk in product_ids])
+            order = Order.objects.create(
+                customer=customer, total_price=0, shipping_address='a', billing_address='b', status='Approved'
+            )
+            OrderItem.objects.bulk_create([OrderItem(order=order, product_id=pk, quantity=1) for pk in product_ids])
+
+            page = options['page_size']
+            products = lambda expand: Product.objects.for_serializer(expand)[:page]
+            cart = lambda expand: CartItem.objects.for_serializer(expand).filter(customer=customer)
+            orders = lambda expand: Order.objects.for_serializer(expand).filter(pk=order.pk)
+            scenarios = [
+                ('product list', 'before', products, LegacyProductSerializer, {'expand': 'reviews'}),
+                ('product list', 'summary', products, ProductSummarySerializer, {}),
+                ('product list', 'expand=reviews', products, ProductSummarySerializer, {'expand': 'reviews'}),
+                ('product list', 'fields=id,name,price', products, ProductSummarySerializer, {'fields': 'id,name,price'}),
+                ('cart', 'before', cart, LegacyCartItemSerializer, {'expand': 'reviews'}),
+                ('cart', 'summary', cart, CartItemSerializer, {}),
+                ('cart', 'fields=id,quantity,product.name,product.price', cart, CartItemSerializer,
+                 {'fields': 'id,quantity,product.name,product.price'}),
+                ('order', 'before', orders, LegacyOrderSerializer, {'expand': 'reviews'}),
+                ('order', 'summary', orders, OrderSerializer, {}),
+            ]
+            measurements = []
+            for endpoint, variant, queryset, serializer_class, params in scenarios:
+                context = fieldset_context(params)
+                measurements.append((endpoint, variant, lambda q=queryset, c=context: list(q(c['expand'])),
+                                     lambda objects, s=serializer_class, c=context: self.serialize(s, objects, c)))
+            # The .values() path (API_FAST_SERIALIZATION); the order items and
+            # products it loads itself are part of its timing
+            measurements += [
+                ('product list', 'summary, fast path', lambda: list(fast_serializers.product_values(products(()))),
+                 lambda rows: fast_serializers.render([fast_serializers.product_summary(row) for row in rows])),
+                ('order', 'summary, fast path', lambda: list(fast_serializers.order_values(orders(()))),
+                 lambda rows: fast_serializers.render(fast_serializers.order_payloads(rows))),
+            ]
+            for endpoint, variant, load, render in measurements:
+                result = {'endpoint': endpoint, 'variant': variant, **self.measure(load, render, options['repeat'])}
+                results.append(result)
+                self.stdout.write(
+                    f"{endpoint:<13} {variant:<48} {result['bytes']:>10,} bytes "
+                    f"serialize p50={result['p50_ms']:>8.2f}ms p95={result['p95_ms']:>8.2f}ms"
+                )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def serialize(self, serializer_class, objects, context):
+        return JSONRenderer().render(serializer_class(objects, many=True, context=context).data)
+
+    def measure(self, load, render, repeat):
+        samples = []
+        for _ in range(repeat):
+            # Loading the rows is not part of the measurement
+            objects = load()
+            started = time.perf_counter()
+            content = render(objects)
+            samples.append(time.perf_counter() - started)
+        return {'bytes': len(content), **benchmarking.summarize(samples)}
@@ -0,0 +1,54 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from api import benchmarking
+from api.models import Product
+from api.search import search_products
+
+
+def icontains_page(text, page_size):
+    # The filter_products search path before the full-text index
+    return list(Product.objects.filter(
+        Q(name__icontains=text) | Q(description__icontains=text) | Q(category__icontains=text)
+    ).order_by('id')[:page_size])
+
+
+def search_page(text, page_size):
+    return list(search_products(Product.objects.all(), text).order_by('search_rank', 'id')[:page_size])
+
+
+class Command(BaseCommand):
+    help = 'Compare product search latency of the full-text index against the icontains scan.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query (default: 20).')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--output', help='Write the results as JSON to this path.')
+
+    def handle(self, *args, **options):
+        words = benchmarking.vocabulary()
+        queries = {
+            'common': words[0],
+            'medium': words[100],
+            'rare': words[1500],
+            'prefix': words[10][:3],
+            'two_terms': f'{words[3]} {words[20]}',
+        }
+        results = []
+        with benchmarking.benchmark_database():
+            seeded = 0
+            for size in sorted(options['sizes']):
+                benchmarking.seed_products(size - seeded, start=seeded)
+                seeded = size
+                for label, text in queries.items():
+                    for path, fn in [('icontains', icontains_page), ('fulltext', search_page)]:
+                        stats = benchmarking.measure(lambda: fn(text, options['page_size']), options['repeat'])
+                        results.append({'products': size, 'query': label, 'path': path, **stats})
+                        self.stdout.write(
+                            f"{size:>9} {label:<10} {path:<10} p50={stats['p50_ms']:>9.3f}ms p95={stats['p95_ms']:>9.3f}ms"
+                        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,109 @@
+import datetime
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer as StockTokenRefreshSerializer
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from api import benchmarking, revocations
+from api.authentication import TokenRefreshSerializer, tokens_for
+
+SEED_BATCH_SIZE = 20_000
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure token refresh latency with the stock blacklist lookup and with the revocation '
+        'filter, on empty token tables and with --rows tokens in them, then prune the expired ones.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Outstanding tokens to seed (default: 1000000).')
+        parser.add_argument(
+            '--expired', type=float, default=0.9,
+            help='Share of the seeded tokens that have expired (default: 0.9). Every other one is blacklisted.',
+        )
+        parser.add_argument('--refreshes', type=int, default=500, help='Timed refreshes per scenario (default: 500).')
+        parser.add_argument('--batch-size', type=int, default=revocations.PRUNE_BATCH_SIZE)
+        parser.add_argument('--output', help='Write the results as JSON to this path.')
+
+    def handle(self, *args, **options):
+        results = []
+        with benchmarking.benchmark_database():
+            user = benchmarking.seed_customers(1)[0].user
+            self.stdout.write(f"{'tokens':>9} {'path':<22} {'queries':>8} {'p50':>10} {'p95':>10}")
+            for rows in [0, options['rows']]:
+                if rows:
+                    self.seed(rows, options['expired'])
+                for path, serializer_class in [('blacklist lookup', StockTokenRefreshSerializer), ('revocation filter', TokenRefreshSerializer)]:
+                    results.append(self.refreshes(user, rows, path, serializer_class, options['refreshes']))
+
+            revocations.revocations.reset()
+            started = time.perf_counter()
+            revocations.revocations.sync()
+            rebuilt = time.perf_counter() - started
+            bloom = revocations.revocations.filter
+            self.stdout.write(
+                f'\nFilter rebuilt from {bloom.count} unexpired revoked tokens in {rebuilt * 1000:.0f}ms, '
+                f'{len(bloom.bits) / 2 ** 20:.1f} MiB'
+            )
+            results.append({'scenario': 'filter rebuild', 'tokens': bloom.count, 'seconds': rebuilt, 'bytes': len(bloom.bits)})
+
+            started = time.perf_counter()
+            deleted = revocations.prune_expired(batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - started
+            batches = max(1, -(-deleted // options['batch_size']))
+            self.stdout.write(
+                f'Pruned {deleted} expired tokens in {elapsed:.1f}s ({deleted / elapsed:.0f}/s), '
+                f'{elapsed / batches * 1000:.0f}ms per {options["batch_size"]}-token transaction'
+            )
+            results.append({'scenario': 'prune', 'tokens': deleted, 'seconds': elapsed, 'batch_size': options['batch_size']})
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def seed(self, rows, expired):
+        now = timezone.now()
+        expired_rows = int(rows * expired)
+        first_id = (OutstandingToken.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        for offset in range(0, rows, SEED_BATCH_SIZE):
+            OutstandingToken.objects.bulk_create([
+                OutstandingToken(
+                    jti=f'{i:032x}', token='-', created_at=now,
+                    expires_at=now + datetime.timedelta(days=-1 if i < expired_rows else 30),
+                )
+                for i in range(offset, min(rows, offset + SEED_BATCH_SIZE))
+            ])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {BlacklistedToken._meta.db_table} (token_id, blacklisted_at) '
+                f'SELECT id, %s FROM {OutstandingToken._meta.db_table} WHERE id >= %s AND id %% 2 = 0',
+                [now, first_id],
+            )
+            if connection.vendor == 'sqlite':
+                cursor.execute('ANALYZE')
+
+    def refreshes(self, user, rows, path, serializer_class, count):
+        token = str(tokens_for(user))
+
+        def refresh():
+            nonlocal token
+            serializer = serializer_class(data={'refresh': token})
+            serializer.is_valid(raise_exception=True)
+            token = serializer.validated_data['refresh']
+
+        # A process whose filter is in sync: the rebuild is timed separately
+        with override_settings(REVOCATION_SYNC_SECONDS=3600):
+            revocations.revocations.reset()
+            revocations.revocations.sync()
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                refresh()
+            stats = benchmarking.measure(refresh, count)
+        executed = len([q for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))])
+        self.stdout.write(f"{rows:>9} {path:<22} {executed:>8} {stats['p50_ms']:>8.3f}ms {stats['p95_ms']:>8.3f}ms")
+        return {'scenario': 'refresh', 'tokens': rows, 'path': path, 'queries': executed, **stats}
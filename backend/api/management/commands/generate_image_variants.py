@@ -0,0 +1,44 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from api import images
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the resized WebP derivatives of product images that do not have them yet '
+        '(existing images, or all of them after PRODUCT_IMAGE_SIZES changes).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Images processed in parallel (default: 4).')
+        parser.add_argument('--all', action='store_true', help='Check every image, not only products without current variants.')
+
+    def handle(self, *args, **options):
+        if not settings.PRODUCT_IMAGE_SIZES:
+            self.stderr.write('PRODUCT_IMAGE_SIZES is empty; nothing to generate.')
+            return
+        names = set()
+        for name, variants in Product.objects.exclude(image='').values_list('image', 'image_variants').iterator():
+            if options['all'] or not images.is_current(name, variants):
+                names.add(name)
+
+        started = time.perf_counter()
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as pool:
+                updated = sum(len(product_ids) for product_ids in pool.map(self.process, sorted(names)))
+        else:
+            updated = sum(len(images.process(name)) for name in sorted(names))
+        self.stdout.write(
+            f'Processed {len(names)} images for {updated} products in {time.perf_counter() - started:.1f}s.'
+        )
+
+    def process(self, name):
+        try:
+            return images.process(name)
+        finally:
+            # Each pool thread has its own connection
+            connections.close_all()
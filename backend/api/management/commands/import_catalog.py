@@ -0,0 +1,70 @@
+import json
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api import imports
+from api.models import CatalogImport
+
+
+class Command(BaseCommand):
+    help = (
+        'Upsert products by sku from a CSV or NDJSON catalog file in batches. Rejected rows are '
+        'reported without stopping the import; --resume continues an interrupted import.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Catalog file (.csv, .ndjson or .jsonl).')
+        parser.add_argument('--format', choices=sorted(imports.READERS), help='Default: from the file extension.')
+        parser.add_argument('--resume', type=int, metavar='IMPORT_ID', help='Continue this import from its checkpoint.')
+        parser.add_argument('--image-root', help='Directory that relative image paths in the file are read from.')
+        parser.add_argument('--batch-size', type=int, default=imports.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--image-workers', type=int, default=imports.DEFAULT_IMAGE_WORKERS)
+        parser.add_argument('--errors', help='Write every rejected row to this file as NDJSON.')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            if not CatalogImport.objects.filter(pk=options['resume']).exists():
+                raise CommandError(f"Import {options['resume']} does not exist.")
+            # The same rule as the resume API: a running import is taken over once its lease ran out
+            job = imports.claim(options['resume'])
+            if job is None:
+                raise CommandError(f"Import {options['resume']} is running in another process or already completed.")
+        elif options['path']:
+            import_format = options['format'] or imports.format_for(options['path'])
+            if import_format is None:
+                raise CommandError('Cannot tell the format from the file name; pass --format.')
+            if not os.path.exists(options['path']):
+                raise CommandError(f"{options['path']} does not exist.")
+            job = CatalogImport.objects.create(source=os.path.abspath(options['path']), format=import_format)
+        else:
+            raise CommandError('Pass a catalog file or --resume IMPORT_ID.')
+
+        errors_file = open(options['errors'], 'a') if options['errors'] else None
+        started, first_row = time.perf_counter(), job.rows_processed
+
+        def progress(job, errors):
+            for error in errors:
+                if errors_file:
+                    errors_file.write(json.dumps(error) + '\n')
+            elapsed = time.perf_counter() - started
+            self.stderr.write(
+                f'Import {job.pk}: {job.rows_processed} rows ({job.created} created, {job.updated} updated, '
+                f'{job.failed} rejected), {(job.rows_processed - first_row) / elapsed:.0f} rows/s'
+            )
+
+        self.stderr.write(f'Import {job.pk} of {job.source}' + (f' from row {first_row}' if first_row else ''))
+        try:
+            imports.run(
+                job, batch_size=options['batch_size'], image_root=options['image_root'],
+                image_workers=options['image_workers'], on_batch=progress,
+            )
+        except KeyboardInterrupt:
+            raise CommandError(f'Interrupted; continue with --resume {job.pk}.')
+        finally:
+            if errors_file:
+                errors_file.close()
+        for error in job.errors[:20]:
+            self.stderr.write(f"line {error['line']} (sku {error['sku']}): {json.dumps(error['errors'])}")
+        self.stdout.write(
+            f'Import {job.pk} completed: {job.created} created, {job.updated} updated, {job.failed} rejected.'
+        )
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from api import revocations
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired refresh tokens from the outstanding and blacklisted token tables in '
+        'short transactions (flushexpiredtokens deletes them all in one statement).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=revocations.PRUNE_BATCH_SIZE,
+            help=f'Tokens deleted per transaction (default: {revocations.PRUNE_BATCH_SIZE}).',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to wait between batches, leaving the tables to other writers (default: 0).',
+        )
+        parser.add_argument('--every', type=int, help='Keep running, pruning every N seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = revocations.prune_expired(batch_size=options['batch_size'], pause=options['pause'])
+            self.stdout.write(f'Deleted {deleted} expired tokens.')
+            if not options['every']:
+                break
+            time.sleep(options['every'])
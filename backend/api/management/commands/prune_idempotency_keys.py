@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from api import idempotency
+
+
+class Command(BaseCommand):
+    help = 'Delete expired Idempotency-Key records, after which their keys can be used again.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=idempotency.PRUNE_BATCH_SIZE,
+            help=f'Keys deleted per statement (default: {idempotency.PRUNE_BATCH_SIZE}).',
+        )
+        parser.add_argument('--every', type=int, help='Keep running, pruning every N seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = idempotency.prune_expired(batch_size=options['batch_size'])
+            self.stdout.write(f'Deleted {deleted} expired idempotency keys.')
+            if not options['every']:
+                break
+            time.sleep(options['every'])
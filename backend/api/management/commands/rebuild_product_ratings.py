@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating aggregates of every product from its reviews.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of products updated per statement (default: 1000).',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Product.objects.aggregate(last_id=Max('pk'))['last_id'] or 0
+        updated = 0
+        # Walk the id range in fixed windows so no single statement holds
+        # its locks for the whole table.
+        for start in range(0, last_id, batch_size):
+            with transaction.atomic():
+                updated += Product.objects.filter(
+                    pk__gt=start, pk__lte=start + batch_size
+                ).rebuild_rating_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} products.'))
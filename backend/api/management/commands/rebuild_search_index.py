@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the products table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild (default: "default").')
+
+    def handle(self, *args, **options):
+        with transaction.atomic(using=options['database']):
+            count = search.rebuild_index(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products.'))
@@ -0,0 +1,32 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api import reservations
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Give the stock held by expired cart lines back to their products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=reservations.SWEEP_BATCH_SIZE,
+            help=f'Cart lines released per transaction (default: {reservations.SWEEP_BATCH_SIZE}).',
+        )
+        parser.add_argument('--every', type=int, help='Keep running, sweeping every N seconds.')
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='First recompute every product\'s reserved_quantity from the cart holds.',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                rebuilt = Product.objects.rebuild_reservations()
+            self.stdout.write(f'Rebuilt reservations for {rebuilt} products.')
+        while True:
+            released = reservations.release_expired(batch_size=options['batch_size'])
+            self.stdout.write(f'Released {released} expired cart holds.')
+            if not options['every']:
+                break
+            time.sleep(options['every'])
@@ -0,0 +1,35 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api import tasks
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued background tasks on a pool of threads. Several of these workers can run side '
+        'by side, in one or many processes: each task is claimed by exactly one of them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.TASK_WORKERS,
+            help=f'Threads running tasks (default: TASK_WORKERS, {settings.TASK_WORKERS}).',
+        )
+        parser.add_argument('--poll', type=float, default=1, help='Seconds to wait when no task is due (default: 1).')
+        parser.add_argument('--once', action='store_true', help='Run the tasks that are due, then exit.')
+
+    def handle(self, *args, **options):
+        batch_size = max(tasks.BATCH_SIZE, options['workers'])
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='task') as executor:
+            while True:
+                ran = tasks.run_due(batch_size, executor)
+                if ran:
+                    self.stdout.write(f'Ran {ran} tasks.')
+                    continue
+                pruned = tasks.prune_finished(settings.TASK_RETENTION_DAYS * 86400)
+                if pruned:
+                    self.stdout.write(f'Deleted {pruned} finished tasks.')
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
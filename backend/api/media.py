@@ -0,0 +1,146 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+from .images import DERIVED_DIR
+from .models import HASHED_IMAGE_DIR
+
+# Production serving of user-uploaded media (MEDIA_SERVING):
+#   'django'           this view: conditional GETs, single byte ranges, and
+#                      the whole file through wsgi.file_wrapper (sendfile
+#                      under gunicorn)
+#   'x-accel-redirect' Django checks the path and sets the cache headers,
+#   'x-sendfile'       then nginx / Apache (mod_xsendfile) sends the file
+#
+# Files under HASHED_DIRS are only written there under a hash of their
+# content (product_image_path, api.imports and api.images), so they never
+# change and are cached for a year as immutable. Everything else, whatever
+# its name, gets MEDIA_MAX_AGE.
+
+HASHED_DIRS = (HASHED_IMAGE_DIR + '/', DERIVED_DIR + '/')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def cache_control(path):
+    hashed = posixpath.normpath(path).startswith(HASHED_DIRS)
+    return IMMUTABLE if hashed else f'public, max-age={settings.MEDIA_MAX_AGE}'
+
+
+def parse_range(header, size):
+    """
+    Return the (first, last) byte positions of a single-range Range header,
+    or None to send the whole file (no header, several ranges or a header
+    this does not understand). RFC 9110 allows ignoring a Range header.
+    """
+    match = BYTE_RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the final N bytes
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(0, size - int(last)), size - 1
+    first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise RangeNotSatisfiable
+    if last < first:
+        return None
+    return first, last
+
+
+class FileRange:
+    """Read-only view of bytes [first, last] of an open file."""
+
+    def __init__(self, file, first, last):
+        file.seek(first)
+        self.file = file
+        self.remaining = last - first + 1
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    # Lets gunicorn sendfile() the range: it starts at the file's current
+    # offset and sends Content-Length bytes
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def etag_for(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found.')
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Not found.')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found.')
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if settings.MEDIA_SERVING in ('x-accel-redirect', 'x-sendfile'):
+        response = HttpResponse(content_type=content_type)
+        if settings.MEDIA_SERVING == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+        else:
+            response['X-Sendfile'] = full_path
+        response['Cache-Control'] = cache_control(path)
+        return response
+
+    etag, last_modified = etag_for(stat), http_date(stat.st_mtime)
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+    else:
+        not_modified = not was_modified_since(request.headers.get('If-Modified-Since'), int(stat.st_mtime))
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        byte_range = None
+        # A range meant for another version of the file gets the whole file
+        if request.headers.get('If-Range') in (None, etag, last_modified):
+            try:
+                byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+            except RangeNotSatisfiable:
+                response = HttpResponse(status=416, content_type=content_type)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                return response
+
+        file = open(full_path, 'rb')
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type)
+        else:
+            first, last = byte_range
+            response = FileResponse(FileRange(file, first, last), status=206, content_type=content_type)
+            response['Content-Length'] = last - first + 1
+            response['Content-Range'] = f'bytes {first}-{last}/{stat.st_size}'
+        response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Cache-Control'] = cache_control(path)
+    return response
@@ -0,0 +1,95 @@
+import bisect
+import threading
+from . import cache
+
+# In-process request metrics fed by api.middleware.RequestMetricsMiddleware
+# and rendered in the Prometheus text exposition format. Each worker keeps
+# its own series; scrape every worker or aggregate in Prometheus.
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"')) for name, value in zip(names, values))
+    return '{%s}' % pairs
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, format_labels(self.labels, labels), value) for labels, value in sorted(self.series.items())]
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, labels, value):
+        with self.lock:
+            counts, total = self.series.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.series[labels] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for labels, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip([*self.buckets, '+Inf'], counts):
+                    cumulative += count
+                    samples.append((f'{self.name}_bucket', format_labels([*self.labels, 'le'], [*labels, bound]), cumulative))
+                samples.append((f'{self.name}_sum', format_labels(self.labels, labels), total))
+                samples.append((f'{self.name}_count', format_labels(self.labels, labels), cumulative))
+        return samples
+
+
+VIEW_LABELS = ('view', 'method')
+
+requests_total = Counter('ecom_http_requests_total', 'Requests handled.', ('view', 'method', 'status'))
+request_duration = Histogram('ecom_http_request_duration_seconds', 'Wall time per request.', DURATION_BUCKETS, VIEW_LABELS)
+db_duration = Histogram('ecom_http_db_duration_seconds', 'Time spent in database queries per request.', DURATION_BUCKETS, VIEW_LABELS)
+serialization_duration = Histogram(
+    'ecom_http_serialization_duration_seconds', 'Time spent building the response payload (serializers).', DURATION_BUCKETS, VIEW_LABELS
+)
+render_duration = Histogram('ecom_http_render_duration_seconds', 'Time spent encoding the response body (renderer).', DURATION_BUCKETS, VIEW_LABELS)
+db_queries = Histogram('ecom_http_db_queries', 'Database queries per request.', QUERY_BUCKETS, VIEW_LABELS)
+response_size = Histogram('ecom_http_response_size_bytes', 'Response body size.', SIZE_BUCKETS, VIEW_LABELS)
+duplicate_queries = Counter(
+    'ecom_http_duplicate_queries_total', 'Queries repeating an earlier statement in the same request (N+1 signature).', VIEW_LABELS
+)
+
+REGISTRY = [requests_total, request_duration, db_duration, serialization_duration, render_duration, db_queries, response_size, duplicate_queries]
+
+
+def render_prometheus():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(f'{name}{labels} {value}' for name, labels, value in metric.samples())
+    for stat, value in cache.stats().items():
+        name = f'ecom_catalog_cache_{stat}_total'
+        lines.append(f'# HELP {name} Catalog response cache {stat.replace("_", " ")}.')
+        lines.append(f'# TYPE {name} counter')
+        lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,214 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from rest_framework.serializers import BaseSerializer
+from whitenoise.middleware import WhiteNoiseMiddleware
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCollector:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+
+_collector = ContextVar('request_query_collector', default=None)
+
+
+def collect_queries(execute, sql, params, many, context):
+    collector = _collector.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    return collector(execute, sql, params, many, context)
+
+
+def install_query_collector(**kwargs):
+    # Connections are per thread, and under ASGI the ORM runs on the
+    # request's sync_to_async thread. request_started is sent on that same
+    # thread, so the wrapper is installed where the queries will run; the
+    # request's collector then reaches it through the context variable.
+    for alias in connections:
+        wrappers = connections[alias].execute_wrappers
+        if collect_queries not in wrappers:
+            wrappers.append(collect_queries)
+
+
+request_started.connect(install_query_collector)
+
+
+class SerializationTimer:
+    def __init__(self):
+        self.duration = 0.0
+        self.active = False
+
+
+_serialization_timer = ContextVar('request_serialization_timer', default=None)
+
+
+@contextmanager
+def serializing():
+    """Count the block as serialization time of the current request (nested blocks count once)."""
+    timer = _serialization_timer.get()
+    if timer is None or timer.active:
+        yield
+        return
+    timer.active = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.duration += time.perf_counter() - started
+        timer.active = False
+
+
+def install_serialization_timer():
+    # serializer.data is where DRF builds the payload (to_representation);
+    # Serializer and ListSerializer reach it through super().data
+    data = BaseSerializer.data
+
+    def timed_data(self):
+        with serializing():
+            return data.fget(self)
+
+    BaseSerializer.data = property(timed_data)
+
+
+install_serialization_timer()
+
+
+class RequestMetricsMiddleware:
+    """
+    Record wall time, database query count and time, serialization and
+    render time and response size of every request into api.metrics, and
+    report them to the client in a Server-Timing header. Statements
+    executed more than once in a request are counted and logged as likely
+    N+1 queries.
+
+    Serialization is building the payload (serializer.data, or a serializing()
+    block on the fast paths), including any queries it runs; render is
+    encoding it (JSONRenderer).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        collector, timer = QueryCollector(), SerializationTimer()
+        tokens = _collector.set(collector), _serialization_timer.set(timer)
+        request._metrics_render_time = 0.0
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _collector.reset(tokens[0])
+            _serialization_timer.reset(tokens[1])
+        return self.finish(request, response, collector, timer, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        collector, timer = QueryCollector(), SerializationTimer()
+        tokens = _collector.set(collector), _serialization_timer.set(timer)
+        request._metrics_render_time = 0.0
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _collector.reset(tokens[0])
+            _serialization_timer.reset(tokens[1])
+        return self.finish(request, response, collector, timer, time.perf_counter() - started)
+
+    def finish(self, request, response, collector, timer, total):
+        match = request.resolver_match
+        labels = (match.view_name if match else 'unmatched', request.method)
+        size = len(response.content) if not response.streaming else 0
+        metrics.requests_total.inc((*labels, response.status_code))
+        metrics.request_duration.observe(labels, total)
+        metrics.db_duration.observe(labels, collector.duration)
+        metrics.serialization_duration.observe(labels, timer.duration)
+        metrics.render_duration.observe(labels, request._metrics_render_time)
+        metrics.db_queries.observe(labels, collector.count)
+        metrics.response_size.observe(labels, size)
+
+        duplicates = collector.duplicates
+        if duplicates:
+            metrics.duplicate_queries.inc(labels, duplicates)
+            if duplicates >= settings.REQUEST_METRICS_DUPLICATE_QUERY_WARNING:
+                sql, count = collector.statements.most_common(1)[0]
+                logger.warning('%s %s ran %d duplicate queries; most repeated (%dx): %s',
+                               request.method, request.path, duplicates, count, sql)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={collector.duration * 1000:.1f};desc="{collector.count} queries ({duplicates} duplicate)"',
+            f'serialize;dur={timer.duration * 1000:.1f}',
+            f'render;dur={request._metrics_render_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after this hook returns; time that step
+        started = time.perf_counter()
+
+        def rendered(response):
+            request._metrics_render_time = time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise's middleware is sync only, which would make Django run
+    every async view behind it through sync_to_async. Finding and opening
+    a static file does not block on anything slow, so serve it inline on
+    both paths.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,65 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:46
+
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_product_fts USING fts5("
+    "name, description, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    # Weight name matches above category and description in bm25 ranking
+    "INSERT INTO api_product_fts (api_product_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0)')",
+    "INSERT INTO api_product_fts (rowid, name, description, category) "
+    "SELECT id, name, description, category FROM api_product",
+]
+SQLITE_REVERSE = ['DROP TABLE api_product_fts']
+
+POSTGRES_FORWARD = [
+    "ALTER TABLE api_product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(category, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'C')) STORED",
+    'CREATE INDEX api_product_search_idx ON api_product USING GIN (search_vector)',
+]
+POSTGRES_REVERSE = [
+    'DROP INDEX api_product_search_idx',
+    'ALTER TABLE api_product DROP COLUMN search_vector',
+]
+
+
+def run_for_vendor(sqlite, postgres):
+    def run(apps, schema_editor):
+        statements = {'sqlite': sqlite, 'postgresql': postgres}.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='api.product')),
+                ('name', models.TextField()),
+                ('description', models.TextField()),
+                ('category', models.TextField()),
+                ('document', api.models.SearchDocumentField(db_column='api_product_fts')),
+                ('rank', models.FloatField(db_column='rank')),
+            ],
+            options={
+                'db_table': 'api_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(
+            run_for_vendor(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_for_vendor(SQLITE_REVERSE, POSTGRES_REVERSE),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:35
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(upload_to=api.models.product_image_path),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.7 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_cart_reservations'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='api_product_category_price',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price', 'id', 'review_count', 'average_rating'], name='api_product_facets'),
+        ),
+    ]
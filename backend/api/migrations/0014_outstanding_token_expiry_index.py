@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # The token_blacklist app's outstanding tokens are pruned by expiry
+    # (api.revocations.prune_expired), which without an index scans the table
+
+    dependencies = [
+        ('api', '0013_product_facets_index'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX api_outstandingtoken_expires_at ON token_blacklist_outstandingtoken (expires_at)',
+            'DROP INDEX api_outstandingtoken_expires_at',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 21:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogimport',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,5 +1,12 @@
+import hashlib
+import os
 from django.db import models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Lower, Now
+from django.db.models.lookups import GreaterThan, Lookup
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 # Wrapper class to distinguish customers from users with no orders
 class Customer(models.Model):
@@ -11,17 +18,143 @@ class Customer(models.Model):
     def __str__(self):
         return self.user.username
 
+class ProductQuerySet(models.QuerySet):
+    def with_reviews(self):
+        return self.prefetch_related(
+            Prefetch('reviews', queryset=Review.objects.select_related('customer__user'))
+        )
+
+    # Everything ProductSerializer touches, loaded in a constant number of
+    # queries; reviews only when the response expands them
+    def for_serializer(self, expand=()):
+        return self.with_reviews() if 'reviews' in expand else self
+
+    # Apply a change in the review set to the stored aggregates in a single
+    # UPDATE, so concurrent review writes never lose an increment.
+    def record_rating(self, rating_delta, count_delta):
+        rating_sum = F('rating_sum') + rating_delta
+        review_count = F('review_count') + count_delta
+        return self.update(
+            rating_sum=rating_sum,
+            review_count=review_count,
+            average_rating=Case(
+                When(GreaterThan(review_count, 0), then=Cast(rating_sum, FloatField()) / review_count),
+                default=Value(0.0),
+            ),
+            updated_at=Now(),
+        )
+
+    # Recompute reserved_quantity from the cart holds (drift repair)
+    def rebuild_reservations(self):
+        holds = CartItem.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        return self.update(reserved_quantity=Coalesce(
+            Subquery(holds.annotate(total=Sum('reserved_quantity')).values('total')), 0
+        ))
+
+    # Recompute the stored aggregates from the reviews table (backfill and drift repair)
+    def rebuild_rating_stats(self):
+        reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        rating_sum = Subquery(reviews.annotate(total=Sum('rating')).values('total'))
+        review_count = Subquery(reviews.annotate(count=Count('pk')).values('count'))
+        return self.update(
+            rating_sum=Coalesce(rating_sum, 0),
+            review_count=Coalesce(review_count, 0),
+            average_rating=Coalesce(Cast(rating_sum, FloatField()) / review_count, Value(0.0)),
+            updated_at=Now(),
+        )
+
+# New uploads are named after their content and kept in HASHED_IMAGE_DIR,
+# whose URLs are cached as immutable (see api.media). FieldFile.save()
+# called directly does not expose the content here; those keep their plain
+# name in product_images/.
+HASHED_IMAGE_DIR = 'product_images/hashed'
+
+def product_image_path(instance, filename):
+    stem, extension = os.path.splitext(os.path.basename(filename))
+    image = instance.image
+    if not image or image._committed:
+        return f'product_images/{stem}{extension}'
+    digest = hashlib.sha256()
+    for chunk in image.file.chunks():
+        digest.update(chunk)
+    return f'{HASHED_IMAGE_DIR}/{stem}-{digest.hexdigest()[:16]}{extension.lower()}'
+
 class Product(models.Model):
+    # Supplier stock-keeping unit; the upsert key of catalog imports
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     category = models.CharField(max_length=255)
-    image = models.ImageField(upload_to='product_images/')
+    image = models.ImageField(upload_to=product_image_path)
+    # Resized copies of image, maintained by api.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     inventory_quantity = models.PositiveIntegerField()
+    # Units held by cart reservations (api.reservations); never above inventory_quantity
+    reserved_quantity = models.PositiveIntegerField(default=0)
+    # Denormalized review aggregates, kept up to date by the Review signals (api.signals)
+    rating_sum = models.PositiveIntegerField(default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    average_rating = models.FloatField(default=0, db_index=True)
+    # Export watermark; queryset.update() callers must set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Match the catalog's filters and keyset orderings (see api.pagination)
+        indexes = [
+            # Serves category pages by price (keyset on price, id) and covers the
+            # facet counts (api.catalog.facets) without reading the rows
+            models.Index(fields=['category', 'price', 'id', 'review_count', 'average_rating'], name='api_product_facets'),
+            models.Index(fields=['price'], name='api_product_price'),
+            models.Index(Lower('name'), name='api_product_name_lower'),
+            models.Index(fields=['updated_at', 'id'], name='api_product_updated'),
+        ]
 
     def __str__(self):
         return self.name
 
+def product_prefetch(lookup='product', expand=()):
+    return Prefetch(lookup, queryset=Product.objects.for_serializer(expand))
+
+class SearchDocumentField(models.TextField):
+    pass
+
+@SearchDocumentField.register_lookup
+class FullTextMatch(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+# Read-only view of the SQLite FTS5 index created in migration 0006 and
+# kept in sync by api.search. Only used for joins; never saved through the ORM.
+class ProductSearchEntry(models.Model):
+    product = models.OneToOneField(
+        Product, primary_key=True, db_column='rowid', related_name='search_entry',
+        on_delete=models.DO_NOTHING, db_constraint=False,
+    )
+    name = models.TextField()
+    description = models.TextField()
+    category = models.TextField()
+    # FTS5 hidden columns: the table-named column is the MATCH target and
+    # rank holds the bm25 score of the current match (lower is better).
+    document = SearchDocumentField(db_column='api_product_fts')
+    rank = models.FloatField(db_column='rank')
+
+    class Meta:
+        managed = False
+        db_table = 'api_product_fts'
+
+class OrderQuerySet(models.QuerySet):
+    def for_serializer(self, expand=()):
+        return self.select_related('customer__user').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.prefetch_related(product_prefetch(expand=expand)))
+        )
+
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -31,6 +164,16 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=50)
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # Read backwards for newest-first history; the implicit trailing id
+        # then also comes out descending, matching the keyset tie-break
+        indexes = [
+            models.Index(fields=['customer', 'created_at'], name='api_order_customer_created'),
+            models.Index(fields=['updated_at', 'id'], name='api_order_updated'),
+        ]
+
     def __str__(self):
         return f'Order {self.id} by {self.customer.user.username}'
 
@@ -42,10 +185,25 @@ class OrderItem(models.Model):
     def __str__(self):
         return f'{self.quantity} of {self.product.name}'
     
+class CartItemQuerySet(models.QuerySet):
+    def for_serializer(self, expand=()):
+        return self.prefetch_related(product_prefetch(expand=expand))
+
 class CartItem(models.Model):
     customer = models.ForeignKey(Customer, related_name='cart_items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
+    # Stock held for this line until reserved_until (api.reservations)
+    reserved_quantity = models.PositiveIntegerField(default=0)
+    reserved_until = models.DateTimeField(blank=True, null=True)
+
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'product'], name='api_cartitem_unique_customer_product'),
+        ]
+        indexes = [models.Index(fields=['reserved_until'], name='api_cartitem_reserved_until')]
 
     def __str__(self):
         return f'{self.quantity} of {self.product.name} in {self.customer.user.username}\'s cart'
@@ -56,17 +214,91 @@ class Review(models.Model):
     rating = models.PositiveIntegerField(default=1)
     review = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Export watermark; re-reviewing through add_review edits the row
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f'Review for {self.product.name} by {self.customer.user.username}'
     
     class Meta:
         unique_together = ('customer', 'product')
+        indexes = [models.Index(fields=['updated_at', 'id'], name='api_review_updated')]
 
     @property
     def average_rating(self):
-        return self.product.reviews.aggregate(avg_rating=models.Avg('rating'))['avg_rating']
+        return self.product.average_rating if self.product.review_count else None
     
     @property
     def review_count(self):
-        return self.product.reviews.count()
\ No newline at end of file
+        return self.product.review_count
+
+class CatalogImport(models.Model):
+    STATUSES = [('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')]
+
+    source = models.CharField(max_length=500)
+    format = models.CharField(max_length=10)
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending')
+    # Resume checkpoint: data rows handled by committed batches
+    rows_processed = models.PositiveIntegerField(default=0)
+    # Heartbeat of a running import, pushed back after every batch: one not
+    # renewed by then was interrupted and can be resumed
+    locked_until = models.DateTimeField(blank=True, null=True)
+    created = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # The first api.imports.MAX_REPORTED_ERRORS rejected rows
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'Import {self.id} of {self.source}'
+
+# A unit of background work (api.tasks), run by the run_tasks worker
+class Task(models.Model):
+    STATUSES = [('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
+    # Dotted path of the function to call with payload as keyword arguments
+    name = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict, blank=True)
+    # Enqueueing a second task with the same key is a no-op
+    idempotency_key = models.CharField(max_length=200, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # A running task whose worker has not finished it by then is run again
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'], name='api_task_due')]
+
+    def __str__(self):
+        return f'Task {self.id}: {self.name}'
+
+# A request made with an Idempotency-Key header and, once it succeeded, its
+# response (api.idempotency)
+class IdempotencyKey(models.Model):
+    # The view and the user (or '-') the key was sent to
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    # Hash of the request body: a key cannot be reused for a different request
+    fingerprint = models.CharField(max_length=64)
+    # Null while the request is in progress
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    # An in-progress claim older than this is abandoned and can be taken over
+    locked_until = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='api_idempotencykey_unique_scope_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.scope} {self.key}'
@@ -0,0 +1,161 @@
+import base64
+import json
+import math
+from decimal import Decimal, InvalidOperation
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+# sort_by value -> (field, descending). Name sorting uses the name_lower
+# annotation added by the view so it matches the case-insensitive ordering.
+PRODUCT_ORDERINGS = {
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+    'name_asc': ('name_lower', False),
+    'name_desc': ('name_lower', True),
+    'rating_asc': ('average_rating', False),
+    'rating_desc': ('average_rating', True),
+}
+
+
+def parse_number(kind):
+    def parse(value):
+        number = kind(value)
+        if not math.isfinite(number):
+            raise ValueError
+        return number
+    return parse
+
+
+def parse_timestamp(value):
+    timestamp = parse_datetime(value)
+    if timestamp is None:
+        raise ValueError
+    return timestamp
+
+
+MIN_ID, MAX_ID = -2 ** 63, 2 ** 63 - 1
+
+# Sort field -> parser of the cursor's value (sent as a string); fields not
+# listed here sort as text
+CURSOR_VALUES = {
+    'price': parse_number(Decimal),
+    'average_rating': parse_number(float),
+    'created_at': parse_timestamp,
+}
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on (sort field, id). Each page is fetched with a
+    WHERE clause on the last row seen instead of an OFFSET, so deep pages
+    cost the same as the first one. Reads only request.GET, so it also
+    serves the plain Django requests of the async views.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=('id', False)):
+        self.field, self.descending = ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_results(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        return self.paginate_results([obj async for obj in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.position, self.reverse = self.decode_cursor(request)
+
+        descending = self.descending != self.reverse
+        if self.position is not None:
+            queryset = queryset.filter(self.seek(self.position, descending))
+        prefix = '-' if descending else ''
+        order = [prefix + self.field] if self.field == 'id' else [prefix + self.field, prefix + 'id']
+        return queryset.order_by(*order)[:self.page_size + 1]
+
+    def paginate_results(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+            has_next, has_previous = self.position is not None, has_more
+        else:
+            has_next, has_previous = has_more, self.position is not None
+
+        self.next_position = self.position_of(results[-1]) if has_next and results else None
+        self.previous_position = self.position_of(results[0]) if has_previous and results else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_data(self, data):
+        return {
+            'next': self.get_link(self.next_position, reverse=False),
+            'previous': self.get_link(self.previous_position, reverse=True),
+            'results': data,
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return max(1, min(page_size, self.max_page_size))
+
+    def seek(self, position, descending):
+        value, pk = position
+        op = 'lt' if descending else 'gt'
+        if self.field == 'id':
+            return Q(**{f'id__{op}': pk})
+        return Q(**{f'{self.field}__{op}': value}) | Q(**{self.field: value, f'id__{op}': pk})
+
+    def position_of(self, obj):
+        # Model instances, or .values() rows on the fast serialization path
+        value = obj[self.field] if isinstance(obj, dict) else getattr(obj, self.field)
+        return (None if self.field == 'id' else str(value), obj['id'] if isinstance(obj, dict) else obj.pk)
+
+    def decode_cursor(self, request):
+        encoded = request.GET.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            if cursor['f'] != self.field:
+                raise ValueError
+            return (self.parse_value(cursor['v']), self.parse_id(cursor['id'])), bool(cursor['r'])
+        except (TypeError, ValueError, KeyError, UnicodeError, InvalidOperation, OverflowError):
+            raise ParseError(self.invalid_cursor_message)
+
+    def parse_id(self, value):
+        # Ids outside a signed 64-bit integer cannot be bound as a query parameter
+        pk = int(value)
+        if not MIN_ID <= pk <= MAX_ID:
+            raise OverflowError
+        return pk
+
+    def parse_value(self, value):
+        # Checked here, since a null or mistyped value would fail in the query
+        if self.field == 'id':
+            return None
+        if not isinstance(value, str):
+            raise TypeError
+        return CURSOR_VALUES.get(self.field, str)(value)
+
+    def get_link(self, position, reverse):
+        if position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        value, pk = position
+        cursor = {'f': self.field, 'v': value, 'id': pk, 'r': reverse}
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(url, self.cursor_query_param, encoded)
@@ -0,0 +1,93 @@
+import functools
+import itertools
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+# Read replicas (DATABASE_REPLICAS, see settings). Views decorated with
+# @read_from_replica run their queries on one replica, picked round-robin
+# from those that are healthy; everything else (writes, and the views that
+# read what they just wrote: cart, checkout, add_review) stays on 'default'.
+#
+# A replica that cannot be connected to is skipped for REPLICA_RETRY_SECONDS
+# and the view is run again on the primary. Replicas lag: a customer who
+# just placed an order reads their history from the primary for
+# REPLICA_PIN_SECONDS (pin_user / pinned_by_user), and the catalog cache
+# does not keep responses read within REPLICA_MAX_LAG_SECONDS of a write
+# (api.cache). Pins live in the default cache, which must be shared by all
+# workers (api.checks).
+#
+# The async catalog views (api.async_views) always read from the primary.
+
+_replica = ContextVar('replica', default=None)
+_next = itertools.count()
+# alias -> time.monotonic() after which it is tried again
+_unhealthy = {}
+
+
+def healthy_replicas():
+    now = time.monotonic()
+    return [alias for alias in settings.DATABASE_REPLICAS if _unhealthy.get(alias, 0) <= now]
+
+
+def choose_replica():
+    replicas = healthy_replicas()
+    return replicas[next(_next) % len(replicas)] if replicas else None
+
+
+def mark_unhealthy(alias):
+    _unhealthy[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+
+
+def pin_key(user_id):
+    return f'replicas:pin:{user_id}'
+
+
+def pin_user(user_id):
+    """Send user_id's replica reads to the primary for REPLICA_PIN_SECONDS."""
+    if settings.DATABASE_REPLICAS:
+        cache.set(pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def read_from_replica(view=None, *, pinned_by_user=False):
+    """
+    Run a read-only view on a replica. With pinned_by_user, users pinned by
+    pin_user read from the primary (this authenticates the request).
+    """
+    if view is None:
+        return functools.partial(read_from_replica, pinned_by_user=pinned_by_user)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if pinned_by_user and request.user.is_authenticated and cache.get(pin_key(request.user.pk)):
+            return view(request, *args, **kwargs)
+        alias = choose_replica()
+        if alias is None:
+            return view(request, *args, **kwargs)
+        token = _replica.set(alias)
+        try:
+            return view(request, *args, **kwargs)
+        except DatabaseError:
+            # An error on an open connection is the query's, not the replica's
+            if connections[alias].connection is not None:
+                raise
+            mark_unhealthy(alias)
+        finally:
+            _replica.reset(token)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
@@ -0,0 +1,119 @@
+import datetime
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+from .checkout import InsufficientStock
+from .models import CartItem, Product
+
+# Stock holds for cart lines. A line holds reserved_quantity units until
+# reserved_until; Product.reserved_quantity is the sum of its lines' holds,
+# so availability is inventory_quantity - reserved_quantity, a one-row
+# read. Holds only grow through conditional UPDATEs, which
+# never let reserved_quantity exceed inventory_quantity.
+#
+# Expired holds keep counting until release_expired() runs (the
+# release_expired_reservations command). Adding to a line holds the added
+# units and renews its expiry; setting a line's quantity holds all of it
+# again. Checkout turns a cart's holds into the stock decrement (see
+# api.checkout.decrement_stock). Deleting a customer gives back its holds
+# (api.signals).
+
+SWEEP_BATCH_SIZE = 1000
+
+
+def hold_expiry():
+    return timezone.now() + datetime.timedelta(seconds=settings.CART_RESERVATION_TTL)
+
+
+def hold(product_id, quantity):
+    """Add quantity units to a product's holds, or raise InsufficientStock (Product.DoesNotExist if there is no such product)."""
+    products = Product.objects.filter(pk=product_id, inventory_quantity__gte=F('reserved_quantity') + quantity)
+    if not products.update(reserved_quantity=F('reserved_quantity') + quantity):
+        raise InsufficientStock(Product.objects.get(pk=product_id))
+
+
+def reserve(cart_item, quantity):
+    """
+    Hold quantity units for a cart line (already saved) and set its
+    quantity, or raise InsufficientStock leaving the hold as it was.
+    """
+    with transaction.atomic():
+        cart_item = CartItem.objects.select_for_update().get(pk=cart_item.pk)
+        reserve_many([cart_item], {cart_item.pk: quantity})
+    return cart_item
+
+
+def reserve_many(cart_items, quantities):
+    """
+    Set each cart line's quantity to quantities[line.pk] and hold the stock
+    for it, with one conditional UPDATE for all the products. The lines must
+    be selected for update in the caller's transaction. Raises
+    InsufficientStock, leaving every hold as it was.
+    """
+    deltas = defaultdict(int)
+    for item in cart_items:
+        deltas[item.product_id] += quantities[item.pk] - item.reserved_quantity
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if deltas:
+        enough_stock = Q()
+        for product_id, delta in deltas.items():
+            enough_stock |= Q(pk=product_id, inventory_quantity__gte=F('reserved_quantity') + max(delta, 0))
+        try:
+            with transaction.atomic():
+                updated = Product.objects.filter(enough_stock).update(reserved_quantity=Case(*[
+                    When(pk=product_id, then=F('reserved_quantity') + delta) for product_id, delta in deltas.items()
+                ]))
+                if updated != len(deltas):
+                    raise InsufficientStock(None)
+        except InsufficientStock:
+            products = Product.objects.filter(pk__in=deltas).order_by('pk')
+            raise InsufficientStock(next((
+                p for p in products if p.inventory_quantity - p.reserved_quantity < deltas[p.pk]
+            ), None)) from None
+
+    expiry = hold_expiry()
+    for item in cart_items:
+        item.quantity = item.reserved_quantity = quantities[item.pk]
+        item.reserved_until = expiry
+    CartItem.objects.bulk_update(cart_items, ['quantity', 'reserved_quantity', 'reserved_until'])
+
+
+def release(cart_items):
+    """Give back the holds of cart lines about to be deleted (call inside their transaction)."""
+    held = defaultdict(int)
+    for item in cart_items:
+        held[item.product_id] += item.reserved_quantity
+    held = {product_id: quantity for product_id, quantity in held.items() if quantity}
+    if held:
+        Product.objects.filter(pk__in=held).update(reserved_quantity=Case(*[
+            When(pk=product_id, then=F('reserved_quantity') - quantity) for product_id, quantity in held.items()
+        ]))
+
+
+def release_expired(now=None, batch_size=SWEEP_BATCH_SIZE):
+    """Release every hold that expired by now, batch_size lines per transaction. Returns the lines released."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            items = list(
+                CartItem.objects.select_for_update()
+                .filter(reserved_until__lte=now, reserved_quantity__gt=0)
+                .only('pk', 'product_id', 'reserved_quantity')[:batch_size]
+            )
+            if not items:
+                return released
+            release(items)
+            CartItem.objects.filter(pk__in=[item.pk for item in items]).update(reserved_quantity=0, reserved_until=None)
+        released += len(items)
+
+
+def availability(product_ids):
+    """Units available to a new hold, by product id."""
+    return {
+        pk: max(inventory - reserved, 0)
+        for pk, inventory, reserved in Product.objects.filter(pk__in=product_ids)
+        .values_list('pk', 'inventory_quantity', 'reserved_quantity')
+    }
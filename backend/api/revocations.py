@@ -0,0 +1,123 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+# Revoked refresh tokens. Every rotation and logout adds a row to the
+# token_blacklist tables, so each process keeps a Bloom filter of the
+# blacklisted jtis: a token the filter has never seen is not looked up, and
+# only the filter's hits (revoked tokens, and about REVOCATION_ERROR_RATE of
+# the others) are checked against the table. The filter picks up tokens
+# revoked elsewhere every REVOCATION_SYNC_SECONDS by reading the rows added
+# since its last sync. In between, a token revoked by another process can
+# pass the check, but not its own rotation or logout: blacklisting a token
+# that already is blacklisted fails (api.authentication.RefreshToken).
+#
+# prune_expired() (the prune_expired_tokens command) deletes the rows of
+# expired tokens, which are refused on their exp claim anyway.
+
+PRUNE_BATCH_SIZE = 1000
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+class RevocationList:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.last_id = 0
+        self.synced_at = 0
+
+    def rebuild(self):
+        rows = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('id', 'token__jti')
+        capacity = max(settings.REVOCATION_CAPACITY, 2 * rows.count())
+        self.filter = BloomFilter(capacity, settings.REVOCATION_ERROR_RATE)
+        self.last_id = 0
+        self.add_rows(rows.order_by('id').iterator(chunk_size=PRUNE_BATCH_SIZE))
+
+    def add_rows(self, rows):
+        for pk, jti in rows:
+            self.filter.add(jti)
+            self.last_id = max(self.last_id, pk)
+
+    def sync(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.filter is not None and now - self.synced_at < settings.REVOCATION_SYNC_SECONDS:
+                return
+            latest = BlacklistedToken.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            # Full once per process, when the filter fills up, and when ids
+            # went back (a SQLite table pruned empty starts over at 1)
+            if self.filter is None or self.filter.count >= self.filter.capacity or latest < self.last_id:
+                self.rebuild()
+            elif latest > self.last_id:
+                self.add_rows(BlacklistedToken.objects.filter(id__gt=self.last_id).values_list('id', 'token__jti'))
+            self.synced_at = now
+
+    def add(self, jti):
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(jti)
+
+    def might_be_revoked(self, jti):
+        self.sync()
+        return jti in self.filter
+
+    def reset(self):
+        with self.lock:
+            self.filter = None
+            self.last_id = self.synced_at = 0
+
+
+revocations = RevocationList()
+
+
+def is_revoked(jti):
+    if not settings.REVOCATION_CACHE_ENABLED:
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+    return revocations.might_be_revoked(jti) and BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def prune_expired(now=None, batch_size=PRUNE_BATCH_SIZE, pause=0):
+    """
+    Delete expired outstanding tokens and their blacklist rows, batch_size
+    per transaction with pause seconds between batches. Returns the
+    outstanding tokens deleted.
+    """
+    now = now or timezone.now()
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(OutstandingToken.objects.filter(expires_at__lte=now).order_by().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            # The cascade deletes their blacklist rows with one statement
+            OutstandingToken.objects.filter(id__in=ids).only('id').delete()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
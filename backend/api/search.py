@@ -0,0 +1,88 @@
+import re
+from django.db import connections
+from django.db.models import BooleanField, F, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from .models import Product
+
+# Product search is backed by an inverted index created in migration 0006:
+#   - SQLite: the api_product_fts FTS5 table, kept in sync from the Product
+#     post_save/post_delete receivers in api.signals.
+#   - PostgreSQL: a generated tsvector column on api_product with a GIN index,
+#     maintained by the database itself.
+# Other backends fall back to the icontains scan.
+
+FTS_TABLE = 'api_product_fts'
+SEARCH_CONFIG = 'english'
+TOKEN_RE = re.compile(r'\w+')
+
+
+def search_tokens(text):
+    return TOKEN_RE.findall(text or '')
+
+
+def search_products(queryset, text):
+    """
+    Filter a Product queryset to matches for ``text`` and annotate each row
+    with ``search_rank`` (ascending = most relevant first). The last term is
+    matched as a prefix so partially typed words find results.
+    """
+    tokens = search_tokens(text)
+    if not tokens:
+        return queryset.none().annotate(search_rank=Value(0.0))
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        terms = ['"%s"' % token.replace('"', '""') for token in tokens]
+        terms[-1] += '*'
+        return queryset.filter(search_entry__document__match=' '.join(terms)).annotate(
+            search_rank=F('search_entry__rank')
+        )
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(tokens[:-1] + [f'{tokens[-1]}:*'])
+        return queryset.filter(
+            RawSQL(f"api_product.search_vector @@ to_tsquery('{SEARCH_CONFIG}', %s)", [tsquery], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(
+                f"-ts_rank(api_product.search_vector, to_tsquery('{SEARCH_CONFIG}', %s))", [tsquery], output_field=FloatField()
+            )
+        )
+
+    match = Q()
+    for token in tokens:
+        match &= Q(name__icontains=token) | Q(description__icontains=token) | Q(category__icontains=token)
+    return queryset.filter(match).annotate(search_rank=Value(0.0))
+
+
+def index_products(products, using='default'):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    rows = [(product.pk, product.name, product.description, product.category) for product in products]
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)', rows
+        )
+
+
+def remove_products(product_ids, using='default'):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+
+def rebuild_index(using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description, category) '
+                f'SELECT id, name, description, category FROM {Product._meta.db_table}'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        elif connection.vendor == 'postgresql':
+            cursor.execute('REINDEX INDEX api_product_search_idx')
+    return Product.objects.using(using).count()
@@ -1,13 +1,70 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Customer, Product, Order, OrderItem, CartItem, Review
-from django.db.models import Avg
+from . import images
+from .models import Customer, Product, Order, OrderItem, CartItem, Review, CatalogImport
+
+MAX_CART_CHANGES = 100
+
+
+def split_param(value):
+    return {part.strip() for part in (value or '').split(',') if part.strip()}
+
+
+def fieldset_context(params):
+    """
+    Serializer context for the sparse fieldset query parameters:
+    ``?fields=id,name,product.price`` keeps only the listed fields (dotted
+    paths reach into nested objects) and ``?expand=reviews`` adds the
+    expandable fields that are left out by default.
+    """
+    fields = split_param(params.get('fields'))
+    return {'fields': fields or None, 'expand': split_param(params.get('expand'))}
+
+
+class SparseFieldsMixin:
+    """
+    Prunes a serializer's fields according to fieldset_context(). Fields
+    named in Meta.expandable are only included when expanded.
+    """
+
+    def field_path(self):
+        path, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        return list(reversed(path))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in getattr(self.Meta, 'expandable', ()):
+            if name not in self.context.get('expand', ()):
+                fields.pop(name, None)
+
+        requested = self.context.get('fields')
+        if requested is None:
+            return fields
+        path = self.field_path()
+        # A requested ancestor (e.g. ``product``) keeps this object whole
+        if any('.'.join(path[:depth]) in requested for depth in range(1, len(path) + 1)):
+            return fields
+        prefix = ''.join(f'{part}.' for part in path)
+        return {
+            name: field for name, field in fields.items()
+            if f'{prefix}{name}' in requested or any(r.startswith(f'{prefix}{name}.') for r in requested)
+        }
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email']
 
+class PublicUserSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+
 class CustomerSerializer(serializers.ModelSerializer):
     user = UserSerializer()
 
@@ -15,45 +72,93 @@ class CustomerSerializer(serializers.ModelSerializer):
         model = Customer
         fields = ['user', 'billing_address', 'shipping_address', 'credit_card_info']
 
-class ReviewSerializer(serializers.ModelSerializer):
-    customer = CustomerSerializer(read_only=True)
+# What other shoppers see of a review's author
+class ReviewerSerializer(serializers.ModelSerializer):
+    user = PublicUserSerializer()
+
+    class Meta:
+        model = Customer
+        fields = ['user']
+
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    customer = ReviewerSerializer(read_only=True)
 
     class Meta:
         model = Review
         fields = ['id', 'customer', 'product', 'rating', 'review', 'created_at']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     reviews = ReviewSerializer(many=True, read_only=True)
+    image_variants = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     review_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['rating_sum', 'reserved_quantity']
+        expandable = ['reviews']
 
     def get_average_rating(self, obj):
-        return obj.reviews.aggregate(avg_rating=Avg('rating'))['avg_rating']
+        return obj.average_rating if obj.review_count else None
     
     def get_review_count(self, obj):
-        return obj.reviews.count()
+        return obj.review_count
 
-class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True) 
+    def get_image_variants(self, obj):
+        return images.variant_urls(obj.image.name, obj.image_variants)
+
+# Product listings, cart lines and order lines
+class ProductSummarySerializer(ProductSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'price', 'category', 'image', 'image_variants', 'inventory_quantity', 'average_rating', 'review_count', 'reviews']
+        expandable = ['reviews']
+
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product = ProductSummarySerializer(read_only=True) 
 
     class Meta:
         model = CartItem
         fields = '__all__'
 
-class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class CartChangeSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    # 0 removes the line
+    quantity = serializers.IntegerField(min_value=0)
+
+class CartBatchSerializer(serializers.Serializer):
+    items = CartChangeSerializer(many=True, allow_empty=False, max_length=MAX_CART_CHANGES)
+
+class ReviewInputSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+    review = serializers.CharField(allow_blank=True, default='')
+
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    product = ProductSummarySerializer(read_only=True)
     class Meta:
         model = OrderItem
         fields = '__all__'
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     customer = CustomerSerializer(read_only=True)
 
     class Meta:
         model = Order
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+# One row of a catalog import file (api.imports). sku uniqueness is left to
+# the upsert, and image is the source to fetch rather than a stored file.
+class ProductImportSerializer(serializers.ModelSerializer):
+    image = serializers.CharField(max_length=500)
+
+    class Meta:
+        model = Product
+        fields = ['sku', 'name', 'description', 'price', 'category', 'image', 'inventory_quantity']
+        extra_kwargs = {'sku': {'required': True, 'allow_null': False, 'allow_blank': False, 'validators': []}}
+
+class CatalogImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CatalogImport
+        fields = '__all__'
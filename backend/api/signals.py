@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import authentication, images, reservations, search
+from .cache import invalidate_products_on_commit
+from .models import CartItem, Customer, Product, Review
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, **kwargs):
+    search.index_products([instance], using=using)
+    invalidate_products_on_commit([instance.pk])
+    if instance.image and not images.is_current(instance.image.name, instance.image_variants):
+        images.schedule_on_commit([instance.image.name])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    search.remove_products([instance.pk], using=using)
+    invalidate_products_on_commit([instance.pk])
+
+
+# Product.rating_sum / review_count follow every Review save and delete,
+# whether it comes from add_review, the admin or the ORM. Fixture loads
+# (raw) carry their own aggregates; bulk writes skip signals and are
+# repaired by rebuild_product_ratings.
+
+@receiver(pre_save, sender=Review)
+def remember_stored_rating(sender, instance, raw, **kwargs):
+    stored = Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first() if instance.pk else None
+    instance._stored_rating = None if raw else stored
+
+
+@receiver(post_save, sender=Review)
+def record_review_rating(sender, instance, created, raw, **kwargs):
+    invalidate_products_on_commit([instance.product_id])
+    if raw:
+        return
+    stored = None if created else instance._stored_rating
+    if stored is None:
+        Product.objects.filter(pk=instance.product_id).record_rating(instance.rating, 1)
+        return
+    product_id, rating = stored
+    if product_id != instance.product_id:
+        Product.objects.filter(pk=product_id).record_rating(-rating, -1)
+        Product.objects.filter(pk=instance.product_id).record_rating(instance.rating, 1)
+        invalidate_products_on_commit([product_id])
+    elif rating != instance.rating:
+        Product.objects.filter(pk=product_id).record_rating(instance.rating - rating, 0)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).record_rating(-instance.rating, -1)
+    invalidate_products_on_commit([instance.product_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user(sender, instance, **kwargs):
+    authentication.forget_on_commit(instance.pk)
+
+
+# Deleting a customer (or its user) cascades to the cart lines, which
+# would leave their holds counted in Product.reserved_quantity; the views
+# and checkout release or convert holds themselves before deleting lines.
+@receiver(pre_delete, sender=Customer)
+def release_cart_holds(sender, instance, **kwargs):
+    reservations.release(
+        CartItem.objects.select_for_update().filter(customer=instance, reserved_quantity__gt=0)
+        .only('pk', 'product_id', 'reserved_quantity')
+    )
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def forget_customer(sender, instance, **kwargs):
+    authentication.forget_on_commit(instance.user_id)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma, value in settings.SQLITE_PRAGMAS.items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
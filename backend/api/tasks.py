@@ -0,0 +1,119 @@
+import datetime
+import logging
+import random
+import traceback
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Task
+
+# A database-backed task queue. enqueue() inserts a row in the caller's
+# transaction, so work queued by a request exists exactly when the request's
+# writes committed; the run_tasks worker claims due rows and calls the
+# function they name with their payload.
+#
+# Tasks run at least once: a failure is retried after an exponential
+# backoff (TASK_RETRY_DELAY doubling per attempt, up to
+# TASK_RETRY_MAX_DELAY) until max_attempts, and a task whose worker died is
+# run again once its TASK_LEASE_SECONDS lease has passed. Task functions
+# must therefore be safe to run twice.
+
+BATCH_SIZE = 20
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(func, key=None, delay=0, max_attempts=None, **payload):
+    """
+    Queue func(**payload) (a module-level function, payload JSON-serializable).
+    With key, only the first task enqueued with that key is kept. Returns
+    the Task.
+    """
+    fields = {
+        'name': f'{func.__module__}.{func.__qualname__}',
+        'payload': payload,
+        'run_at': timezone.now() + datetime.timedelta(seconds=delay),
+        'max_attempts': max_attempts or settings.TASK_MAX_ATTEMPTS,
+    }
+    if key is None:
+        return Task.objects.create(**fields)
+    task, _ = Task.objects.get_or_create(idempotency_key=key, defaults=fields)
+    return task
+
+
+def retry_delay(attempts):
+    delay = min(settings.TASK_RETRY_DELAY * 2 ** (attempts - 1), settings.TASK_RETRY_MAX_DELAY)
+    # Jitter, so tasks that failed together are not retried together
+    return random.uniform(delay / 2, delay)
+
+
+def due(now):
+    return Q(status='pending', run_at__lte=now) | Q(status='running', locked_until__lte=now)
+
+
+def claim(limit=BATCH_SIZE):
+    """
+    Mark up to limit due tasks as running on this worker and return them.
+    Each is taken with a conditional UPDATE, so two workers never claim the
+    same task.
+    """
+    now = timezone.now()
+    # Leases that ran out on the last attempt: the task keeps killing its worker
+    Task.objects.filter(status='running', locked_until__lte=now, attempts__gte=F('max_attempts')).update(
+        status='failed', last_error='Lease expired on the last attempt.', finished_at=now,
+    )
+    candidates = list(Task.objects.filter(due(now)).order_by('run_at').values_list('pk', flat=True)[:limit])
+    lease = now + datetime.timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    claimed = [
+        pk for pk in candidates
+        if Task.objects.filter(due(now), pk=pk).update(status='running', locked_until=lease, attempts=F('attempts') + 1)
+    ]
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_at'))
+
+
+def run(task):
+    """Run a claimed task and record the outcome. Returns True if it succeeded."""
+    # Matching attempts: if the lease ran out and another worker took the
+    # task over, its outcome is the one recorded
+    claimed = Task.objects.filter(pk=task.pk, attempts=task.attempts)
+    try:
+        import_string(task.name)(**task.payload)
+    except Exception:
+        logger.exception('Task %s (%s) failed on attempt %s', task.pk, task.name, task.attempts)
+        error = traceback.format_exc()
+        if task.attempts >= task.max_attempts:
+            claimed.update(status='failed', last_error=error, locked_until=None, finished_at=timezone.now())
+        else:
+            run_at = timezone.now() + datetime.timedelta(seconds=retry_delay(task.attempts))
+            claimed.update(status='pending', last_error=error, locked_until=None, run_at=run_at)
+        return False
+    claimed.update(status='done', locked_until=None, finished_at=timezone.now())
+    return True
+
+
+def run_in_thread(task):
+    # Worker threads each have their own connection; close it when it is stale
+    try:
+        return run(task)
+    finally:
+        close_old_connections()
+
+
+def run_due(limit=BATCH_SIZE, executor=None):
+    """Claim and run up to limit due tasks, on executor's threads if given. Returns how many ran."""
+    tasks = claim(limit)
+    if executor is None:
+        for task in tasks:
+            run(task)
+    else:
+        list(executor.map(run_in_thread, tasks))
+    return len(tasks)
+
+
+def prune_finished(older_than):
+    """Delete tasks that finished (done or failed) more than older_than seconds ago."""
+    cutoff = timezone.now() - datetime.timedelta(seconds=older_than)
+    deleted, _ = Task.objects.filter(status__in=['done', 'failed'], finished_at__lte=cutoff).delete()
+    return deleted
@@ -1,3 +1,2120 @@
-from django.test import TestCase
+from urllib.parse import parse_qs, urlencode, urlparse
+from io import BytesIO, StringIO
+import base64
+import csv
+import datetime
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache as django_cache
+from django.core import mail
+from django.core.management import CommandError, call_command
+import random
+import threading
+import time
+from unittest import skipUnless
+from django.db import IntegrityError, OperationalError, connection, connections, transaction
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, UntypedToken
+from . import authentication, benchmarking, cache, carts, checks, exports, fast_serializers, idempotency, imports, media, metrics, replicas, reservations, revocations, tasks
+from .checkout import InsufficientStock, place_order
+from .middleware import QueryCollector
+from .serializers import ProductSummarySerializer
+from .models import Customer, Product, Order, OrderItem, CartItem, Review, CatalogImport, Task, IdempotencyKey
 
-# Create your tests here.
+
+def create_customer(username='shopper'):
+    user = User.objects.create_user(username=username, password='secret-pass', email=f'{username}@example.com')
+    return Customer.objects.create(user=user)
+
+
+def create_products(count, reviews_per_product=0, category='Toys', start=0):
+    products = [
+        Product.objects.create(
+            name=f'Product {i}',
+            description=f'Description for product {i}',
+            price=f'{10 + i}.00',
+            category=category,
+            image='product_images/Sample_Image.jpg',
+            inventory_quantity=100,
+        )
+        for i in range(start, start + count)
+    ]
+    for n in range(reviews_per_product):
+        reviewer = create_customer(f'reviewer-{category}-{start}-{n}')
+        for product in products:
+            Review.objects.create(customer=reviewer, product=product, rating=(n % 5) + 1, review='Nice')
+    Product.objects.filter(pk__in=[p.pk for p in products]).rebuild_rating_stats()
+    return products
+
+
+# Response caching is covered by CatalogCacheTests
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class ProductQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def assertConstantQueries(self, url, num, seed_more):
+        with self.assertNumQueries(num):
+            self.client.get(url)
+        seed_more()
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        return response
+
+    def test_list_products_query_count_is_constant(self):
+        create_products(1, reviews_per_product=1)
+        response = self.assertConstantQueries(
+            reverse('list_products') + '?expand=reviews', 2,
+            lambda: create_products(5, reviews_per_product=3, start=1),
+        )
+        results = response.data['results']
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[1]['review_count'], 3)
+        self.assertEqual(results[1]['average_rating'], 2.0)
+        self.assertEqual(results[1]['reviews'][0]['customer']['user']['username'], 'reviewer-Toys-1-0')
+
+    def test_filter_products_query_count_is_constant(self):
+        create_products(1, reviews_per_product=1)
+        self.assertConstantQueries(
+            reverse('filter_products') + '?category=Toys&sort_by=price_desc&expand=reviews', 2,
+            lambda: create_products(5, reviews_per_product=3, start=1),
+        )
+
+    def test_product_detail_and_reviews_query_count_is_constant(self):
+        product = create_products(1, reviews_per_product=1)[0]
+
+        def add_reviews():
+            for n in range(4):
+                Review.objects.create(customer=create_customer(f'extra-{n}'), product=product, rating=5)
+            Product.objects.filter(pk=product.pk).rebuild_rating_stats()
+
+        self.assertConstantQueries(reverse('product_detail', args=[product.pk]) + '?expand=reviews', 2, add_reviews)
+        response = self.assertConstantQueries(reverse('product_reviews', args=[product.pk]), 2, lambda: None)
+        self.assertEqual(len(response.data['results']), 5)
+        # Without ?expand=reviews the reviews are neither fetched nor shipped
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('product_detail', args=[product.pk]))
+        self.assertNotIn('reviews', response.data)
+
+    def test_products_without_reviews(self):
+        create_products(1)
+        response = self.client.get(reverse('list_products'))
+        self.assertIsNone(response.data['results'][0]['average_rating'])
+        self.assertEqual(response.data['results'][0]['review_count'], 0)
+
+
+class CartAndOrderQueryCountTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+
+    def test_get_cart_query_count_is_constant(self):
+        products = create_products(6, reviews_per_product=2)
+        CartItem.objects.create(customer=self.customer, product=products[0], quantity=1)
+        url = reverse('get_cart') + '?expand=reviews'
+        # cart items, products, reviews (the customer comes with request.user)
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        for product in products[1:]:
+            CartItem.objects.create(customer=self.customer, product=product, quantity=2)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data), 6)
+
+    def test_order_history_query_count_is_constant(self):
+        products = create_products(4, reviews_per_product=2)
+
+        def place_order(items):
+            order = Order.objects.create(
+                customer=self.customer, total_price='10.00', shipping_address='a', billing_address='b', status='Pending'
+            )
+            for product in items:
+                OrderItem.objects.create(order=order, product=product, quantity=1)
+
+        place_order(products[:1])
+        url = reverse('order_history') + '?expand=reviews'
+        # orders + customer/user, items, products, reviews
+        with self.assertNumQueries(4):
+            self.client.get(url)
+        place_order(products)
+        place_order(products[2:])
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 3)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.customer.credit_card_info = {'cardNumber': '4111111111111111'}
+        self.customer.save()
+        self.products = create_products(2)
+        Review.objects.create(customer=self.customer, product=self.products[0], rating=4, review='Good')
+        CartItem.objects.create(customer=self.customer, product=self.products[0], quantity=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+
+    def test_listings_default_to_summaries(self):
+        product = self.client.get(reverse('list_products')).data['results'][0]
+        self.assertEqual(
+            set(product),
+            {'id', 'name', 'price', 'category', 'image', 'image_variants', 'inventory_quantity', 'average_rating', 'review_count'},
+        )
+        detail = self.client.get(reverse('product_detail', args=[self.products[0].pk])).data
+        self.assertIn('description', detail)
+        self.assertNotIn('reviews', detail)
+
+    def test_fields_select_top_level_and_nested_fields(self):
+        response = self.client.get(reverse('list_products') + '?fields=id,price')
+        self.assertEqual(response.data['results'][0], {'id': self.products[0].pk, 'price': '10.00'})
+        response = self.client.get(reverse('get_cart') + '?fields=quantity,product.name')
+        self.assertEqual(response.data, [{'quantity': 2, 'product': {'name': 'Product 0'}}])
+        response = self.client.get(reverse('get_cart') + '?fields=product')
+        self.assertEqual(response.data[0]['product']['id'], self.products[0].pk)
+
+    def test_expanded_reviews_hide_reviewer_details(self):
+        for url in [reverse('product_detail', args=[self.products[0].pk]), reverse('get_cart')]:
+            response = self.client.get(url + '?expand=reviews')
+            product = response.data if 'reviews' in response.data else response.data[0]['product']
+            self.assertEqual(
+                product['reviews'][0]['customer'], {'user': {'id': self.customer.user.pk, 'username': 'shopper'}}
+            )
+        response = self.client.get(reverse('product_reviews', args=[self.products[0].pk]))
+        self.assertNotIn('credit_card_info', response.data['results'][0]['customer'])
+
+    def test_orders_embed_product_summaries(self):
+        self.client.post(reverse('checkout'), {'shipping_address': 'a', 'billing_address': 'b'}, format='json')
+        order = self.client.get(reverse('order_history') + '?fields=id,items.quantity,items.product.name').data['results'][0]
+        self.assertEqual(set(order), {'id', 'items'})
+        self.assertEqual(order['items'], [{'quantity': 2, 'product': {'name': 'Product 0'}}])
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class FastSerializationTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.customer.shipping_address = 'Straße 1\u2028Floor 2'
+        self.customer.save()
+        self.products = create_products(5, reviews_per_product=2)
+        Product.objects.filter(pk=self.products[1].pk).update(name='Café \u2029 “Zoë”', price='3.50', image='')
+        create_products(2, category='Books', start=5)
+        for n in range(3):
+            order = Order.objects.create(
+                customer=self.customer, total_price=f'{n}9.90', shipping_address='a', billing_address='b', status='Approved'
+            )
+            for product in self.products[n:n + 2]:
+                OrderItem.objects.create(order=order, product=product, quantity=n + 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+
+    def assertSameBytes(self, url):
+        with override_settings(API_FAST_SERIALIZATION=False):
+            expected = self.client.get(url)
+        with override_settings(API_FAST_SERIALIZATION=True):
+            actual = self.client.get(url)
+        self.assertEqual(actual.status_code, expected.status_code)
+        self.assertEqual(actual['Content-Type'], expected['Content-Type'])
+        self.assertEqual(actual.content, expected.content, url)
+        # Only the serializer path returns a DRF Response
+        self.assertFalse(hasattr(actual, 'data'))
+        return actual
+
+    def test_fast_path_output_is_byte_identical(self):
+        for url in [
+            reverse('list_products'),
+            reverse('list_products') + '?page_size=2',
+            reverse('filter_products') + '?category=Toys&sort_by=price_asc&page_size=3',
+            reverse('filter_products') + '?sort_by=name_desc',
+            reverse('filter_products') + '?sort_by=rating_desc&min_rating=1',
+            reverse('filter_products') + '?search=product',
+            reverse('order_history'),
+            reverse('order_history') + '?page_size=2',
+        ]:
+            response = self.assertSameBytes(url)
+            if response.json()['next']:
+                self.assertSameBytes(response.json()['next'])
+
+    @override_settings(API_FAST_SERIALIZATION=True)
+    def test_fast_path_is_only_used_for_default_payloads(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('list_products'))
+        # orders with their customer, items, products
+        with self.assertNumQueries(3):
+            self.client.get(reverse('order_history'))
+        response = self.client.get(reverse('list_products') + '?expand=reviews')
+        self.assertEqual(len(response.data['results'][0]['reviews']), 2)
+        response = self.client.get(reverse('list_products') + '?fields=id')
+        self.assertEqual(set(response.data['results'][0]), {'id'})
+
+
+@override_settings(EXPORT_SAFETY_MARGIN=0)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.products = create_products(3, reviews_per_product=1)
+        self.order = Order.objects.create(
+            customer=self.customer, total_price='21.00', shipping_address='a', billing_address='b', status='Approved'
+        )
+        for product in self.products[:2]:
+            OrderItem.objects.create(order=self.order, product=product, quantity=2)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass'))
+
+    def export(self, name, query=''):
+        response = self.client.get(reverse('export_data', args=[name, 'ndjson']) + query)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_exports_are_admin_only(self):
+        self.client.force_authenticate(self.customer.user)
+        self.assertEqual(self.client.get(reverse('export_data', args=['orders', 'csv'])).status_code, 403)
+
+    def test_ndjson_orders_include_items(self):
+        [order] = self.export('orders')
+        self.assertEqual(order['id'], self.order.pk)
+        self.assertEqual(order['total_price'], '21.00')
+        self.assertEqual(order['items'], [{'product_id': p.pk, 'quantity': 2} for p in self.products[:2]])
+        self.assertEqual(len(self.export('products')), 3)
+        self.assertEqual(len(self.export('reviews')), 3)
+
+    def test_csv_has_one_line_per_order_item(self):
+        response = self.client.get(reverse('export_data', args=['orders', 'csv']))
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][-2:], ['item_product_id', 'item_quantity'])
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.order.pk)] * 2)
+
+    def test_watermarks_resume_after_the_last_row(self):
+        rows = self.export('products')
+        last = rows[1]
+        # Rows sharing the watermark timestamp are told apart by id
+        Product.objects.filter(pk=rows[2]['id']).update(updated_at=parse_datetime(last['updated_at']))
+        query = '?' + urlencode({'since': last['updated_at'], 'since_id': last['id']})
+        self.assertEqual([row['id'] for row in self.export('products', query)], [rows[2]['id']])
+        self.products[0].save()
+        self.assertEqual({row['id'] for row in self.export('products', query)}, {rows[2]['id'], self.products[0].pk})
+        response = self.client.get(reverse('export_data', args=['products', 'ndjson']) + '?since=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_records_watermark_between_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state, output = os.path.join(directory, 'state.json'), os.path.join(directory, 'reviews.ndjson')
+            call_command('export_data', 'reviews', output=output, state=state, stderr=StringIO())
+            with open(output) as f:
+                self.assertEqual(len(f.readlines()), 3)
+            Review.objects.create(customer=self.customer, product=self.products[0], rating=5)
+            call_command('export_data', 'reviews', output=output, state=state, stderr=StringIO())
+            with open(output) as f:
+                self.assertEqual([json.loads(line)['customer_id'] for line in f], [self.customer.pk])
+            # Re-reviewing edits the row, which is exported again
+            self.client.force_authenticate(self.customer.user)
+            self.client.post(reverse('add_review'), {'product_id': self.products[0].pk, 'rating': 2}, format='json')
+            call_command('export_data', 'reviews', output=output, state=state, stderr=StringIO())
+            with open(output) as f:
+                self.assertEqual([(row['customer_id'], row['rating']) for row in map(json.loads, f)], [(self.customer.pk, 2)])
+
+    def test_rebuilding_rating_stats_marks_products_changed(self):
+        rows = self.export('products')
+        query = '?' + urlencode({'since': rows[-1]['updated_at'], 'since_id': rows[-1]['id']})
+        Product.objects.filter(pk=self.products[0].pk).rebuild_rating_stats()
+        self.assertEqual([row['id'] for row in self.export('products', query)], [self.products[0].pk])
+
+    def test_rows_saved_within_the_margin_wait_for_the_next_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state, output = os.path.join(directory, 'state.json'), os.path.join(directory, 'reviews.ndjson')
+            with override_settings(EXPORT_SAFETY_MARGIN=60):
+                # Saved, but its transaction may still be open
+                call_command('export_data', 'reviews', output=output, state=state, stderr=StringIO())
+                with open(output) as f:
+                    self.assertEqual(f.read(), '')
+                self.assertEqual(self.export('reviews'), [])
+            # By the next run they are older than the margin (0 here stands for the time passing)
+            call_command('export_data', 'reviews', output=output, state=state, stderr=StringIO())
+            with open(output) as f:
+                self.assertEqual(len(f.readlines()), 3)
+
+
+# About a minute, most of it tracemalloc overhead; skip with --exclude-tag slow
+@tag('slow')
+@override_settings(EXPORT_SAFETY_MARGIN=0)
+class ExportMemoryTests(TestCase):
+    rows = 1_000_000
+    # Python heap peak while streaming; the rows themselves are ~400 MB of NDJSON
+    ceiling = 32 * 1024 * 1024
+
+    def test_million_row_export_runs_in_constant_memory(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < %s)
+                INSERT INTO api_product (name, description, price, category, image, image_variants,
+                                         inventory_quantity, reserved_quantity, rating_sum, review_count,
+                                         average_rating, updated_at)
+                SELECT 'Product ' || n, 'Synthetic product number ' || n, '9.99', 'Category ' || (n %% 20),
+                       'product_images/Sample_Image.jpg', '{}', 10, 0, 0, 0, 0, %s
+                FROM seq
+                """,
+                [self.rows, timezone.now()],
+            )
+        lines = size = 0
+        tracemalloc.start()
+        try:
+            for data in exports.export('products', 'ndjson'):
+                lines += data.count(b'\n')
+                size += len(data)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(lines, self.rows)
+        self.assertLess(peak, self.ceiling, f'peak {peak / 2**20:.1f} MB for {size / 2**20:.0f} MB exported')
+
+
+def write_lines(directory, name, lines):
+    path = os.path.join(directory, name)
+    with open(path, 'w', newline='') as f:
+        f.write(''.join(line + '\n' for line in lines))
+    return path
+
+
+@override_settings(IMAGE_WORKERS=0)
+class CatalogImportTests(TestCase):
+    header = 'sku,name,description,price,category,image,inventory_quantity'
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        media = override_settings(MEDIA_ROOT=os.path.join(self.directory.name, 'media'))
+        media.enable()
+        self.addCleanup(media.disable)
+        self.image_root = os.path.join(self.directory.name, 'supplier')
+        os.makedirs(self.image_root)
+        for name, color in [('red.png', 'red'), ('blue.png', 'blue')]:
+            Image.new('RGB', (8, 8), color).save(os.path.join(self.image_root, name))
+        with open(os.path.join(self.image_root, 'notes.png'), 'w') as f:
+            f.write('not an image')
+
+    def import_file(self, path, **options):
+        stdout = StringIO()
+        call_command('import_catalog', path, image_root=self.image_root, stdout=stdout, stderr=StringIO(), **options)
+        return CatalogImport.objects.latest('pk')
+
+    def test_upserts_by_sku_and_reports_rejected_rows(self):
+        existing = create_products(1, reviews_per_product=1)[0]
+        Product.objects.filter(pk=existing.pk).update(sku='B-2')
+        path = write_lines(self.directory.name, 'catalog.csv', [
+            self.header,
+            'A-1,Red Kite,Flies well,19.99,Toys,red.png,5',
+            'B-2,Blue Kite,Flies better,24.50,Toys,blue.png,7',
+            'C-3,Cheap Kite,Price is wrong,free,Toys,red.png,1',
+            'D-4,Paper Kite,Image is not one,4.00,Toys,notes.png,1',
+            'A-1,Red Kite XL,Flies well,21.99,Toys,red.png,3',
+        ])
+        job = self.import_file(path)
+
+        self.assertEqual((job.status, job.rows_processed), ('completed', 5))
+        self.assertEqual((job.created, job.updated, job.failed), (1, 2, 2))
+        self.assertEqual([(error['line'], error['sku']) for error in job.errors], [(4, 'C-3'), (5, 'D-4')])
+        self.assertIn('price', job.errors[0]['errors'])
+        self.assertIn('image', job.errors[1]['errors'])
+
+        kite = Product.objects.get(sku='A-1')
+        self.assertEqual((kite.name, str(kite.price), kite.inventory_quantity), ('Red Kite XL', '21.99', 3))
+        self.assertTrue(kite.image.name.startswith('product_images/hashed/import-'))
+        self.assertTrue(os.path.exists(kite.image.path))
+        updated = Product.objects.get(pk=existing.pk)
+        self.assertEqual((updated.name, updated.review_count), ('Blue Kite', 1))
+        self.assertGreater(updated.updated_at, existing.updated_at)
+        # bulk_create skips the signals; the importer indexes the rows itself
+        response = APIClient().get(reverse('filter_products'), {'search': 'kite'})
+        self.assertEqual({row['id'] for row in response.data['results']}, {kite.pk, updated.pk})
+
+        # A second run updates the same rows and reuses the copied images
+        images = os.listdir(os.path.dirname(kite.image.path))
+        job = self.import_file(path)
+        self.assertEqual((job.created, job.updated, job.failed), (0, 3, 2))
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(os.listdir(os.path.dirname(kite.image.path)), images)
+
+        # A changed source image is stored under a new name, not served stale
+        Image.new('RGB', (8, 8), 'green').save(os.path.join(self.image_root, 'red.png'))
+        self.import_file(path)
+        self.assertNotEqual(Product.objects.get(sku='A-1').image.name, kite.image.name)
+
+    def test_interrupted_import_resumes_from_its_checkpoint(self):
+        path = write_lines(self.directory.name, 'catalog.ndjson', [
+            json.dumps({'sku': f'S-{i}', 'name': f'Kite {i}', 'description': 'd', 'price': '1.00',
+                        'category': 'Toys', 'image': 'red.png', 'inventory_quantity': i})
+            for i in range(5)
+        ] + ['{"sku": "S-5", "name": '])
+        job = CatalogImport.objects.create(source=path, format='ndjson')
+
+        def interrupt(job, errors):
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            imports.run(job, batch_size=2, image_root=self.image_root, on_batch=interrupt)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_processed, job.created), ('failed', 2, 2))
+
+        call_command('import_catalog', resume=job.pk, batch_size=2, image_root=self.image_root,
+                     stdout=StringIO(), stderr=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_processed, job.created, job.failed), ('completed', 6, 5, 1))
+        self.assertEqual(job.errors[0]['line'], 6)
+        self.assertEqual(Product.objects.filter(sku__startswith='S-').count(), 5)
+
+    def test_admin_api_imports_uploaded_catalog(self):
+        client = APIClient()
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass')
+        client.force_authenticate(create_customer().user)
+        self.assertEqual(client.post(reverse('import_catalog')).status_code, 403)
+        client.force_authenticate(admin)
+
+        # Without an image root, images must already be in storage
+        with open(os.path.join(self.image_root, 'red.png'), 'rb') as f:
+            stored = Product._meta.get_field('image').storage.save('product_images/kite.png', f)
+        self.assertEqual(json.loads(client.get(reverse('list_products')).content)['results'], [])
+        upload = SimpleUploadedFile('catalog.ndjson', '\n'.join([
+            json.dumps({'sku': 'K-1', 'name': 'Kite', 'description': 'd', 'price': '5.00', 'category': 'Toys',
+                        'image': stored, 'inventory_quantity': 1}),
+            json.dumps({'sku': 'K-2', 'name': 'Kite', 'description': 'd', 'price': '5.00', 'category': 'Toys',
+                        'image': '../../etc/passwd', 'inventory_quantity': 1}),
+        ]).encode())
+        imports_root = override_settings(CATALOG_IMPORT_ROOT=os.path.join(self.directory.name, 'imports'))
+        with imports_root:
+            response = client.post(reverse('import_catalog'), {'file': upload}, format='multipart')
+        self.assertEqual((response.status_code, response.data['status']), (202, 'pending'))
+        # The worker runs it
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(tasks.run_due(), 1)
+        job = CatalogImport.objects.get(pk=response.data['id'])
+        self.assertEqual((job.created, job.failed), (1, 1))
+        # The cached product list was invalidated by the import
+        products = json.loads(client.get(reverse('list_products')).content)['results']
+        self.assertEqual([row['name'] for row in products], ['Kite'])
+
+        job_url = reverse('catalog_import', args=[response.data['id']])
+        self.assertEqual(client.get(job_url).data['status'], 'completed')
+        resume = client.post(reverse('resume_catalog_import', args=[response.data['id']]))
+        self.assertEqual(resume.status_code, 409)
+
+    def test_interrupted_running_import_is_resumed(self):
+        path = write_lines(self.directory.name, 'catalog.ndjson', [
+            json.dumps({'sku': f'S-{i}', 'name': f'Kite {i}', 'description': 'd', 'price': '1.00',
+                        'category': 'Toys', 'image': 'red.png', 'inventory_quantity': i})
+            for i in range(3)
+        ])
+        # A process that died mid-import leaves it running with its last lease
+        job = CatalogImport.objects.create(
+            source=path, format='ndjson', status='running', locked_until=timezone.now() + datetime.timedelta(minutes=1),
+        )
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass'))
+        url = reverse('resume_catalog_import', args=[job.pk])
+        self.assertEqual(client.post(url).status_code, 409)
+        with self.assertRaisesMessage(CommandError, 'running in another process'):
+            call_command('import_catalog', resume=job.pk, stdout=StringIO(), stderr=StringIO())
+
+        CatalogImport.objects.filter(pk=job.pk).update(locked_until=timezone.now())
+        self.assertEqual(client.post(url).status_code, 202)
+        self.assertEqual(client.post(url).status_code, 202)
+        # Of the two queued runs, the first claims the import and the second finds it completed
+        with self.settings(MEDIA_ROOT=os.path.join(self.directory.name, 'media')):
+            self.assertEqual(tasks.run_due(), 2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.rows_processed, job.locked_until), ('completed', 3, None))
+        self.assertEqual(Task.objects.filter(status='done').count(), 2)
+
+
+@override_settings(IMAGE_WORKERS=0, PRODUCT_IMAGE_SIZES={'thumb': 32, 'medium': 96})
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, name, size=(400, 200), color='red'):
+        output = BytesIO()
+        Image.new('RGB', size, color).save(output, 'PNG')
+        return SimpleUploadedFile(name, output.getvalue())
+
+    def create_product(self, image):
+        return Product.objects.create(
+            name='Kite', description='d', price='5.00', category='Toys', image=image, inventory_quantity=1
+        )
+
+    def test_saving_a_product_generates_hashed_webp_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product(self.upload('kite.png'))
+        product.refresh_from_db()
+        self.assertRegex(product.image.name, r'^product_images/hashed/kite-[0-9a-f]{16}\.png$')
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        for label, edge in [('thumb', 32), ('medium', 96)]:
+            name = product.image_variants[label]
+            self.assertRegex(name, rf'^product_images/derived/kite-[0-9a-f]{{16}}-{label}-[0-9a-f]{{16}}\.webp$')
+            with Image.open(product.image.storage.path(name)) as image:
+                self.assertEqual((image.format, max(image.size)), ('WEBP', edge))
+
+        data = APIClient().get(reverse('list_products')).data['results'][0]
+        self.assertEqual(data['image_variants'], {
+            'thumb': f"/media/{product.image_variants['thumb']}", 'medium': f"/media/{product.image_variants['medium']}",
+        })
+
+        # Same bytes under another name: same derivatives, nothing new written
+        with self.captureOnCommitCallbacks(execute=True):
+            other = self.create_product(self.upload('copy.png'))
+        other.refresh_from_db()
+        self.assertEqual(other.image_variants['thumb'].split('-')[-1], product.image_variants['thumb'].split('-')[-1])
+
+    def test_variants_of_a_replaced_image_are_not_served(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product(self.upload('kite.png'))
+        product.refresh_from_db()
+        old_thumb = product.image_variants['thumb']
+        product.image = self.upload('blue.png', color='blue')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            product.save()
+            self.assertEqual(ProductSummarySerializer(product).data['image_variants'], {})
+        self.assertEqual(len(callbacks), 2)
+        product.refresh_from_db()
+        self.assertNotEqual(product.image_variants['thumb'], old_thumb)
+        self.assertRegex(product.image_variants['thumb'], r'^product_images/derived/blue-[0-9a-f]{16}-thumb-')
+
+    def test_backfill_command_covers_products_without_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = self.create_product(self.upload('kite.png')).image.name
+        # bulk_create sends no post_save, like rows that predate derivatives
+        Product.objects.bulk_create([
+            Product(name=f'Kite {i}', description='d', price='5.00', category='Toys', image=image, inventory_quantity=1)
+            for i in range(3)
+        ])
+        stdout = StringIO()
+        call_command('generate_image_variants', workers=1, stdout=stdout)
+        self.assertIn('Processed 1 images for 3 products', stdout.getvalue())
+        self.assertFalse(Product.objects.filter(image_variants={}).exists())
+        stdout = StringIO()
+        call_command('generate_image_variants', workers=1, stdout=stdout)
+        self.assertIn('Processed 0 images', stdout.getvalue())
+
+
+class MediaServingTests(TestCase):
+    hashed = 'product_images/hashed/kite-0123456789abcdef.png'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name, MEDIA_SERVING='django')
+        media.enable()
+        self.addCleanup(media.disable)
+        os.makedirs(os.path.join(directory.name, 'product_images', 'hashed'))
+        self.content = bytes(range(256)) * 4
+        for name in [self.hashed, 'product_images/kite.png']:
+            with open(os.path.join(directory.name, name), 'wb') as f:
+                f.write(self.content)
+        self.root = directory.name
+
+    def get(self, name, **headers):
+        response = self.client.get(f'/media/{name}', headers=headers)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_whole_file_with_cache_headers(self):
+        response = self.get(self.hashed)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.content)
+        self.assertEqual((response['Content-Type'], response['Content-Length']), ('image/png', '1024'))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(self.get('product_images/kite.png')['Cache-Control'], 'public, max-age=3600')
+        # Only files the app stored under their content hash, not names that look hashed
+        for name in ['product_images/kite-0123456789abcdef.png', 'product_images/hashed/../kite.png']:
+            self.assertEqual(media.cache_control(name), 'public, max-age=3600')
+
+    def test_byte_ranges(self):
+        response = self.get(self.hashed, range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), self.content[10:20])
+        self.assertEqual((response['Content-Range'], response['Content-Length']), ('bytes 10-19/1024', '10'))
+        self.assertEqual(self.body(self.get(self.hashed, range='bytes=-5')), self.content[-5:])
+        self.assertEqual(self.body(self.get(self.hashed, range='bytes=1000-5000')), self.content[1000:])
+        response = self.get(self.hashed, range='bytes=1024-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */1024'))
+        # Several ranges, or a range for another version of the file: the whole file
+        self.assertEqual(self.get(self.hashed, range='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self.get(self.hashed, range='bytes=0-1', if_range='"stale"').status_code, 200)
+        etag = self.get(self.hashed)['ETag']
+        self.assertEqual(self.get(self.hashed, range='bytes=0-1', if_range=etag).status_code, 206)
+
+    def test_conditional_requests(self):
+        first = self.get(self.hashed)
+        self.assertEqual(self.get(self.hashed, if_none_match=first['ETag']).status_code, 304)
+        self.assertEqual(self.get(self.hashed, if_modified_since=first['Last-Modified']).status_code, 304)
+        self.assertEqual(self.get(self.hashed, if_none_match='"other"').status_code, 200)
+
+    def test_proxy_modes_hand_off_the_file(self):
+        with override_settings(MEDIA_SERVING='x-accel-redirect'):
+            response = self.get(self.hashed)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.hashed}')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_SERVING='x-sendfile'):
+            response = self.get(self.hashed)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.root, self.hashed))
+
+    def test_missing_and_outside_paths_are_not_found(self):
+        self.assertEqual(self.get('product_images/missing.png').status_code, 404)
+        self.assertEqual(self.get('product_images').status_code, 404)
+        self.assertEqual(self.get('../settings.py').status_code, 404)
+        self.assertEqual(self.client.post(f'/media/{self.hashed}').status_code, 405)
+
+
+class StatementRecorder:
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+class QueryPlanMixin:
+    """
+    Run EXPLAIN QUERY PLAN on every SELECT a request issues and fail if
+    any reads a whole table or sorts rows no index delivers in order.
+    """
+
+    def query_plans(self, method, url, **kwargs):
+        recorder = StatementRecorder()
+        with connection.execute_wrapper(recorder):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, url)
+        plans = []
+        with connection.cursor() as cursor:
+            for sql, params in recorder.statements:
+                if sql.lstrip().upper().startswith('SELECT'):
+                    cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                    plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertNoFullScans(self, method, url, **kwargs):
+        for sql, plan in self.query_plans(method, url, **kwargs):
+            for step in plan:
+                full_scan = step.startswith('SCAN ') and ' USING ' not in step and 'VIRTUAL TABLE' not in step
+                if full_scan or step.startswith('USE TEMP B-TREE') and 'ORDER BY' in step:
+                    self.fail(f'{method.upper()} {url}: "{step}" in plan of\n{sql}')
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def walk(self, url, follow='next'):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(product['id'] for product in response.data['results'])
+            url = response.data[follow]
+        return seen
+
+    def test_pages_cover_every_product_once_in_sort_order(self):
+        products = create_products(7)
+        # Duplicate prices and mixed-case names exercise the id tiebreaker
+        Product.objects.filter(pk__in=[p.pk for p in products[:3]]).update(price='15.00')
+        Product.objects.filter(pk=products[4].pk).update(name='product 4')
+        for sort_by, key in [
+            ('price_asc', lambda p: (p.price, p.pk)),
+            ('price_desc', lambda p: (-p.price, -p.pk)),
+            ('name_asc', lambda p: (p.name.lower(), p.pk)),
+            ('name_desc', lambda p: (p.name.lower(), p.pk)),
+        ]:
+            expected = [p.pk for p in sorted(Product.objects.all(), key=key, reverse=sort_by == 'name_desc')]
+            url = reverse('filter_products') + f'?sort_by={sort_by}&page_size=3'
+            self.assertEqual(self.walk(url), expected, sort_by)
+
+    def test_previous_link_walks_back(self):
+        products = create_products(5)
+        first = self.client.get(reverse('list_products') + '?page_size=2')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        third = self.client.get(second.data['next'])
+        self.assertIsNone(third.data['next'])
+        back = self.client.get(third.data['previous'])
+        self.assertEqual(back.data['results'], second.data['results'])
+        self.assertEqual(self.walk(second.data['previous'], follow='previous'), [p.pk for p in products[:2]])
+
+    def test_deep_pages_use_a_seek_instead_of_an_offset(self):
+        create_products(6)
+        first = self.client.get(reverse('filter_products') + '?sort_by=price_asc&page_size=2')
+        with self.assertNumQueries(1) as ctx:
+            self.client.get(first.data['next'])
+        self.assertNotIn('OFFSET', ctx.captured_queries[0]['sql'])
+
+    @override_settings(REST_FRAMEWORK={'PAGE_SIZE': 4})
+    def test_page_size_is_configurable_and_capped(self):
+        create_products(6)
+        self.assertEqual(len(self.client.get(reverse('list_products')).data['results']), 4)
+        response = self.client.get(reverse('list_products') + '?page_size=1000')
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_cursor_from_another_ordering_is_rejected(self):
+        create_products(3)
+        first = self.client.get(reverse('filter_products') + '?sort_by=price_asc&page_size=1')
+        cursor = parse_qs(urlparse(first.data['next']).query)['cursor'][0]
+        response = self.client.get(reverse('filter_products'), {'sort_by': 'name_asc', 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('list_products') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_with_a_null_or_mistyped_value_is_rejected(self):
+        create_products(3)
+        def encode(cursor):
+            return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+        for sort_by, field, value in [
+            ('price_asc', 'price', None), ('price_asc', 'price', 'cheap'), ('price_asc', 'price', 'NaN'),
+            ('rating_desc', 'average_rating', [4]), ('name_asc', 'name_lower', {'a': 1}),
+        ]:
+            cursor = encode({'f': field, 'v': value, 'id': 1, 'r': False})
+            response = self.client.get(reverse('filter_products'), {'sort_by': sort_by, 'cursor': cursor})
+            self.assertEqual((response.status_code, response.data['detail']), (400, 'Invalid cursor'))
+        # Ids JSON can carry but the database cannot
+        for pk in [float('inf'), 2 ** 63, -2 ** 63 - 1]:
+            cursor = encode({'f': 'id', 'v': None, 'id': pk, 'r': False})
+            response = self.client.get(reverse('list_products'), {'cursor': cursor})
+            self.assertEqual((response.status_code, response.data['detail']), (400, 'Invalid cursor'))
+        self.client.force_authenticate(create_customer().user)
+        cursor = encode({'f': 'created_at', 'v': 'yesterday', 'id': 1, 'r': False})
+        self.assertEqual(self.client.get(reverse('order_history'), {'cursor': cursor}).status_code, 400)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.product = create_products(1)[0]
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+
+    def review(self, rating, client=None):
+        response = (client or self.client).post(
+            reverse('add_review'), {'product_id': self.product.pk, 'rating': rating}, format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.product.refresh_from_db()
+
+    def test_add_review_updates_aggregates_incrementally(self):
+        self.review(4)
+        self.assertEqual((self.product.rating_sum, self.product.review_count, self.product.average_rating), (4, 1, 4.0))
+
+        other = APIClient()
+        other.force_authenticate(create_customer('second').user)
+        self.review(1, client=other)
+        self.assertEqual((self.product.rating_sum, self.product.review_count, self.product.average_rating), (5, 2, 2.5))
+
+        # Re-reviewing replaces the earlier rating instead of adding to it
+        self.review(2)
+        self.assertEqual((self.product.rating_sum, self.product.review_count, self.product.average_rating), (3, 2, 1.5))
+
+    def test_invalid_ratings_are_rejected(self):
+        for data in [{}, {'rating': 'five'}, {'rating': 0}, {'rating': -5}, {'rating': 99}, {'rating': 4.5}]:
+            response = self.client.post(reverse('add_review'), {'product_id': self.product.pk, **data}, format='json')
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn('rating', response.data)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.review_count), (0, 0))
+        self.assertFalse(Review.objects.exists())
+
+    def test_deleting_a_review_updates_aggregates(self):
+        self.review(5)
+        Review.objects.get(customer=self.customer).delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.review_count, self.product.average_rating), (0, 0, 0.0))
+        response = self.client.get(reverse('product_detail', args=[self.product.pk]))
+        self.assertIsNone(response.data['average_rating'])
+
+    def test_orm_review_writes_keep_aggregates(self):
+        def totals(product):
+            product.refresh_from_db()
+            return product.rating_sum, product.review_count, product.average_rating
+
+        review = Review.objects.create(customer=self.customer, product=self.product, rating=4)
+        self.assertEqual(totals(self.product), (4, 1, 4.0))
+        review.rating = 2
+        review.save()
+        self.assertEqual(totals(self.product), (2, 1, 2.0))
+        # Moving a review takes its rating along
+        other = create_products(1, start=1)[0]
+        review.product = other
+        review.save()
+        self.assertEqual((totals(self.product), totals(other)), ((0, 0, 0.0), (2, 1, 2.0)))
+        review.delete()
+        self.assertEqual(totals(other), (0, 0, 0.0))
+
+    def test_rebuild_command_repairs_drift(self):
+        Review.objects.create(customer=self.customer, product=self.product, rating=3)
+        Product.objects.update(rating_sum=40, review_count=7, average_rating=1.0)
+        out = StringIO()
+        call_command('rebuild_product_ratings', batch_size=1, stdout=out)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.review_count, self.product.average_rating), (3, 1, 3.0))
+        self.assertIn('1 products', out.getvalue())
+
+    def test_products_sort_and_filter_by_stored_rating(self):
+        low, high = create_products(2, start=1)
+        Review.objects.create(customer=self.customer, product=low, rating=2)
+        Review.objects.create(customer=self.customer, product=high, rating=5)
+        Product.objects.rebuild_rating_stats()
+        response = self.client.get(reverse('filter_products') + '?sort_by=rating_desc')
+        self.assertEqual([p['id'] for p in response.data['results']], [high.pk, low.pk, self.product.pk])
+        response = self.client.get(reverse('filter_products') + '?min_rating=3')
+        self.assertEqual([p['id'] for p in response.data['results']], [high.pk])
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class ProductFacetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for name, category, price, ratings in [
+            ('Lego castle', 'Toys', '8.00', [5, 4]),
+            ('Lego truck', 'Toys', '30.00', [3]),
+            ('Teddy bear', 'Toys', '30.00', []),
+            ('Lego manual', 'Books', '12.00', [2]),
+            ('Atlas', 'Books', '600.00', [5]),
+        ]:
+            product = Product.objects.create(
+                name=name, description='', price=price, category=category,
+                image='product_images/Sample_Image.jpg', inventory_quantity=1,
+            )
+            Product.objects.filter(pk=product.pk).record_rating(sum(ratings), len(ratings))
+
+    def facets(self, **params):
+        response = self.client.get(reverse('product_facets'), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        return (
+            data['total'],
+            {row['category']: row['count'] for row in data['categories']},
+            {row['min_price']: row['count'] for row in data['price'] if row['count']},
+            {row['min_rating']: row['count'] for row in data['rating']},
+        )
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            total, categories, prices, ratings = self.facets()
+        self.assertEqual(total, 5)
+        self.assertEqual(categories, {'Books': 2, 'Toys': 3})
+        self.assertEqual(prices, {0: 1, 10: 1, 25: 2, 500: 1})
+        self.assertEqual(ratings, {4: 2, 3: 3, 2: 4, 1: 4})
+
+    def test_each_facet_ignores_its_own_filter(self):
+        total, categories, prices, ratings = self.facets(category='Toys', min_rating='3')
+        self.assertEqual(total, 2)
+        self.assertEqual(categories, {'Books': 1, 'Toys': 2})
+        self.assertEqual(prices, {0: 1, 25: 1})
+        self.assertEqual(ratings, {4: 1, 3: 2, 2: 2, 1: 2})
+
+        total, categories, prices, _ = self.facets(search='lego', min_price='25', max_price='50')
+        self.assertEqual((total, categories, prices), (1, {'Toys': 1}, {0: 1, 10: 1, 25: 1}))
+
+    def test_bucket_edges_select_the_bucket_products(self):
+        response = self.client.get(reverse('filter_products'), {'min_price': '25', 'max_price': '50'})
+        self.assertEqual(sorted(p['name'] for p in response.data['results']), ['Lego truck', 'Teddy bear'])
+        self.assertEqual(self.client.get(reverse('product_facets'), {'max_price': 'cheap'}).status_code, 400)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def search(self, text, **params):
+        response = self.client.get(reverse('filter_products'), {'search': text, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def create(self, name, description='', category='Toys'):
+        return Product.objects.create(
+            name=name, description=description, price='5.00', category=category,
+            image='product_images/Sample_Image.jpg', inventory_quantity=1,
+        )
+
+    def test_matches_are_ranked_with_name_hits_first(self):
+        self.create('Plain box', description='Works with lego bricks')
+        self.create('Lego castle')
+        self.create('Teddy bear')
+        self.assertEqual(self.search('lego'), ['Lego castle', 'Plain box'])
+        self.assertEqual(self.search('lego', sort_by='name_asc'), ['Lego castle', 'Plain box'])
+        first = self.client.get(reverse('filter_products'), {'search': 'lego', 'page_size': 1})
+        second = self.client.get(first.data['next'])
+        self.assertEqual([p['name'] for p in second.data['results']], ['Plain box'])
+        self.assertIsNone(second.data['next'])
+
+    def test_last_term_matches_as_prefix(self):
+        self.create('Racing car', category='Vehicles')
+        self.create('Race track')
+        self.assertEqual(self.search('vehic'), ['Racing car'])
+        self.assertEqual(sorted(self.search('rac')), ['Race track', 'Racing car'])
+        self.assertEqual(self.search('racing c'), ['Racing car'])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        product = self.create('Kite')
+        self.assertEqual(self.search('kite'), ['Kite'])
+        product.name = 'Glider'
+        product.save()
+        self.assertEqual(self.search('kite'), [])
+        self.assertEqual(self.search('glider'), ['Glider'])
+        product.delete()
+        self.assertEqual(self.search('glider'), [])
+
+    def test_rebuild_command_reindexes_bulk_writes(self):
+        Product.objects.bulk_create([
+            Product(name=f'Puzzle {i}', description='', price='1.00', category='Games', image='x.jpg', inventory_quantity=1)
+            for i in range(3)
+        ])
+        self.assertEqual(self.search('puzzle'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search('puzzle')), 3)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+        self.products = create_products(3)
+
+    def test_checkout_creates_order_and_decrements_stock(self):
+        for product in self.products:
+            CartItem.objects.create(customer=self.customer, product=product, quantity=2)
+        # Locked cart read, one stock UPDATE, order insert, bulk item insert,
+        # cart delete and the confirmation task insert inside savepoints; the
+        # order re-read for the response. None of it grows with the number
+        # of cart lines.
+        with self.assertNumQueries(13):
+            response = self.client.post(reverse('checkout'), {'shipping_address': 'Here', 'billing_address': 'There'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['total_price'], '66.00')
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('inventory_quantity', flat=True)), [98, 98, 98]
+        )
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(Task.objects.get().payload, {'order_id': response.data['id']})
+
+    def test_insufficient_stock_rolls_back_everything(self):
+        CartItem.objects.create(customer=self.customer, product=self.products[0], quantity=5)
+        CartItem.objects.create(customer=self.customer, product=self.products[1], quantity=500)
+        response = self.client.post(reverse('checkout'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Not enough stock for Product 1')
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).inventory_quantity, 100)
+        self.assertEqual(CartItem.objects.count(), 2)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Task.objects.exists())
+
+    def test_empty_cart(self):
+        response = self.client.post(reverse('checkout'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['detail'], 'Cart is empty')
+
+
+# Calls by marker, for the task queue tests
+task_calls = {}
+
+
+def flaky_task(marker, failures):
+    task_calls[marker] = task_calls.get(marker, 0) + 1
+    if task_calls[marker] <= failures:
+        raise RuntimeError(f'{marker} failed')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        task_calls.clear()
+
+    def make_due(self):
+        Task.objects.update(run_at=timezone.now())
+
+    def test_checkout_confirmation_is_sent_by_the_worker(self):
+        customer = create_customer()
+        product = create_products(1)[0]
+        CartItem.objects.create(customer=customer, product=product, quantity=2)
+        order = place_order(customer, 'a', 'b', 'Pending')
+        self.assertEqual(mail.outbox, [])
+
+        self.assertEqual(tasks.run_due(), 1)
+        self.assertEqual(mail.outbox[0].to, ['shopper@example.com'])
+        self.assertEqual(mail.outbox[0].subject, f'Your order #{order.pk}')
+        self.assertIn('2 x Product 0: 20.00', mail.outbox[0].body)
+        self.assertEqual(Task.objects.get().status, 'done')
+        self.assertEqual(tasks.run_due(), 0)
+
+    @override_settings(TASK_RETRY_DELAY=60)
+    def test_failures_are_retried_with_backoff(self):
+        tasks.enqueue(flaky_task, marker='flaky', failures=2)
+        tasks.run_due()
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), ('pending', 1))
+        self.assertIn('RuntimeError: flaky failed', task.last_error)
+        self.assertGreaterEqual(task.run_at, timezone.now() + datetime.timedelta(seconds=25))
+        # Not due yet
+        self.assertEqual(tasks.run_due(), 0)
+
+        self.make_due()
+        tasks.run_due()
+        second = Task.objects.get()
+        # The second retry waits up to twice as long
+        self.assertGreater(second.run_at - timezone.now(), datetime.timedelta(seconds=55))
+        self.make_due()
+        tasks.run_due()
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts, task_calls['flaky']), ('done', 3, 3))
+
+    def test_tasks_fail_for_good_after_max_attempts(self):
+        tasks.enqueue(flaky_task, max_attempts=2, marker='broken', failures=10)
+        tasks.run_due()
+        self.make_due()
+        tasks.run_due()
+        self.make_due()
+        self.assertEqual(tasks.run_due(), 0)
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), ('failed', 2))
+        self.assertIsNotNone(task.finished_at)
+
+    def test_idempotency_key_queues_once(self):
+        first = tasks.enqueue(flaky_task, key='once', marker='a', failures=0)
+        second = tasks.enqueue(flaky_task, key='once', marker='b', failures=0)
+        self.assertEqual(first.pk, second.pk)
+        tasks.run_due()
+        self.assertEqual(task_calls, {'a': 1})
+
+    def test_expired_lease_is_taken_over(self):
+        tasks.enqueue(flaky_task, marker='slow', failures=0)
+        [stalled] = tasks.claim()
+        self.assertEqual(tasks.claim(), [])
+        Task.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        [taken_over] = tasks.claim()
+        self.assertEqual(taken_over.attempts, 2)
+        # The stalled worker finishing late does not overwrite the new run
+        tasks.run(stalled)
+        self.assertEqual(Task.objects.get().status, 'running')
+        tasks.run(taken_over)
+        self.assertEqual(Task.objects.get().status, 'done')
+
+    def test_prune_finished(self):
+        tasks.enqueue(flaky_task, marker='old', failures=0)
+        tasks.enqueue(flaky_task, marker='new', failures=0)
+        tasks.run_due()
+        Task.objects.filter(payload__marker='old').update(finished_at=timezone.now() - datetime.timedelta(days=8))
+        self.assertEqual(tasks.prune_finished(7 * 86400), 1)
+        self.assertEqual(Task.objects.get().payload['marker'], 'new')
+
+
+class TaskWorkerTests(TransactionTestCase):
+    def setUp(self):
+        task_calls.clear()
+
+    def test_worker_threads_run_each_task_once(self):
+        for i in range(30):
+            tasks.enqueue(flaky_task, marker=f'task-{i}', failures=0)
+        out = StringIO()
+        call_command('run_tasks', '--once', '--workers', '4', stdout=out)
+        self.assertEqual(Task.objects.filter(status='done').count(), 30)
+        self.assertEqual(task_calls, {f'task-{i}': 1 for i in range(30)})
+        self.assertIn('Ran 20 tasks.', out.getvalue())
+
+
+# Committed product saves would otherwise write derivatives into MEDIA_ROOT
+@override_settings(PRODUCT_IMAGE_SIZES={})
+class CheckoutConcurrencyTests(TransactionTestCase):
+    def test_concurrent_checkouts_never_oversell(self):
+        product = create_products(1)[0]
+        Product.objects.filter(pk=product.pk).update(inventory_quantity=10)
+        customers = [create_customer(f'buyer-{i}') for i in range(12)]
+        for customer in customers:
+            CartItem.objects.create(customer=customer, product=product, quantity=3)
+
+        outcomes = []
+        start = threading.Barrier(len(customers))
+
+        def buy(customer):
+            start.wait()
+            try:
+                for attempt in range(50):
+                    try:
+                        place_order(customer, 'a', 'b', 'Pending')
+                        outcomes.append('ok')
+                        return
+                    except OperationalError:
+                        # SQLite reports write contention instead of waiting
+                        time.sleep(random.random() * 0.01 * attempt)
+                outcomes.append('locked')
+            except InsufficientStock:
+                outcomes.append('short')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        sold = sum(OrderItem.objects.values_list('quantity', flat=True))
+        self.assertGreaterEqual(product.inventory_quantity, 0)
+        self.assertEqual(product.inventory_quantity + sold, 10)
+        self.assertEqual(outcomes.count('ok'), 3)
+        self.assertEqual(Order.objects.count(), outcomes.count('ok'))
+        self.assertEqual(CartItem.objects.count(), len(customers) - outcomes.count('ok'))
+
+
+def declining_seed():
+    # A seed whose first payment is declined and second approved
+    for seed in range(100):
+        random.seed(seed)
+        if random.randint(1, 3) == 3 and random.randint(1, 3) != 3:
+            return seed
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+        self.product = create_products(1)[0]
+        CartItem.objects.create(customer=self.customer, product=self.product, quantity=2)
+
+    def post(self, name, key, data=None):
+        data = data or {'shipping_address': 'Here', 'billing_address': 'There'}
+        return self.client.post(reverse(name), data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_order(self):
+        first = self.post('checkout', 'order-1')
+        self.assertEqual(first.status_code, 201)
+        # Only the read of the stored response
+        with self.assertNumQueries(1):
+            retry = self.post('checkout', 'order-1')
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get().inventory_quantity, 98)
+
+    def test_key_reused_for_another_request(self):
+        self.assertEqual(self.post('checkout', 'order-1').status_code, 201)
+        response = self.post('checkout', 'order-1', {'shipping_address': 'Elsewhere'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_keys_are_per_user(self):
+        self.assertEqual(self.post('checkout', 'order-1').status_code, 201)
+        other = create_customer('other')
+        CartItem.objects.create(customer=other, product=self.product, quantity=1)
+        self.client.force_authenticate(other.user)
+        response = self.post('checkout', 'order-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_failures_release_the_key(self):
+        CartItem.objects.all().delete()
+        self.assertEqual(self.post('checkout', 'order-1').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        CartItem.objects.create(customer=self.customer, product=self.product, quantity=2)
+        self.assertEqual(self.post('checkout', 'order-1').status_code, 201)
+
+    def test_declined_payment_can_be_retried(self):
+        random.seed(declining_seed())
+        self.assertEqual(self.post('process_payment', 'pay-1').status_code, 402)
+        response = self.post('process_payment', 'pay-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'Approved')
+        replay = self.post('process_payment', 'pay-1')
+        self.assertEqual((replay.status_code, replay.json()), (201, response.json()))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_in_progress_and_abandoned_claims(self):
+        record, claimed = idempotency.claim(f'checkout_order:{self.customer.user.pk}', 'order-1', 'elsewhere')
+        self.assertTrue(claimed)
+        record.fingerprint = idempotency.fingerprint(type('Request', (), {'data': {'shipping_address': 'Here', 'billing_address': 'There'}}))
+        record.save()
+        response = self.post('checkout', 'order-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+        # The request holding it died: the claim is taken over once its lock runs out
+        IdempotencyKey.objects.update(locked_until=timezone.now())
+        self.assertEqual(self.post('checkout', 'order-1').status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_without_a_key(self):
+        response = self.client.post(reverse('checkout'), {'shipping_address': 'Here', 'billing_address': 'There'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        response = self.post('checkout', 'x' * 256)
+        self.assertEqual(response.status_code, 400)
+
+    def test_register_or_login_and_checkout_shares_checkout_keys(self):
+        first = self.post('register_or_login_and_checkout', 'order-1')
+        self.assertEqual(first.status_code, 201)
+        retry = self.post('checkout', 'order-1')
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+
+    def test_prune_expired(self):
+        self.post('checkout', 'order-1')
+        self.assertEqual(idempotency.prune_expired(), 0)
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        out = StringIO()
+        call_command('prune_idempotency_keys', batch_size=1, stdout=out)
+        self.assertIn('Deleted 1 expired', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@override_settings(PRODUCT_IMAGE_SIZES={})
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    def test_concurrent_retries_create_one_order(self):
+        customer = create_customer()
+        product = create_products(1)[0]
+        CartItem.objects.create(customer=customer, product=product, quantity=2)
+
+        outcomes = []
+        start = threading.Barrier(8)
+
+        def send():
+            client = APIClient()
+            client.force_authenticate(customer.user)
+            start.wait()
+            try:
+                for attempt in range(50):
+                    try:
+                        response = client.post(
+                            reverse('checkout'), {'shipping_address': 'Here', 'billing_address': 'There'}, format='json',
+                            HTTP_IDEMPOTENCY_KEY='order-1',
+                        )
+                        outcomes.append((response.status_code, response.get('Idempotent-Replayed'), response.json().get('id')))
+                        return
+                    except OperationalError:
+                        # SQLite reports write contention instead of waiting
+                        time.sleep(random.random() * 0.01 * attempt)
+                outcomes.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        order = Order.objects.get()
+        # A request that errored after its commit is retried and replayed, so
+        # the first response is not always in the outcomes
+        self.assertTrue(set(outcomes) <= {(201, None, order.pk), (201, 'true', order.pk), (409, None, None)}, outcomes)
+        self.assertLessEqual(outcomes.count((201, None, order.pk)), 1)
+        self.assertEqual(len(outcomes), 8)
+        self.assertEqual(Product.objects.get().inventory_quantity, 98)
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+        self.products = create_products(3)
+
+    def add(self, product, quantity):
+        return self.client.post(reverse('add_to_cart'), {'product_id': product.pk, 'quantity': quantity}, format='json')
+
+    def batch(self, *items):
+        return self.client.post(reverse('update_cart'), {'items': [
+            {'product_id': product.pk, 'quantity': quantity} for product, quantity in items
+        ]}, format='json')
+
+    def test_summary_is_one_query(self):
+        self.add(self.products[0], 2)
+        self.add(self.products[1], 1)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('cart_summary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {key: response.data[key] for key in ('line_count', 'item_count', 'subtotal', 'warnings')},
+            {'line_count': 2, 'item_count': 3, 'subtotal': '31.00', 'warnings': []},
+        )
+        line = response.data['lines'][0]
+        self.assertEqual((line['quantity'], line['line_total'], line['available']), (2, '20.00', 100))
+        self.assertEqual(line['product'], fast_serializers.product_summary(
+            fast_serializers.product_values(Product.objects.filter(pk=self.products[0].pk)).get()
+        ))
+
+    def test_summary_warns_about_lines_stock_no_longer_covers(self):
+        CartItem.objects.create(customer=self.customer, product=self.products[0], quantity=5)
+        Product.objects.filter(pk=self.products[0].pk).update(inventory_quantity=3)
+        warnings = self.client.get(reverse('cart_summary')).data['warnings']
+        self.assertEqual(
+            [(warning['product'], warning['available'], warning['detail']) for warning in warnings],
+            [(self.products[0].pk, 3, 'Only 3 of Product 0 available.')],
+        )
+
+    def test_add_increments_the_line(self):
+        self.add(self.products[0], 2)
+        self.assertEqual(self.add(self.products[0], 3).data['quantity'], 5)
+        self.assertEqual(CartItem.objects.get().reserved_quantity, 5)
+        self.assertEqual(self.add(self.products[0], 0).status_code, 400)
+        self.assertEqual(self.client.post(reverse('add_to_cart'), {'product_id': 999}, format='json').status_code, 404)
+
+    def test_batch_update_sets_adds_and_removes_lines(self):
+        self.add(self.products[0], 2)
+        self.add(self.products[1], 1)
+        # Locked lines, new product check, insert, lines again, one release,
+        # delete and hold UPDATE each, line update, summary, savepoints
+        with self.assertNumQueries(13):
+            response = self.batch((self.products[0], 4), (self.products[1], 0), (self.products[2], 1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(line['product']['id'], line['quantity']) for line in response.data['lines']],
+            [(self.products[0].pk, 4), (self.products[2].pk, 1)],
+        )
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('reserved_quantity', flat=True)), [4, 0, 1]
+        )
+
+    def test_batch_update_is_all_or_nothing(self):
+        self.add(self.products[0], 2)
+        Product.objects.filter(pk=self.products[1].pk).update(inventory_quantity=1)
+        response = self.batch((self.products[0], 5), (self.products[1], 2))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual((response.data['detail'], response.data['available']), ('Not enough stock for Product 1', 1))
+        self.assertEqual(list(CartItem.objects.values_list('product_id', 'quantity')), [(self.products[0].pk, 2)])
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('reserved_quantity', flat=True)), [2, 0, 0]
+        )
+
+        response = self.client.post(reverse('update_cart'), {'items': [{'product_id': 999, 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse('update_cart'), {'items': [{'product_id': 1, 'quantity': -1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ReservationTests(TestCase):
+    def setUp(self):
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+        self.product = create_products(1)[0]
+        Product.objects.filter(pk=self.product.pk).update(inventory_quantity=5)
+
+    def add(self, quantity, client=None):
+        return (client or self.client).post(
+            reverse('add_to_cart'), {'product_id': self.product.pk, 'quantity': quantity}, format='json'
+        )
+
+    def reserved(self):
+        return Product.objects.get(pk=self.product.pk).reserved_quantity
+
+    def other_client(self):
+        client = APIClient()
+        client.force_authenticate(create_customer('other').user)
+        return client
+
+    def test_add_and_update_hold_stock(self):
+        self.assertEqual(self.add(2).status_code, 201)
+        self.assertEqual(self.add(1).data['quantity'], 3)
+        self.assertEqual(self.reserved(), 3)
+        item = CartItem.objects.get()
+        self.assertIsNotNone(item.reserved_until)
+
+        response = self.client.put(reverse('update_cart_item', args=[item.pk]), {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.reserved(), 1)
+        response = self.client.delete(reverse('remove_from_cart', args=[item.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.reserved(), 0)
+
+    def test_holds_of_other_carts_are_not_available(self):
+        self.add(4)
+        response = self.add(2, self.other_client())
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['available'], 1)
+        # The rejected line is not left behind
+        self.assertEqual(CartItem.objects.count(), 1)
+        self.assertEqual(self.reserved(), 4)
+
+        item = CartItem.objects.get()
+        response = self.client.put(reverse('update_cart_item', args=[item.pk]), {'quantity': 6}, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+
+    def test_availability_endpoint(self):
+        self.add(2)
+        response = self.client.get(reverse('product_availability') + f'?ids={self.product.pk},999')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {str(self.product.pk): 3})
+        self.assertEqual(self.client.get(reverse('product_availability') + '?ids=x').status_code, 400)
+        # Holds stay out of the cached product payload
+        self.assertNotIn('reserved_quantity', self.client.get(reverse('product_detail', args=[self.product.pk])).data)
+
+    def test_expired_holds_are_swept(self):
+        self.add(3)
+        other = self.other_client()
+        self.add(2, other)
+        CartItem.objects.filter(customer=self.customer).update(reserved_until=timezone.now() - datetime.timedelta(seconds=1))
+
+        out = StringIO()
+        call_command('release_expired_reservations', stdout=out)
+        self.assertIn('Released 1 expired cart holds.', out.getvalue())
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(CartItem.objects.get(customer=self.customer).reserved_quantity, 0)
+        self.assertEqual(self.add(3, other).status_code, 201)
+
+    def test_expired_lines_are_held_again_when_updated(self):
+        self.add(3)
+        CartItem.objects.update(reserved_until=timezone.now() - datetime.timedelta(seconds=1))
+        reservations.release_expired()
+        # Adding holds only the added units; setting the quantity holds the whole line
+        self.assertEqual(self.add(1).data['quantity'], 4)
+        self.assertEqual(self.reserved(), 1)
+        item = CartItem.objects.get()
+        self.client.put(reverse('update_cart_item', args=[item.pk]), {'quantity': 4}, format='json')
+        self.assertEqual(self.reserved(), 4)
+
+    def test_checkout_converts_holds_into_the_order(self):
+        self.add(3)
+        self.add(2, self.other_client())
+        response = self.client.post(reverse('checkout'), {'shipping_address': 'Here', 'billing_address': 'There'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.inventory_quantity, product.reserved_quantity), (2, 2))
+
+    def test_checkout_respects_other_holds(self):
+        self.add(4, self.other_client())
+        # A line that bypassed reservation (or whose hold was swept) only gets what is free
+        CartItem.objects.create(customer=self.customer, product=self.product, quantity=2)
+        response = self.client.post(reverse('checkout'), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).inventory_quantity, 5)
+
+    def test_deleting_a_customer_releases_their_holds(self):
+        self.add(3)
+        self.add(1, self.other_client())
+        self.customer.user.delete()
+        self.assertEqual(self.reserved(), 1)
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_rebuild_repairs_drift(self):
+        self.add(3)
+        Product.objects.update(reserved_quantity=0)
+        call_command('release_expired_reservations', '--rebuild', stdout=StringIO())
+        self.assertEqual(self.reserved(), 3)
+
+
+@override_settings(PRODUCT_IMAGE_SIZES={})
+class ReservationConcurrencyTests(TransactionTestCase):
+    def test_concurrent_holds_never_exceed_stock(self):
+        product = create_products(1)[0]
+        Product.objects.filter(pk=product.pk).update(inventory_quantity=10)
+        customers = [create_customer(f'holder-{i}') for i in range(12)]
+        outcomes = []
+        start = threading.Barrier(len(customers))
+
+        def hold(customer):
+            start.wait()
+            try:
+                for attempt in range(50):
+                    try:
+                        with transaction.atomic():
+                            item, _ = CartItem.objects.get_or_create(customer=customer, product=product, defaults={'quantity': 0})
+                            reservations.reserve(item, 3)
+                        outcomes.append('ok')
+                        return
+                    except OperationalError:
+                        # SQLite reports write contention instead of waiting
+                        time.sleep(random.random() * 0.01 * attempt)
+                outcomes.append('locked')
+            except InsufficientStock:
+                outcomes.append('short')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=hold, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(outcomes.count('ok'), 3)
+        self.assertEqual(product.reserved_quantity, 9)
+        self.assertEqual(sum(CartItem.objects.values_list('reserved_quantity', flat=True)), 9)
+        self.assertEqual(reservations.availability([product.pk]), {product.pk: 1})
+
+    def test_concurrent_adds_to_one_line_all_count(self):
+        product = create_products(1)[0]
+        customer = create_customer()
+        start = threading.Barrier(8)
+        outcomes = []
+
+        def add():
+            start.wait()
+            try:
+                for attempt in range(50):
+                    try:
+                        carts.add(customer, product.pk, 2)
+                        outcomes.append('ok')
+                        return
+                    except OperationalError:
+                        time.sleep(random.random() * 0.01 * attempt)
+                outcomes.append('locked')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes, ['ok'] * 8)
+        line = CartItem.objects.get()
+        self.assertEqual((line.quantity, line.reserved_quantity), (16, 16))
+        self.assertEqual(Product.objects.get(pk=product.pk).reserved_quantity, 16)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Points the command at a throwaway SQLite file')
+class BenchmarkCommandTests(SimpleTestCase):
+    def test_every_scenario_runs_on_a_tiny_dataset(self):
+        # In a process of its own: the command swaps in a database of its own
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            subprocess.run(
+                [sys.executable, 'manage.py', 'benchmark', '--products', '30', '--customers', '6', '--reviews', '30',
+                 '--carts', '3', '--orders', '10', '--requests', '3', '--output', output],
+                cwd=settings.BASE_DIR, env={**os.environ, 'DB_NAME': os.path.join(directory, 'db.sqlite3')},
+                check=True, capture_output=True,
+            )
+            with open(output) as f:
+                routes = json.load(f)['routes']
+        self.assertTrue({'cart_summary', 'update_cart', 'product_facets', 'product_availability'} <= set(routes))
+        for name, stats in routes.items():
+            self.assertTrue(all(code < '500' for code in stats['statuses']), (name, stats['statuses']))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite connection settings')
+class SQLiteConnectionTests(SimpleTestCase):
+    def test_new_connections_use_wal_and_busy_timeout(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = connections['default'].__class__({**connection.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')})
+            try:
+                with wrapper.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+                    cursor.execute('PRAGMA synchronous')
+                    self.assertEqual(cursor.fetchone()[0], 1)
+                    cursor.execute('PRAGMA busy_timeout')
+                    self.assertEqual(cursor.fetchone()[0], 20000)
+            finally:
+                wrapper.close()
+
+    def test_asgi_defaults_to_a_connection_per_request(self):
+        def conn_max_age(module):
+            env = {key: value for key, value in os.environ.items() if key not in ('DB_CONN_MAX_AGE', 'DJANGO_SERVER_INTERFACE')}
+            return subprocess.run(
+                [sys.executable, '-c', f"import {module}; from django.conf import settings; "
+                 "print(settings.DATABASES['default']['CONN_MAX_AGE'])"],
+                cwd=settings.BASE_DIR, env=env, check=True, capture_output=True, text=True,
+            ).stdout.strip()
+        self.assertEqual(conn_max_age('backend.wsgi'), '60')
+        self.assertEqual(conn_max_age('backend.asgi'), '0')
+
+
+@override_settings(PASSWORD_HASHERS=[
+    'django.contrib.auth.hashers.ScryptPasswordHasher', 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+])
+class AuthenticationTests(TestCase):
+    def setUp(self):
+        authentication.clear()
+        self.customer = create_customer()
+        self.client = APIClient()
+
+    def login(self, password='secret-pass'):
+        return self.client.post(reverse('login'), {'username': 'shopper', 'password': password}, format='json')
+
+    def authenticate(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login().data['access']}")
+
+    def test_tokens_carry_the_customer_id(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.data['access'])['customer_id'], self.customer.pk)
+
+    def test_user_and_customer_are_resolved_once_then_cached(self):
+        self.authenticate()
+        # The customer with its user, then nothing: the serializer reads both
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('account')).data['user']['username'], 'shopper')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('account')).status_code, 200)
+
+    def test_account_changes_invalidate_the_cache(self):
+        self.authenticate()
+        self.client.get(reverse('account'))
+        self.client.put(reverse('account'), {'shipping_address': '1 New Street'}, format='json')
+        self.assertEqual(self.client.get(reverse('account')).data['shipping_address'], '1 New Street')
+
+        user = self.customer.user
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get(reverse('account')).status_code, 401)
+
+    @override_settings(AUTH_USER_CACHE_TTL=0)
+    def test_tokens_without_the_claim_still_authenticate(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.customer.user)}')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(reverse('account')).status_code, 200)
+
+    def test_login_rehashes_passwords_stored_with_another_hasher(self):
+        user = self.customer.user
+        user.password = make_password('secret-pass', hasher='pbkdf2_sha256')
+        user.save()
+
+        self.assertEqual(self.login('wrong-pass').status_code, 401)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+        self.assertEqual(self.login().status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+        self.assertEqual(self.login().status_code, 200)
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        revocations.revocations.reset()
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.tokens = self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret-pass'}, format='json').data
+
+    def refresh(self, token):
+        return self.client.post(reverse('token_refresh'), {'refresh': token}, format='json')
+
+    def outstanding(self, jti, expires_at, blacklisted=False):
+        token = OutstandingToken.objects.create(jti=jti, token='-', expires_at=expires_at)
+        if blacklisted:
+            BlacklistedToken.objects.create(token=token)
+        return token
+
+    def test_rotated_tokens_cannot_be_refreshed_again(self):
+        response = self.refresh(self.tokens['refresh'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(AccessToken(response.data['access'])['customer_id'], self.customer.pk)
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, 200)
+
+    def test_logged_out_tokens_are_refused(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+        self.assertEqual(self.client.post(reverse('logout'), {'refresh_token': self.tokens['refresh']}, format='json').status_code, 205)
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+
+    def test_tokens_the_filter_has_not_seen_skip_the_blacklist_lookup(self):
+        second = self.client.post(reverse('login'), {'username': 'shopper', 'password': 'secret-pass'}, format='json').data
+        revocations.revocations.sync()
+        with override_settings(REVOCATION_CACHE_ENABLED=False), CaptureQueriesContext(connection) as uncached:
+            self.refresh(self.tokens['refresh'])
+        with CaptureQueriesContext(connection) as cached:
+            self.assertEqual(self.refresh(second['refresh']).status_code, 200)
+        self.assertEqual(len(cached), len(uncached) - 1)
+
+    def test_tokens_revoked_by_another_process(self):
+        jti = UntypedToken(self.tokens['refresh'])['jti']
+        revocations.revocations.sync()
+        # Blacklisted without this process's filter seeing it
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=jti))
+        # The rotation's blacklist write refuses it before the filter syncs...
+        self.assertEqual(self.refresh(self.tokens['refresh']).status_code, 401)
+        # ...and the filter has it from the next sync on
+        with override_settings(REVOCATION_SYNC_SECONDS=0):
+            self.assertTrue(revocations.revocations.might_be_revoked(jti))
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = revocations.BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add(f'revoked-{i}')
+        self.assertTrue(all(f'revoked-{i}' in bloom for i in range(1000)))
+        false_positives = sum(f'valid-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_prune_deletes_expired_tokens_in_batches(self):
+        now = timezone.now()
+        for i in range(5):
+            self.outstanding(f'expired-{i}', now - datetime.timedelta(days=1), blacklisted=i % 2 == 0)
+        self.outstanding('current', now + datetime.timedelta(days=1), blacklisted=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(revocations.prune_expired(batch_size=2), 5)
+        # Three batches of the expired ids, the rows to delete and two deletes, and the empty select
+        self.assertEqual(len([q for q in queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]), 13)
+        self.assertEqual(
+            set(OutstandingToken.objects.values_list('jti', flat=True)), {'current', UntypedToken(self.tokens['refresh'])['jti']}
+        )
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+        out = StringIO()
+        call_command('prune_expired_tokens', stdout=out)
+        self.assertIn('Deleted 0 expired tokens.', out.getvalue())
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False, PRODUCT_IMAGE_SIZES={})
+class ReadReplicaTests(TransactionTestCase):
+    """Two SQLite files stand in for replicas: each holds a snapshot of the primary."""
+
+    replicas = ['replica_a', 'replica_b']
+
+    def setUp(self):
+        self.customer = create_customer()
+        self.client = APIClient()
+        self.client.force_authenticate(self.customer.user)
+        self.product = create_products(1)[0]
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for alias in self.replicas:
+            self.add_replica(alias, os.path.join(directory.name, f'{alias}.sqlite3'), snapshot=True)
+        replicas._unhealthy.clear()
+        django_cache.clear()
+        # The primary moves on; the replicas have not caught up
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+
+    def add_replica(self, alias, path, snapshot=False):
+        if snapshot:
+            target = sqlite3.connect(path)
+            connection.connection.backup(target)
+            target.close()
+        if alias in connections.settings:
+            self.remove_replica(alias)
+        else:
+            self.addCleanup(self.remove_replica, alias)
+        connections.settings[alias] = {**connection.settings_dict, 'NAME': path}
+
+    def remove_replica(self, alias):
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+    def detail_name(self):
+        return self.client.get(reverse('product_detail', args=[self.product.pk])).data['name']
+
+    def test_catalog_reads_rotate_over_replicas(self):
+        with override_settings(DATABASE_REPLICAS=self.replicas), \
+                CaptureQueriesContext(connections['replica_a']) as on_a, \
+                CaptureQueriesContext(connections['replica_b']) as on_b:
+            self.assertEqual([self.detail_name(), self.detail_name()], ['Product 0', 'Product 0'])
+            self.assertEqual(self.client.get(reverse('list_categories')).status_code, 200)
+        self.assertTrue(on_a.captured_queries)
+        self.assertTrue(on_b.captured_queries)
+        # Without replicas everything reads the primary
+        self.assertEqual(self.detail_name(), 'Renamed')
+
+    def test_writes_and_cart_reads_use_the_primary(self):
+        with override_settings(DATABASE_REPLICAS=self.replicas):
+            response = self.client.post(reverse('add_to_cart'), {'product_id': self.product.pk, 'quantity': 1}, format='json')
+            self.assertEqual(response.data['product']['name'], 'Renamed')
+            self.assertEqual(self.client.get(reverse('get_cart')).data[0]['product']['name'], 'Renamed')
+        self.assertEqual(CartItem.objects.using('replica_a').count(), 0)
+
+    def test_unreachable_replica_is_skipped(self):
+        self.add_replica('replica_b', os.path.join(tempfile.gettempdir(), 'missing-directory', 'replica.sqlite3'))
+        with override_settings(DATABASE_REPLICAS=self.replicas):
+            # Each request is served, the one sent to replica_b by the primary
+            self.assertCountEqual([self.detail_name() for _ in range(2)], ['Product 0', 'Renamed'])
+            self.assertEqual(replicas.healthy_replicas(), ['replica_a'])
+            self.assertEqual([self.detail_name() for _ in range(3)], ['Product 0'] * 3)
+
+    def test_order_history_reads_the_primary_after_checkout(self):
+        CartItem.objects.create(customer=self.customer, product=self.product, quantity=1)
+        with override_settings(DATABASE_REPLICAS=self.replicas):
+            place_order(self.customer, 'a', 'b', 'Pending')
+            with CaptureQueriesContext(connections['replica_a']) as on_a, \
+                    CaptureQueriesContext(connections['replica_b']) as on_b:
+                self.assertEqual(len(self.client.get(reverse('order_history')).data['results']), 1)
+            self.assertEqual(on_a.captured_queries + on_b.captured_queries, [])
+            # Once the pin lapses the (stale) replicas serve the history again
+            django_cache.clear()
+            self.assertEqual(self.client.get(reverse('order_history')).data['results'], [])
+
+    def test_replica_reads_right_after_a_write_are_not_cached(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        with override_settings(DATABASE_REPLICAS=self.replicas, CATALOG_CACHE_ENABLED=True):
+            # The rename committed; the replicas have not replayed it yet
+            cache.invalidate_products([self.product.pk])
+            response = self.client.get(url)
+            self.assertEqual(response.data['name'], 'Product 0')
+            self.assertNotIn('ETag', response)
+            cache.reset_stats()
+            self.assertEqual(self.client.get(url).data['name'], 'Product 0')
+            self.assertEqual(cache.stats()['hits'], 0)
+            # Past the lag window replica responses are cached again
+            django_cache.delete_many([f'changed:{cache.CATALOG}', f'changed:{cache.product_scope(self.product.pk)}'])
+            self.assertIn('ETag', self.client.get(url))
+            self.assertIn('ETag', self.client.get(url))
+            self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_replicas_need_a_shared_cache(self):
+        self.assertEqual(checks.check_replica_cache(None), [])
+        with override_settings(DATABASE_REPLICAS=self.replicas):
+            self.assertEqual([error.id for error in checks.check_replica_cache(None)], ['api.E001'])
+            redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+            with override_settings(CACHES=redis):
+                self.assertEqual(checks.check_replica_cache(None), [])
+
+
+# Tests run in one process, where the locmem cache is shared
+@override_settings(PRODUCT_IMAGE_SIZES={}, CATALOG_CACHE_ENABLED=True)
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.get_cache().clear()
+        cache.reset_stats()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = create_products(1)[0]
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_repeat_reads_are_served_from_cache(self):
+        url = reverse('list_products')
+        first = self.get(url)
+        with self.assertNumQueries(0):
+            second = self.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(second.json()['results'][0]['id'], self.product.pk)
+        self.assertEqual(self.get(reverse('list_categories')).json(), ['Toys'])
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_if_none_match_returns_not_modified(self):
+        url = reverse('product_detail', args=[self.product.pk])
+        etag = self.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.get(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(cache.stats()['not_modified'], 1)
+
+    def test_product_writes_invalidate_catalog_and_product_entries(self):
+        list_url, detail_url = reverse('list_products'), reverse('product_detail', args=[self.product.pk])
+        list_etag, detail_etag = self.get(list_url)['ETag'], self.get(detail_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed'
+            self.product.save()
+        self.assertEqual(self.get(list_url, if_none_match=list_etag).json()['results'][0]['name'], 'Renamed')
+        self.assertEqual(self.get(detail_url, if_none_match=detail_etag).json()['name'], 'Renamed')
+
+    def test_other_products_keep_their_entries(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = create_products(1, start=1)[0]
+        detail_url = reverse('product_detail', args=[self.product.pk])
+        etag = self.get(detail_url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        self.assertEqual(self.get(detail_url, if_none_match=etag).status_code, 304)
+
+    def test_reviews_and_checkout_invalidate(self):
+        customer = create_customer()
+        self.client.force_authenticate(customer.user)
+        reviews_url, detail_url = reverse('product_reviews', args=[self.product.pk]), reverse('product_detail', args=[self.product.pk])
+        self.assertEqual(self.get(reviews_url).json()['results'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add_review'), {'product_id': self.product.pk, 'rating': 4}, format='json')
+        self.assertEqual(len(self.get(reviews_url).json()['results']), 1)
+
+        self.assertEqual(self.get(detail_url).json()['inventory_quantity'], 100)
+        CartItem.objects.create(customer=customer, product=self.product, quantity=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('checkout'), {'shipping_address': 'a', 'billing_address': 'b'}, format='json')
+        self.assertEqual(self.get(detail_url).json()['inventory_quantity'], 97)
+
+    def test_stats_endpoint_is_admin_only(self):
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 401)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass')
+        self.client.force_authenticate(admin)
+        self.assertEqual(set(self.client.get(reverse('cache_stats')).data), {'hits', 'misses', 'not_modified', 'invalidations'})
+
+    def test_needs_a_shared_backend(self):
+        self.assertEqual([error.id for error in checks.check_catalog_cache(None)], ['api.E002'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.check_catalog_cache(None), [])
+        with override_settings(CATALOG_CACHE_ENABLED=False):
+            self.assertEqual(checks.check_catalog_cache(None), [])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Reads SQLite query plans')
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        benchmarking.seed_dataset(products=300, customers=20, reviews=600, carts=10, orders=200)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.customer = Customer.objects.filter(cart_items__isnull=False).first()
+        self.product = Product.objects.filter(reviews__isnull=False).first()
+
+    def next_page(self, url):
+        return self.client.get(url).data['next']
+
+    def test_catalog_reads_use_indexes(self):
+        category = urlencode({'category': self.product.category, 'page_size': 5})
+        for url in [
+            self.next_page(reverse('list_products')),
+            reverse('product_detail', args=[self.product.pk]),
+            reverse('product_reviews', args=[self.product.pk]),
+            reverse('list_categories'),
+            reverse('filter_products') + f'?{category}&sort_by=price_asc',
+            self.next_page(reverse('filter_products') + f'?{category}&sort_by=price_desc'),
+            reverse('filter_products') + '?sort_by=price_asc',
+            self.next_page(reverse('filter_products') + '?sort_by=name_asc'),
+            reverse('filter_products') + '?sort_by=rating_desc',
+        ]:
+            self.assertNoFullScans('get', url)
+
+    def test_customer_reads_and_cart_writes_use_indexes(self):
+        self.client.force_authenticate(self.customer.user)
+        self.assertNoFullScans('get', reverse('get_cart'))
+        self.assertNoFullScans('get', reverse('order_history'))
+        self.assertNoFullScans('get', self.next_page(reverse('order_history') + '?page_size=1'))
+        self.assertNoFullScans('post', reverse('add_to_cart'), data={'product_id': self.product.pk}, format='json')
+
+    def test_cart_lines_are_unique_per_product(self):
+        CartItem.objects.filter(customer=self.customer).delete()
+        CartItem.objects.create(customer=self.customer, product=self.product, quantity=1)
+        with self.assertRaises(IntegrityError):
+            CartItem.objects.create(customer=self.customer, product=self.product, quantity=1)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class AsyncCatalogViewTests(TestCase):
+    def setUp(self):
+        self.products = create_products(3, reviews_per_product=2)
+        self.async_client = AsyncClient()
+
+    async def assertSameResponse(self, name, args=(), query=''):
+        sync_response = await self.async_client.get(reverse(name, args=args) + query)
+        async_response = await self.async_client.get(reverse(f'async_{name}', args=args) + query)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        # Pagination links point at their own route
+        self.assertEqual(
+            async_response.content.replace(b'/async/', b'/'), sync_response.content, f'{name}{query}'
+        )
+        return async_response
+
+    async def test_async_views_match_sync_views(self):
+        pk = self.products[0].pk
+        await self.assertSameResponse('list_products', query='?page_size=2')
+        await self.assertSameResponse('product_detail', args=[pk])
+        await self.assertSameResponse('product_detail', args=[pk], query='?expand=reviews&fields=id,reviews.rating')
+        await self.assertSameResponse('list_products', query='?expand=reviews&fields=id,name,reviews')
+        await self.assertSameResponse('product_detail', args=[0])
+        await self.assertSameResponse('product_reviews', args=[pk], query='?page_size=1')
+        await self.assertSameResponse('product_reviews', args=[0])
+        await self.assertSameResponse('list_categories')
+        await self.assertSameResponse('filter_products', query='?search=product&sort_by=price_desc')
+        await self.assertSameResponse('filter_products', query='?min_rating=abc')
+        await self.assertSameResponse('filter_products', query='?cursor=bogus')
+
+    async def test_async_pagination_follows_cursors(self):
+        url = reverse('async_list_products') + '?page_size=2'
+        seen = []
+        while url:
+            data = (await self.async_client.get(url)).json()
+            seen.extend(product['id'] for product in data['results'])
+            url = data['next']
+        self.assertEqual(seen, [product.pk for product in self.products])
+
+    async def test_queries_are_reported_from_the_orm_thread(self):
+        url = reverse('async_product_detail', args=[self.products[0].pk]) + '?expand=reviews'
+        response = await self.async_client.get(url)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('2 queries (0 duplicate)', response['Server-Timing'])
+
+    @override_settings(CATALOG_CACHE_ENABLED=True)
+    async def test_async_views_are_cached(self):
+        cache.get_cache().clear()
+        url = reverse('async_product_detail', args=[self.products[0].pk])
+        first = await self.async_client.get(url)
+        second = await self.async_client.get(url, headers={'if-none-match': first['ETag']})
+        self.assertEqual(second.status_code, 304)
+        third = await self.async_client.get(url)
+        self.assertEqual(third.content, first.content)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        create_products(2, reviews_per_product=1)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('list_products'))
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'db', 'serialize', 'render', 'total'})
+        self.assertIn('1 queries (0 duplicate)', timing['db'])
+
+    def test_serialization_is_timed_apart_from_rendering(self):
+        labels = ('list_products', 'GET')
+        for fast in [False, True]:
+            before = metrics.serialization_duration.series.get(labels, (None, 0.0))[1]
+            with override_settings(API_FAST_SERIALIZATION=fast):
+                self.client.get(reverse('list_products'))
+            self.assertGreater(metrics.serialization_duration.series[labels][1], before, fast)
+
+    def test_metrics_endpoint_reports_per_view_histograms(self):
+        self.client.get(reverse('list_products'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE ecom_http_request_duration_seconds histogram', body)
+        self.assertIn('ecom_http_db_queries_bucket{view="list_products",method="GET",le="2"}', body)
+        self.assertIn('ecom_http_requests_total{view="list_products",method="GET",status="200"}', body)
+        self.assertIn('ecom_catalog_cache_hits_total', body)
+
+    def test_duplicate_queries_are_counted(self):
+        collector = QueryCollector()
+        execute = lambda sql, params, many, context: None
+        for pk in (1, 2, 3):
+            collector(execute, 'SELECT * FROM api_review WHERE product_id = %s', (pk,), False, {})
+        collector(execute, 'SELECT * FROM api_product', (), False, {})
+        self.assertEqual((collector.count, collector.duplicates), (4, 2))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', (0.1, 1.0), labels=('view',))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(('v',), value)
+        samples = {labels: value for name, labels, value in histogram.samples() if name == 'test_seconds_bucket'}
+        self.assertEqual(list(samples.values()), [2, 3, 4])
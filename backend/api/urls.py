@@ -1,15 +1,18 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('register/', views.register, name='register'),
     path('login/', views.login, name='login'),
     path('products/', views.list_products, name='list_products'),
     path('products/<int:pk>/', views.product_detail, name='product_detail'),
+    path('products/availability/', views.product_availability, name='product_availability'),
     path('cart/', views.get_cart, name='get_cart'),
     path('cart/add/', views.add_to_cart, name='add_to_cart'),
     path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
+    path('cart/summary/', views.cart_summary, name='cart_summary'),
+    path('cart/batch/', views.update_cart, name='update_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('orders/', views.order_history, name='order_history'),
     path('process_payment/', views.process_payment, name='process_payment'),
@@ -17,7 +20,20 @@ urlpatterns = [
     path('products/filter/', views.filter_products, name='filter_products'),
     path('register_or_login_and_checkout/', views.register_or_login_and_checkout, name='register_or_login_and_checkout'),
     path('categories/', views.list_categories, name='list_categories'),
+    path('products/facets/', views.product_facets, name='product_facets'),
     path('reviews/add/', views.add_review, name='add_review'),
     path('products/<int:pk>/reviews/', views.product_reviews, name='product_reviews'),
     path('logout/', views.logout, name='logout'),
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
+    path('exports/<slug:dataset>.<slug:output_format>', views.export_data, name='export_data'),
+    path('imports/', views.import_catalog, name='import_catalog'),
+    path('imports/<int:pk>/', views.catalog_import, name='catalog_import'),
+    path('imports/<int:pk>/resume/', views.resume_catalog_import, name='resume_catalog_import'),
+    # Async variants of the catalog reads, for ASGI deployments
+    path('async/products/', async_views.list_products, name='async_list_products'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async_product_detail'),
+    path('async/products/filter/', async_views.filter_products, name='async_filter_products'),
+    path('async/products/<int:pk>/reviews/', async_views.product_reviews, name='async_product_reviews'),
+    path('async/categories/', async_views.list_categories, name='async_list_categories'),
 ]
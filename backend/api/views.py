@@ -1,19 +1,30 @@
 import random
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
-from .models import Customer, Product, Order, OrderItem, CartItem, Review
+from .models import Customer, Product, Order, OrderItem, CartItem, Review, CatalogImport
+from . import cache, carts, exports, fast_serializers, imports, metrics, reservations, tasks
+from .authentication import RefreshToken, tokens_for
+from .cache import CATALOG, cache_response, product_scope
+from .checkout import EmptyCart, InsufficientStock, place_order
+from .idempotency import idempotent
+from .middleware import serializing
+from .catalog import categories, facets, filtered_products
+from .pagination import KeysetPagination
+from .replicas import read_from_replica
 from .serializers import (
-    ReviewSerializer, UserSerializer, CustomerSerializer, ProductSerializer, 
-    OrderSerializer, OrderItemSerializer, CartItemSerializer
+    ReviewSerializer, UserSerializer, CustomerSerializer, ProductSerializer, ProductSummarySerializer,
+    OrderSerializer, OrderItemSerializer, CartItemSerializer, CartBatchSerializer, CatalogImportSerializer,
+    ReviewInputSerializer, fieldset_context
 )
-from rest_framework.permissions import AllowAny
-from django.db.models import Q
-from django.db.models.functions import Lower
+from rest_framework.permissions import AllowAny, IsAdminUser
+from django.db import transaction
+from django.utils import timezone
+
+MAX_AVAILABILITY_IDS = 100
 
 @api_view(['POST'])
 def register(request):
@@ -32,45 +43,61 @@ def register(request):
 def login(request):
     if request.method == 'POST':
         data = request.data
-        user = User.objects.filter(username=data['username']).first()
+        user = User.objects.select_related('customer').filter(username=data['username']).first()
+        # check_password rehashes a password stored with another hasher (see PASSWORD_HASHING)
         if user and user.check_password(data['password']):
-            refresh = RefreshToken.for_user(user)
+            refresh = tokens_for(user)
             return Response({
                 'refresh': str(refresh),
                 'access': str(refresh.access_token),
             })
         return Response({'detail': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
 
+@cache_response(lambda pk: [product_scope(pk)])
 @api_view(['GET'])
+@read_from_replica
 def product_detail(request, pk):
     try:
-        product = Product.objects.get(pk=pk)
+        context = fieldset_context(request.query_params)
+        product = Product.objects.for_serializer(context['expand']).get(pk=pk)
     except Product.DoesNotExist:
         return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
-    serializer = ProductSerializer(product)
+    serializer = ProductSerializer(product, context=context)
     return Response(serializer.data)
 
+def customer_for(request):
+    try:
+        return request.user.customer
+    except Customer.DoesNotExist:
+        customer, _ = Customer.objects.get_or_create(user=request.user)
+        return customer
+
+def insufficient_stock(e):
+    available = reservations.availability([e.product.pk])[e.product.pk]
+    return Response({'detail': str(e), 'available': available}, status=status.HTTP_409_CONFLICT)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_to_cart(request):
     try:
-        customer, _ = Customer.objects.get_or_create(user=request.user)
+        customer = customer_for(request)
         data = request.data
-        product = Product.objects.get(pk=data['product_id'])
-        quantity = data.get('quantity', 1)
-
         try:
-            cart_item = CartItem.objects.get(customer=customer, product=product)
-            cart_item.quantity += quantity
-        except CartItem.DoesNotExist:
-            cart_item = CartItem(customer=customer, product=product, quantity=quantity)
-        
-        cart_item.save()
+            quantity = int(data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response({'detail': 'Quantity must be a valid integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if quantity <= 0:
+            return Response({'detail': 'Quantity must be a positive integer.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = CartItemSerializer(cart_item)
+        cart_item_id = carts.add(customer, data['product_id'], quantity)
+
+        context = fieldset_context(request.query_params)
+        serializer = CartItemSerializer(CartItem.objects.for_serializer(context['expand']).get(pk=cart_item_id), context=context)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     except Product.DoesNotExist:
         return Response({'detail': 'Product not found.'}, status=status.HTTP_404_NOT_FOUND)
+    except InsufficientStock as e:
+        return insufficient_stock(e)
     except Exception as e:
         return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -78,9 +105,11 @@ def add_to_cart(request):
 @permission_classes([IsAuthenticated])
 def remove_from_cart(request, item_id):
     try:
-        customer = Customer.objects.get(user=request.user)
-        cart_item = CartItem.objects.get(pk=item_id, customer=customer)
-        cart_item.delete()
+        customer = request.user.customer
+        with transaction.atomic():
+            cart_item = CartItem.objects.select_for_update().get(pk=item_id, customer=customer)
+            reservations.release([cart_item])
+            cart_item.delete()
         return Response({'detail': 'Item removed from cart successfully.'}, status=status.HTTP_204_NO_CONTENT)
     except Customer.DoesNotExist:
         return Response({'detail': 'Customer not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -93,7 +122,7 @@ def remove_from_cart(request, item_id):
 @permission_classes([IsAuthenticated])
 def update_cart_item(request, item_id):
     try:
-        customer = Customer.objects.get(user=request.user)
+        customer = request.user.customer
         cart_item = CartItem.objects.get(pk=item_id, customer=customer)
         
         quantity = request.data.get('quantity')
@@ -107,53 +136,47 @@ def update_cart_item(request, item_id):
         except ValueError:
             return Response({'detail': 'Quantity must be a valid integer.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        cart_item.quantity = quantity
-        cart_item.save()
+        cart_item = reservations.reserve(cart_item, quantity)
         
-        serializer = CartItemSerializer(cart_item)
+        context = fieldset_context(request.query_params)
+        serializer = CartItemSerializer(CartItem.objects.for_serializer(context['expand']).get(pk=cart_item.pk), context=context)
         return Response(serializer.data, status=status.HTTP_200_OK)
     except Customer.DoesNotExist:
         return Response({'detail': 'Customer not found.'}, status=status.HTTP_404_NOT_FOUND)
     except CartItem.DoesNotExist:
         return Response({'detail': 'Cart item not found.'}, status=status.HTTP_404_NOT_FOUND)
+    except InsufficientStock as e:
+        return insufficient_stock(e)
     except Exception as e:
         return Response({'detail': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-@api_view(['POST'])
-@permission_classes([IsAuthenticated])
-def checkout(request):
-    customer = Customer.objects.get(user=request.user)
-    cart_items = CartItem.objects.filter(customer=customer)
-    if not cart_items:
-        return Response({'detail': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    for item in cart_items:
-        if item.quantity > item.product.inventory_quantity:
-            return Response({'detail': f'Not enough stock for {item.product.name}'}, status=status.HTTP_400_BAD_REQUEST)
-    
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
+# Shared by checkout and register_or_login_and_checkout: a view given the
+# Request of another cannot wrap it again
+@idempotent
+def checkout_order(request):
+    customer = request.user.customer
     data = request.data
-    order = Order.objects.create(
-        customer=customer,
-        total_price=total_price,
-        shipping_address=data.get('shipping_address', customer.shipping_address),
-        billing_address=data.get('billing_address', customer.billing_address),
-        status='Pending'
-    )
-    
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            quantity=item.quantity
+    try:
+        order = place_order(
+            customer,
+            shipping_address=data.get('shipping_address', customer.shipping_address),
+            billing_address=data.get('billing_address', customer.billing_address),
+            status='Pending',
         )
-        item.product.inventory_quantity -= item.quantity
-        item.product.save()
-        item.delete()
-    
-    serializer = OrderSerializer(order)
+    except EmptyCart:
+        return Response({'detail': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+    except InsufficientStock as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    context = fieldset_context(request.query_params)
+    serializer = OrderSerializer(Order.objects.for_serializer(context['expand']).get(pk=order.pk), context=context)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def checkout(request):
+    return checkout_order(request)
+
 @api_view(['POST'])
 def register_or_login_and_checkout(request):
     if not request.user.is_authenticated:
@@ -169,73 +192,101 @@ def register_or_login_and_checkout(request):
             shipping_address=data.get('shipping_address'),
             credit_card_info=data.get('credit_card_info')
         )
-        refresh = RefreshToken.for_user(user)
+        refresh = tokens_for(user)
         request.user = user
         return Response({
             'refresh': str(refresh),
             'access': str(refresh.access_token),
         }, status=status.HTTP_201_CREATED)
     else:
-        return checkout(request)
+        return checkout_order(request)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@read_from_replica(pinned_by_user=True)
 def order_history(request):
-    customer = Customer.objects.get(user=request.user)
-    orders = Order.objects.filter(customer=customer)
-    serializer = OrderSerializer(orders, many=True)
-    return Response(serializer.data)
+    customer = request.user.customer
+    context = fieldset_context(request.query_params)
+    paginator = KeysetPagination(ordering=('created_at', True))
+    if fast_serializers.enabled(request, context):
+        orders = fast_serializers.order_values(Order.objects.filter(customer=customer), 'created_at')
+        page = paginator.paginate_queryset(orders, request)
+        with serializing():
+            data = paginator.get_paginated_data(fast_serializers.order_payloads(page))
+        return fast_serializers.response(request, data)
+
+    orders = Order.objects.for_serializer(context['expand']).filter(customer=customer)
+    page = paginator.paginate_queryset(orders, request)
+    serializer = OrderSerializer(page, many=True, context=context)
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_cart(request):
-    customer = Customer.objects.get(user=request.user)
-    cart_items = CartItem.objects.filter(customer=customer)
+    customer = request.user.customer
+    context = fieldset_context(request.query_params)
+    cart_items = CartItem.objects.for_serializer(context['expand']).filter(customer=customer)
     if not cart_items:
         return Response({'detail': 'Cart is empty'}, status=status.HTTP_204_NO_CONTENT)
 
-    serializer = CartItemSerializer(cart_items, many=True)
+    serializer = CartItemSerializer(cart_items, many=True, context=context)
     return Response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cart_summary(request):
+    return Response(carts.summary(request.user))
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def update_cart(request):
+    serializer = CartBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    customer = customer_for(request)
+    # The last change for a product wins
+    changes = {item['product_id']: item['quantity'] for item in serializer.validated_data['items']}
+    try:
+        carts.apply_changes(customer, changes)
+    except Product.DoesNotExist as e:
+        return Response({'detail': str(e)}, status=status.HTTP_404_NOT_FOUND)
+    except InsufficientStock as e:
+        return insufficient_stock(e)
+    return Response(carts.summary(request.user))
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def process_payment(request):
-    customer = Customer.objects.get(user=request.user)
-    cart_items = CartItem.objects.filter(customer=customer)
-    if not cart_items:
+    customer = request.user.customer
+    if not CartItem.objects.filter(customer=customer).exists():
         return Response({'detail': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
     
     # Dummy payment algorithm: deny every 3rd request
     if random.randint(1, 3) == 3:
         return Response({'detail': 'Credit Card Authorization Failed.'}, status=status.HTTP_402_PAYMENT_REQUIRED)
 
-    total_price = sum(item.product.price * item.quantity for item in cart_items)
     data = request.data
-    order = Order.objects.create(
-        customer=customer,
-        total_price=total_price,
-        shipping_address=data['shipping_address'],
-        billing_address=data['billing_address'],
-        status='Approved'
-    )
-    
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            quantity=item.quantity
+    try:
+        order = place_order(
+            customer,
+            shipping_address=data['shipping_address'],
+            billing_address=data['billing_address'],
+            status='Approved',
         )
-        item.product.inventory_quantity -= item.quantity
-        item.product.save()
-        item.delete()
+    except EmptyCart:
+        return Response({'detail': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+    except InsufficientStock as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer = OrderSerializer(order)
+    context = fieldset_context(request.query_params)
+    serializer = OrderSerializer(Order.objects.for_serializer(context['expand']).get(pk=order.pk), context=context)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 @api_view(['GET', 'PUT'])
 @permission_classes([IsAuthenticated])
 def account(request):
-    customer = Customer.objects.get(user=request.user)
+    customer = request.user.customer
     if request.method == 'GET':
         serializer = CustomerSerializer(customer)
         return Response(serializer.data)
@@ -247,78 +298,110 @@ def account(request):
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def fast_product_page(request, paginator, products):
+    rows = paginator.paginate_queryset(fast_serializers.product_values(products, paginator.field), request)
+    with serializing():
+        data = paginator.get_paginated_data([fast_serializers.product_summary(row) for row in rows])
+    return fast_serializers.response(request, data)
+
+@cache_response(lambda: [CATALOG])
 @api_view(['GET'])
+@read_from_replica
 def filter_products(request):
-    category = request.query_params.get('category')
-    search = request.query_params.get('search')
-    sort_by = request.query_params.get('sort_by')
-
-    products = Product.objects.all()
-
-    if category:
-        products = products.filter(category=category)
-    if search:
-        products = products.filter(
-            Q(name__icontains=search) |
-            Q(description__icontains=search) |
-            Q(category__icontains=search)
-        )
+    context = fieldset_context(request.query_params)
+    try:
+        products, ordering = filtered_products(request.query_params, context['expand'])
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    if sort_by:
-        if sort_by == 'price_asc':
-            products = products.order_by('price')
-        elif sort_by == 'price_desc':
-            products = products.order_by('-price')
-        elif sort_by == 'name_asc':
-            products = products.order_by(Lower('name'))
-        elif sort_by == 'name_desc':
-            products = products.order_by(Lower('name').desc())
-
-    serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data)
+    paginator = KeysetPagination(ordering=ordering)
+    if fast_serializers.enabled(request, context):
+        return fast_product_page(request, paginator, products)
+    page = paginator.paginate_queryset(products, request)
+    serializer = ProductSummarySerializer(page, many=True, context=context)
+    return paginator.get_paginated_response(serializer.data)
 
+@cache_response(lambda: [CATALOG])
 @api_view(['GET'])
+@read_from_replica
 def list_products(request):
-    products = Product.objects.all()
-    serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data)
+    context = fieldset_context(request.query_params)
+    products = Product.objects.for_serializer(context['expand'])
+    paginator = KeysetPagination()
+    if fast_serializers.enabled(request, context):
+        return fast_product_page(request, paginator, products)
+    page = paginator.paginate_queryset(products, request)
+    serializer = ProductSummarySerializer(page, many=True, context=context)
+    return paginator.get_paginated_response(serializer.data)
 
+@cache_response(lambda: [CATALOG])
+@read_from_replica
 def list_categories(request):
-    categories = Product.objects.values_list('category', flat=True).distinct()
-    return JsonResponse(list(categories), safe=False)
+    return JsonResponse(list(categories()), safe=False)
+
+@cache_response(lambda: [CATALOG])
+@api_view(['GET'])
+@read_from_replica
+def product_facets(request):
+    try:
+        return Response(facets(request.query_params))
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+# Not cached: holds change with every cart update, and this is one indexed read
+@api_view(['GET'])
+def product_availability(request):
+    try:
+        ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+    except ValueError:
+        return Response({'detail': 'ids must be a comma-separated list of product ids.'}, status=status.HTTP_400_BAD_REQUEST)
+    if not ids or len(ids) > MAX_AVAILABILITY_IDS:
+        return Response({'detail': f'Pass between 1 and {MAX_AVAILABILITY_IDS} product ids.'}, status=status.HTTP_400_BAD_REQUEST)
+    available = reservations.availability(ids)
+    return Response({str(pk): available[pk] for pk in ids if pk in available})
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_review(request):
-    customer = Customer.objects.get(user=request.user)
-    data = request.data
-    try:
-        product = Product.objects.get(pk=data['product_id'])
-    except Product.DoesNotExist:
-        return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
-    
-    review, created = Review.objects.update_or_create(
-        customer=customer,
-        product=product,
-        defaults={
-            'rating': data['rating'],
-            'review': data.get('review', '')
-        }
-    )
+    serializer = ReviewInputSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    customer = request.user.customer
+    data = serializer.validated_data
+    with transaction.atomic():
+        # Lock the product row so the previous rating the save signal reads
+        # (api.signals) is consistent with concurrent reviews.
+        try:
+            product = Product.objects.select_for_update().get(pk=data['product_id'])
+        except Product.DoesNotExist:
+            return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        review, created = Review.objects.update_or_create(
+            customer=customer,
+            product=product,
+            defaults={
+                'rating': data['rating'],
+                'review': data['review']
+            }
+        )
 
     serializer = ReviewSerializer(review)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+@cache_response(lambda pk: [product_scope(pk)])
 @api_view(['GET'])
+@read_from_replica
 def product_reviews(request, pk):
     try:
         product = Product.objects.get(pk=pk)
     except Product.DoesNotExist:
         return Response({'detail': 'Product not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    reviews = product.reviews.all()
-    serializer = ReviewSerializer(reviews, many=True)
-    return Response(serializer.data)
+    reviews = product.reviews.select_related('customer__user')
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(reviews, request)
+    serializer = ReviewSerializer(page, many=True, context=fieldset_context(request.query_params))
+    return paginator.get_paginated_response(serializer.data)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -330,3 +413,68 @@ def logout(request):
         return Response(status=status.HTTP_205_RESET_CONTENT)
     except Exception as e:
         return Response(status=status.HTTP_400_BAD_REQUEST)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    return Response(cache.stats())
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def prometheus_metrics(request):
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def export_data(request, dataset, output_format):
+    if dataset not in exports.DATASETS or output_format not in exports.FORMATS:
+        return Response({'detail': 'Unknown export.'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        since, since_id = exports.parse_watermark(request.query_params.get('since'), request.query_params.get('since_id'))
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        exports.export(dataset, output_format, since, since_id), content_type=exports.FORMATS[output_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{output_format}"'
+    return response
+
+# The import runs on the task worker (api.tasks); poll catalog_import for
+# progress. An interrupted import is continued from its checkpoint by the
+# task's retry or by resume_catalog_import.
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def import_catalog(request):
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'detail': 'Upload the catalog file as "file".'}, status=status.HTTP_400_BAD_REQUEST)
+    import_format = request.data.get('format') or imports.format_for(upload.name)
+    if import_format not in imports.READERS:
+        return Response({'detail': 'format must be csv or ndjson.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    job = imports.save_upload(upload, import_format)
+    tasks.enqueue(imports.run_import, import_id=job.pk)
+    return Response(CatalogImportSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def catalog_import(request, pk):
+    try:
+        job = CatalogImport.objects.get(pk=pk)
+    except CatalogImport.DoesNotExist:
+        return Response({'detail': 'Import not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(CatalogImportSerializer(job).data)
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def resume_catalog_import(request, pk):
+    try:
+        job = CatalogImport.objects.get(pk=pk)
+    except CatalogImport.DoesNotExist:
+        return Response({'detail': 'Import not found.'}, status=status.HTTP_404_NOT_FOUND)
+    # The task claims it (imports.claim): of several resumes, one runs it
+    if not CatalogImport.objects.filter(imports.claimable(timezone.now()), pk=pk).exists():
+        return Response({'detail': 'Import is running or already completed.'}, status=status.HTTP_409_CONFLICT)
+    tasks.enqueue(imports.run_import, import_id=job.pk)
+    return Response(CatalogImportSerializer(job).data, status=status.HTTP_202_ACCEPTED)
@@ -14,6 +14,7 @@ from pathlib import Path
 from datetime import timedelta
 import os
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 load_dotenv()
 
@@ -28,7 +29,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv('SECRET_KEY', "wcp9npbtgmw_tb97!%5+uhl%w4$!13ukg0bl(3tmeafllol2o!")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv('DEBUG', 'true').lower() == 'true'
 
 ALLOWED_HOSTS = ["*", "localhost", "127.0.0.1"]
 
@@ -49,30 +50,106 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CustomerJWTAuthentication',
     ),
     # 'DEFAULT_PERMISSION_CLASSES': (
     #     'rest_framework.permissions.AllowAny',
     # ),
+    # Page size for the keyset-paginated list endpoints (overridable with ?page_size=)
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 20)),
 }
 
+# Render the default product list and order history payloads from .values()
+# rows instead of DRF serializers (see api.fast_serializers)
+API_FAST_SERIALIZATION = os.getenv('API_FAST_SERIALIZATION', 'false').lower() == 'true'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=30),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'api.authentication.TokenRefreshSerializer',
 }
+# Blacklisted refresh tokens are looked up through a per-process Bloom filter
+# (api.revocations) sized for REVOCATION_CAPACITY tokens at
+# REVOCATION_ERROR_RATE false positives, which reads newly revoked tokens
+# every REVOCATION_SYNC_SECONDS. Prune expired tokens with prune_expired_tokens.
+REVOCATION_CACHE_ENABLED = os.getenv('REVOCATION_CACHE_ENABLED', 'true').lower() == 'true'
+REVOCATION_CAPACITY = int(os.getenv('REVOCATION_CAPACITY', 1_000_000))
+REVOCATION_ERROR_RATE = float(os.getenv('REVOCATION_ERROR_RATE', 0.001))
+REVOCATION_SYNC_SECONDS = int(os.getenv('REVOCATION_SYNC_SECONDS', 5))
+# Seconds an authenticated user and their customer stay cached in each
+# process (api.authentication; 0 turns the cache off), and how many users
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 30))
+AUTH_USER_CACHE_SIZE = int(os.getenv('AUTH_USER_CACHE_SIZE', 10000))
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# How MEDIA_URL is served (api.media): 'django' streams files itself with
+# Range and conditional request support; 'x-accel-redirect' (nginx) and
+# 'x-sendfile' (Apache, lighttpd) hand them to the proxy; 'off' leaves
+# MEDIA_URL entirely to the web server.
+MEDIA_SERVING = os.getenv('MEDIA_SERVING', 'django')
+# nginx `internal` location aliased to MEDIA_ROOT, for x-accel-redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+# Cache lifetime in seconds of media without a content hash in its name
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 3600))
+
+# Longest edge in pixels of each WebP derivative of a product image (api.images),
+# generated by IMAGE_WORKERS background threads (0: inline, after commit)
+PRODUCT_IMAGE_SIZES = {'thumb': 160, 'medium': 480, 'large': 1200}
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Catalog files uploaded to the import API are kept here, outside MEDIA_ROOT,
+# so an interrupted import can be resumed from the same file (api.imports)
+CATALOG_IMPORT_ROOT = os.getenv('CATALOG_IMPORT_ROOT', BASE_DIR / 'imports')
+# A running import renews its lease after every batch; one whose lease ran
+# out was interrupted and is resumed by the next claim. Keep it well above
+# the time one batch takes.
+CATALOG_IMPORT_LEASE_SECONDS = int(os.getenv('CATALOG_IMPORT_LEASE_SECONDS', 300))
+
+# Exports (api.exports) leave out rows saved in the last EXPORT_SAFETY_MARGIN
+# seconds: their transactions may not have committed yet
+EXPORT_SAFETY_MARGIN = int(os.getenv('EXPORT_SAFETY_MARGIN', 60))
+
+# Seconds a cart line holds its stock after it was last added or updated
+# (api.reservations); run release_expired_reservations to give stale holds back
+CART_RESERVATION_TTL = int(os.getenv('CART_RESERVATION_TTL', 900))
+
+# Background tasks (api.tasks), run by python manage.py run_tasks. A failed
+# task is retried after TASK_RETRY_DELAY seconds, doubling per attempt up to
+# TASK_RETRY_MAX_DELAY, until TASK_MAX_ATTEMPTS; one whose worker died is run
+# again after TASK_LEASE_SECONDS. Finished tasks are kept TASK_RETENTION_DAYS.
+TASK_WORKERS = int(os.getenv('TASK_WORKERS', 4))
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 5))
+TASK_RETRY_DELAY = int(os.getenv('TASK_RETRY_DELAY', 10))
+TASK_RETRY_MAX_DELAY = int(os.getenv('TASK_RETRY_MAX_DELAY', 3600))
+TASK_LEASE_SECONDS = int(os.getenv('TASK_LEASE_SECONDS', 300))
+TASK_RETENTION_DAYS = int(os.getenv('TASK_RETENTION_DAYS', 7))
+
+# Order confirmations are sent from the task worker; the console backend
+# prints them until an SMTP server is configured
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'orders@localhost')
+
+# Order-creating requests sent with an Idempotency-Key header are run once
+# per key (api.idempotency): a retry gets the stored response. Keys are kept
+# IDEMPOTENCY_KEY_TTL seconds (prune_idempotency_keys deletes them), and a
+# request that died holding its key releases it after IDEMPOTENCY_LOCK_SECONDS.
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 86400))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', 60))
 
 CORS_ALLOW_ALL_ORIGINS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 ALLOWED_HOSTS = ['*']
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    'api.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -82,6 +159,9 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
+# Log requests that repeat at least this many queries (likely N+1)
+REQUEST_METRICS_DUPLICATE_QUERY_WARNING = int(os.getenv('REQUEST_METRICS_DUPLICATE_QUERY_WARNING', 5))
+
 ROOT_URLCONF = 'backend.urls'
 
 TEMPLATES = [
@@ -106,23 +186,113 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    # 'default': {
-    #     'ENGINE': 'django.db.backends.postgresql',
-    #     'NAME': os.getenv('DB_NAME'),
-    #     'USER': os.getenv('DB_USER'),
-    #     'PASSWORD': os.getenv('DB_PASSWORD'),
-    #     'HOST': os.getenv('DB_HOST'),
-    #     'PORT': os.getenv('DB_PORT'),
-    # }
-
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE selects the database: 'sqlite' (the default, DB_NAME or
+# db.sqlite3 next to manage.py) or 'postgres' (DB_NAME, DB_USER, DB_PASSWORD,
+# DB_HOST, DB_PORT). Connections are kept open for DB_CONN_MAX_AGE seconds
+# (0 opens one per request) and checked before a request reuses them.
+#
+# Under ASGI (backend.asgi) the ORM runs in a different thread from request
+# to request, and connections are per thread: persistent ones are not
+# reused but pile up, one per worker thread. So the default there is 0; for
+# pooled connections put PgBouncer in front instead of raising it.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+SERVER_INTERFACE = os.getenv('DJANGO_SERVER_INTERFACE', 'wsgi')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 0 if SERVER_INTERFACE == 'asgi' else 60))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('DB_NAME'),
+            'USER': os.getenv('DB_USER'),
+            'PASSWORD': os.getenv('DB_PASSWORD'),
+            'HOST': os.getenv('DB_HOST'),
+            'PORT': os.getenv('DB_PORT'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5))},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # Seconds a write waits for the lock before "database is locked"
+            'OPTIONS': {'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 20))},
+        }
+    }
+
+# Read replicas (api.replicas): DB_REPLICAS lists their hosts (postgres) or
+# database files (sqlite), comma separated, with the primary's other settings.
+# Replica databases mirror the primary in tests.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(','))):
+    alias = f'replica_{number}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST' if DB_ENGINE == 'postgres' else 'NAME': replica.strip(),
+        'TEST': {'MIRROR': 'default'},
     }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Seconds an unreachable replica is skipped; the longest replication lag
+# allowed for (catalog responses read within it after a write are not
+# cached); and how long a customer who just placed an order reads their
+# orders from the primary. Replicas need a shared CACHE_BACKEND (api.checks).
+REPLICA_RETRY_SECONDS = int(os.getenv('REPLICA_RETRY_SECONDS', 30))
+REPLICA_MAX_LAG_SECONDS = int(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', REPLICA_MAX_LAG_SECONDS))
+
+# Run on every new SQLite connection (api.signals). WAL lets reads go on
+# while a write commits; synchronous=normal is safe under WAL.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'normal'),
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# CACHE_BACKEND selects the backend: 'locmem' (bounded in-process LRU, the
+# default, for a single process only), 'file' (shared between workers on one
+# host) or 'redis' (shared between hosts).
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', BASE_DIR / 'cache'),
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000))},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 5000))},
+        }
+    }
+
+# Catalog response cache (api.cache). Its version counters must be seen by
+# every worker, so it is on by default only with a shared CACHE_BACKEND, and
+# enabling it on locmem fails the system checks (api.checks).
+CATALOG_CACHE_ENABLED = os.getenv('CATALOG_CACHE_ENABLED', str(CACHE_BACKEND != 'locmem')).lower() == 'true'
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 300))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -142,6 +312,27 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/5.0/topics/auth/passwords/
+# PASSWORD_HASHING picks the hasher for new passwords: 'scrypt' (the
+# default), 'argon2' (needs argon2-cffi) or 'pbkdf2' (Django's default, about
+# five times slower to verify than scrypt). Passwords stored with one of the
+# others still verify, and are rehashed with the chosen one on login.
+# python manage.py benchmark_auth measures login throughput of each.
+
+PASSWORD_HASHING = os.getenv('PASSWORD_HASHING', 'scrypt')
+PASSWORD_HASHER_PROFILES = {
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [
+    PASSWORD_HASHER_PROFILES[PASSWORD_HASHING],
+    *(hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items() if profile != PASSWORD_HASHING),
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
@@ -160,6 +351,17 @@ USE_TZ = True
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles') 
 STATIC_URL = '/static/'
 
+# Outside DEBUG, collectstatic writes content-hashed copies plus gzip and
+# (with the Brotli package) brotli versions, which WhiteNoise serves with
+# far-future caching and content negotiation. Run collectstatic on deploy.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+        else 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
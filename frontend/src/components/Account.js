@@ -5,6 +5,7 @@ import { useNavigate } from "react-router-dom";
 function Account() {
     const [accountInfo, setAccountInfo] = useState({ user: {}, billing_address: "", shipping_address: "", credit_card_info: "" });
     const [orderHistory, setOrderHistory] = useState([]);
+    const [nextOrders, setNextOrders] = useState(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState("");
     const [openOrderId, setOpenOrderId] = useState(null);
@@ -16,7 +17,8 @@ function Account() {
             try {
                 const [accountRes, orderRes] = await Promise.all([axiosInstance.get("account/"), axiosInstance.get("orders/")]);
                 setAccountInfo(accountRes.data);
-                setOrderHistory(orderRes.data);
+                setOrderHistory(orderRes.data.results);
+                setNextOrders(orderRes.data.next);
                 setLoading(false);
             } catch (err) {
                 console.error("Error fetching data:", err);
@@ -31,6 +33,12 @@ function Account() {
         fetchData();
     }, [navigate]);
 
+    const loadMoreOrders = async () => {
+        const res = await axiosInstance.get(nextOrders);
+        setOrderHistory([...orderHistory, ...res.data.results]);
+        setNextOrders(res.data.next);
+    };
+
     const handleUpdate = async () => {
         const updateData = {
             billing_address: accountInfo.billing_address,
@@ -188,6 +196,9 @@ function Account() {
                             ))}
                         </tbody>
                     </table>
+                    {nextOrders && (
+                        <button className="btn btn-outline-primary" onClick={loadMoreOrders}>Load More Orders</button>
+                    )}
                 </div>
             ) : (
                 <p>No order history available.</p>
@@ -4,70 +4,54 @@ import axiosInstance from "../axiosInstance";
 import { Trash, PlusCircle, DashCircle } from 'react-bootstrap-icons';
 
 function Cart() {
-    const [cartItems, setCartItems] = useState([]);
-    const [total, setTotal] = useState(0);
+    const [cart, setCart] = useState({ lines: [], subtotal: "0.00", warnings: [] });
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
     const navigate = useNavigate();
 
     useEffect(() => {
-        fetchCartItems();
+        fetchCart();
     }, []);
 
-    useEffect(() => {
-        calculateTotal();
-    }, [cartItems]);
-
-    const fetchCartItems = () => {
+    // Totals and stock warnings come from the server
+    const fetchCart = () => {
         setLoading(true);
         axiosInstance
-            .get("cart/")
+            .get("cart/summary/")
             .then((res) => {
-                setCartItems(res.data || []); // Ensure it's always an array
+                setCart(res.data);
                 setError(null);
             })
             .catch((err) => {
                 console.error(err);
-                if (err.response && err.response.status === 204) {
-                    // Cart is empty
-                    setCartItems([]);
-                    setError(null);
-                } else {
-                    setError("Failed to load cart. Please try again.");
-                    setCartItems([]); // Set to empty array on error
-                }
+                setError("Failed to load cart. Please try again.");
             })
             .finally(() => {
                 setLoading(false);
             });
     };
 
-    const handleRemove = (itemId) => {
-        axiosInstance.delete(`cart/remove/${itemId}/`).then(() => {
-            fetchCartItems();
+    // Quantity 0 removes the line; the response is the updated cart
+    const updateCart = (productId, quantity) => {
+        axiosInstance.post("cart/batch/", { items: [{ product_id: productId, quantity }] }).then((res) => {
+            setCart(res.data);
         }).catch(err => {
-            console.error("Error removing item:", err);
-            setError("Failed to remove item. Please try again.");
+            console.error("Error updating cart:", err);
+            if (err.response && err.response.status === 409) {
+                setError(`${err.response.data.detail}. Only ${err.response.data.available} available.`);
+            } else {
+                setError("Failed to update cart. Please try again.");
+            }
         });
     };
 
-    const handleQuantityChange = (itemId, quantity) => {
-        if (quantity > 0) {
-            axiosInstance.put(`cart/update/${itemId}/`, { quantity }).then(() => {
-                fetchCartItems();
-            }).catch(err => {
-                console.error("Error updating quantity:", err);
-                setError("Failed to update quantity. Please try again.");
-            });
-        }
+    const handleRemove = (productId) => {
+        updateCart(productId, 0);
     };
 
-    const calculateTotal = () => {
-        if (Array.isArray(cartItems) && cartItems.length > 0) {
-            const sum = cartItems.reduce((acc, item) => acc + item.quantity * parseFloat(item.product.price), 0);
-            setTotal(sum.toFixed(2));
-        } else {
-            setTotal("0.00");
+    const handleQuantityChange = (productId, quantity) => {
+        if (quantity > 0) {
+            updateCart(productId, quantity);
         }
     };
 
@@ -90,7 +74,10 @@ function Cart() {
     return (
         <div className="container mt-5">
             <h2 className="mb-4">Your Cart</h2>
-            {cartItems.length > 0 ? (
+            {cart.warnings.map((warning) => (
+                <div key={warning.line} className="alert alert-warning">{warning.detail}</div>
+            ))}
+            {cart.lines.length > 0 ? (
                 <div>
                     <div className="table-responsive">
                         <table className="table table-hover">
@@ -104,11 +91,11 @@ function Cart() {
                                 </tr>
                             </thead>
                             <tbody>
-                                {cartItems.map((item) => (
+                                {cart.lines.map((item) => (
                                     <tr key={item.id}>
                                         <td>
                                             <img 
-                                                src={`http://localhost:8000${item.product.image}`} 
+                                                src={`http://localhost:8000${item.product.image_variants?.thumb || item.product.image}`} 
                                                 alt={item.product.name} 
                                                 className="img-thumbnail me-2" 
                                                 style={{ width: "50px", height: "50px", objectFit: "contain" }} 
@@ -120,7 +107,7 @@ function Cart() {
                                             <div className="btn-group" role="group">
                                                 <button 
                                                     className="btn btn-outline-secondary btn-sm" 
-                                                    onClick={() => handleQuantityChange(item.id, item.quantity - 1)}
+                                                    onClick={() => handleQuantityChange(item.product.id, item.quantity - 1)}
                                                     disabled={item.quantity <= 1}
                                                 >
                                                     <DashCircle />
@@ -130,16 +117,16 @@ function Cart() {
                                                 </span>
                                                 <button 
                                                     className="btn btn-outline-secondary btn-sm" 
-                                                    onClick={() => handleQuantityChange(item.id, item.quantity + 1)}
-                                                    disabled={item.quantity >= item.product.inventory_quantity}
+                                                    onClick={() => handleQuantityChange(item.product.id, item.quantity + 1)}
+                                                    disabled={item.quantity >= item.available}
                                                 >
                                                     <PlusCircle />
                                                 </button>
                                             </div>
                                         </td>
-                                        <td>${formatPrice(item.quantity * item.product.price)}</td>
+                                        <td>${item.line_total}</td>
                                         <td>
-                                            <button className="btn btn-danger btn-sm" onClick={() => handleRemove(item.id)}>
+                                            <button className="btn btn-danger btn-sm" onClick={() => handleRemove(item.product.id)}>
                                                 <Trash />
                                             </button>
                                         </td>
@@ -149,7 +136,7 @@ function Cart() {
                         </table>
                     </div>
                     <div className="text-end">
-                        <h4>Total: ${total}</h4>
+                        <h4>Total: ${cart.subtotal}</h4>
                         <button className="btn btn-primary" onClick={checkout}>Proceed to Checkout</button>
                     </div>
                 </div>
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import axiosInstance from "../axiosInstance";
 
@@ -15,6 +15,8 @@ function Checkout() {
     const [total, setTotal] = useState(0);
     const [error, setError] = useState("");
     const [saveDetails, setSaveDetails] = useState(false);
+    // One key per checkout: a retried or double-submitted request places one order
+    const idempotencyKey = useRef(crypto.randomUUID());
     const navigate = useNavigate();
 
     useEffect(() => {
@@ -86,7 +88,9 @@ function Checkout() {
         };
 
         axiosInstance
-            .post("checkout/", orderData)
+            .post("checkout/", orderData, {
+                headers: { "Idempotency-Key": idempotencyKey.current },
+            })
             .then((res) => {
                 const orderSummary = {
                     ...res.data,
@@ -104,6 +108,8 @@ function Checkout() {
                 console.error("Checkout error:", err);
                 if (err.response && err.response.status === 402) {
                     setError("Credit Card Authorization Failed.");
+                } else if (err.response && err.response.status === 409) {
+                    setError("Your order is still being placed. Please wait a moment.");
                 } else {
                     setError("An error occurred during checkout. Please try again.");
                 }
@@ -35,7 +35,7 @@ function ProductDetail() {
         ])
         .then(([productRes, reviewsRes, cartRes]) => {
             setProduct(productRes.data);
-            setReviews(reviewsRes.data);
+            setReviews(reviewsRes.data.results);
             
             if (Array.isArray(cartRes.data)) {
                 const cartItem = cartRes.data.find(item => item.product.id === parseInt(id));
@@ -149,7 +149,7 @@ function ProductDetail() {
             <div className="row">
                 <div className="col-md-6">
                     <img 
-                        src={`http://localhost:8000${product.image}`} 
+                        src={`http://localhost:8000${product.image_variants?.large || product.image}`} 
                         alt={product.name} 
                         className="product-image"
                     />
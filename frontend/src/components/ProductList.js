@@ -5,33 +5,49 @@ import { Star, StarHalf, StarFill } from 'react-bootstrap-icons';
 
 function ProductList() {
     const [products, setProducts] = useState([]);
+    const [nextPage, setNextPage] = useState(null);
     const [category, setCategory] = useState("");
     const [search, setSearch] = useState("");
     const [sort, setSort] = useState("");
-    const [categories, setCategories] = useState([]);
-
-    useEffect(() => {
-        axiosInstance.get("categories/").then((res) => {
-            setCategories(res.data);
-        });
-    }, []);
+    const [priceRange, setPriceRange] = useState("");
+    const [minRating, setMinRating] = useState("");
+    const [facets, setFacets] = useState({ categories: [], price: [], rating: [] });
 
     const fetchProducts = () => {
-        let query = "products/filter/";
         let params = [];
-        if (category) params.push(`category=${category}`);
-        if (search) params.push(`search=${search}`);
+        if (category) params.push(`category=${encodeURIComponent(category)}`);
+        if (search) params.push(`search=${encodeURIComponent(search)}`);
+        if (priceRange) params.push(priceRange);
+        if (minRating) params.push(`min_rating=${minRating}`);
+        const filters = params.join("&");
         if (sort) params.push(`sort_by=${sort}`);
-        if (params.length > 0) query += "?" + params.join("&");
 
-        axiosInstance.get(query).then((res) => {
-            setProducts(res.data);
+        axiosInstance.get("products/filter/?" + params.join("&")).then((res) => {
+            setProducts(res.data.results);
+            setNextPage(res.data.next);
+        });
+        // Counts for the filter menus, for the same search and filters
+        axiosInstance.get("products/facets/?" + filters).then((res) => {
+            setFacets(res.data);
+        });
+    };
+
+    const priceParams = (bucket) =>
+        `min_price=${bucket.min_price}` + (bucket.max_price === null ? "" : `&max_price=${bucket.max_price}`);
+
+    const priceLabel = (bucket) =>
+        bucket.max_price === null ? `$${bucket.min_price}+` : `$${bucket.min_price} - $${bucket.max_price}`;
+
+    const loadMore = () => {
+        axiosInstance.get(nextPage).then((res) => {
+            setProducts([...products, ...res.data.results]);
+            setNextPage(res.data.next);
         });
     };
 
     useEffect(() => {
         fetchProducts();
-    }, [category, sort]);
+    }, [category, sort, priceRange, minRating]);
 
     const handleSubmit = (e) => {
         e.preventDefault();
@@ -76,24 +92,41 @@ function ProductList() {
                     <div className="col-md-3">
                         <select className="form-select" value={category} onChange={(e) => setCategory(e.target.value)}>
                             <option value="">All Categories</option>
-                            {categories.map((cat) => (
-                                <option key={cat} value={cat}>{cat}</option>
+                            {facets.categories.map((facet) => (
+                                <option key={facet.category} value={facet.category}>{facet.category} ({facet.count})</option>
+                            ))}
+                        </select>
+                    </div>
+                    <div className="col-md-2">
+                        <select className="form-select" value={priceRange} onChange={(e) => setPriceRange(e.target.value)}>
+                            <option value="">Any Price</option>
+                            {facets.price.filter((bucket) => bucket.count > 0 || priceParams(bucket) === priceRange).map((bucket) => (
+                                <option key={bucket.min_price} value={priceParams(bucket)}>{priceLabel(bucket)} ({bucket.count})</option>
+                            ))}
+                        </select>
+                    </div>
+                    <div className="col-md-2">
+                        <select className="form-select" value={minRating} onChange={(e) => setMinRating(e.target.value)}>
+                            <option value="">Any Rating</option>
+                            {facets.rating.map((bucket) => (
+                                <option key={bucket.min_rating} value={bucket.min_rating}>{bucket.min_rating}+ stars ({bucket.count})</option>
                             ))}
                         </select>
                     </div>
-                    <div className="col-md-4">
+                    <div className="col-md-2">
                         <input type="text" className="form-control" value={search} onChange={(e) => setSearch(e.target.value)} placeholder="Search" />
                     </div>
-                    <div className="col-md-3">
+                    <div className="col-md-2">
                         <select className="form-select" value={sort} onChange={(e) => setSort(e.target.value)}>
                             <option value="">Sort By</option>
                             <option value="price_asc">Price: Low to High</option>
                             <option value="price_desc">Price: High to Low</option>
                             <option value="name_asc">Name: A-Z</option>
                             <option value="name_desc">Name: Z-A</option>
+                            <option value="rating_desc">Rating: High to Low</option>
                         </select>
                     </div>
-                    <div className="col-md-2">
+                    <div className="col-md-1">
                         <button type="submit" className="btn btn-primary w-100">Search</button>
                     </div>
                 </div>
@@ -103,7 +136,7 @@ function ProductList() {
                     <div key={product.id} className="col">
                         <div className={`card h-100 ${product.inventory_quantity === 0 ? 'text-muted' : ''}`}>
                             <img 
-                                src={`http://localhost:8000${product.image}`} 
+                                src={`http://localhost:8000${product.image_variants?.medium || product.image}`} 
                                 className="card-img-top" 
                                 alt={product.name} 
                                 style={{ 
@@ -134,6 +167,11 @@ function ProductList() {
                 ))}
             
             </div>
+            {nextPage && (
+                <div className="text-center my-4">
+                    <button className="btn btn-outline-primary" onClick={loadMore}>Load More</button>
+                </div>
+            )}
         </div>
     );
 }